@@ -0,0 +1,167 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import zlib
+import collections
+import subprocess
+import concurrent.futures
+
+from .utils import fatal
+
+ArchiveFormat = collections.namedtuple('ArchiveFormat',
+                                       ['suffix', 'default_level', 'min_level', 'max_level'])
+
+# Compressed tarball formats for generated upstream sources.  rpm's
+# %setup picks the decompressor from the file suffix.
+ARCHIVE_FORMATS = {
+    'gz': ArchiveFormat('.tar.gz', 6, 1, 9),
+    'xz': ArchiveFormat('.tar.xz', 6, 0, 9),
+    'zst': ArchiveFormat('.tar.zst', 3, 1, 19),
+}
+
+def default_threads():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def archive_settings(config):
+    """Validate an 'archive' mapping from overlay.yml, returning
+    (format, level) with defaults filled in."""
+    for key in config:
+        if key not in ['format', 'level']:
+            fatal("Unknown key {0} in archive: {1}".format(key, config))
+    fmt = config.get('format', 'gz')
+    info = ARCHIVE_FORMATS.get(fmt)
+    if info is None:
+        fatal("Unknown archive format {0}; expected one of: {1}".format(fmt, ' '.join(sorted(ARCHIVE_FORMATS))))
+    level = config.get('level', info.default_level)
+    if not isinstance(level, int) or not (info.min_level <= level <= info.max_level):
+        fatal("Invalid {0} compression level {1}; expected {2}-{3}".format(fmt, level, info.min_level,
+                                                                           info.max_level))
+    return (fmt, level)
+
+class ParallelGzipWriter(object):
+    """A writable file object producing gzip output, compressing
+    fixed-size chunks on a thread pool (zlib releases the GIL).
+
+    Each chunk becomes its own gzip member; gzip(1), and therefore
+    rpmbuild, decompresses the concatenation transparently.  Since the
+    chunking doesn't depend on the number of threads and no name or
+    timestamp is recorded, the output depends only on the input and
+    level.
+    """
+    def __init__(self, fileobj, level=6, threads=1, chunk_size=4 << 20):
+        self.fileobj = fileobj
+        self.level = level
+        self.chunk_size = chunk_size
+        self._buf = []
+        self._buflen = 0
+        self._executor = concurrent.futures.ThreadPoolExecutor(max(1, threads))
+        # Bound memory use by limiting chunks in flight
+        self._max_pending = max(1, threads) * 2
+        self._pending = collections.deque()
+        self.closed = False
+
+    def _compress(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def _drain(self, max_pending):
+        while len(self._pending) > max_pending:
+            self.fileobj.write(self._pending.popleft().result())
+
+    def _submit(self, data):
+        self._pending.append(self._executor.submit(self._compress, data))
+        self._drain(self._max_pending)
+
+    def write(self, data):
+        written = len(data)
+        self._buf.append(bytes(data))
+        self._buflen += written
+        if self._buflen >= self.chunk_size:
+            data = b''.join(self._buf)
+            offset = 0
+            while len(data) - offset >= self.chunk_size:
+                self._submit(data[offset:offset+self.chunk_size])
+                offset += self.chunk_size
+            self._buf = [data[offset:]]
+            self._buflen = len(data) - offset
+        return written
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            # An empty input still yields one (empty) member
+            if self._buflen > 0 or len(self._pending) == 0:
+                self._submit(b''.join(self._buf))
+            self._drain(0)
+        finally:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+class PipeCompressWriter(object):
+    """A writable file object feeding an external compressor whose
+    output goes to @fileobj."""
+    def __init__(self, argv, fileobj):
+        self.argv = argv
+        self._proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=fileobj)
+        self.closed = False
+
+    def write(self, data):
+        return self._proc.stdin.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._proc.stdin.close()
+        if self._proc.wait() != 0:
+            fatal("{0} exited with code {1}".format(self.argv[0], self._proc.returncode))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+def compress_writer(fmt, level, fileobj, threads=1):
+    """Return a writable file object which compresses into the real
+    file @fileobj in the archive format @fmt."""
+    if fmt == 'gz':
+        return ParallelGzipWriter(fileobj, level=level, threads=threads)
+    elif fmt == 'xz':
+        # Multithreaded xz splits the input into blocks by size, so the
+        # output doesn't depend on the thread count; but a single
+        # thread selects a different encoder, so never ask for one.
+        return PipeCompressWriter(['xz', '-c', '-{0}'.format(level),
+                                   '-T{0}'.format(max(2, threads))], fileobj)
+    elif fmt == 'zst':
+        return PipeCompressWriter(['zstd', '-q', '-c', '-{0}'.format(level),
+                                   '-T{0}'.format(threads)], fileobj)
+    else:
+        fatal("Unknown archive format {0}".format(fmt))
@@ -0,0 +1,117 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import re
+import shutil
+import tempfile
+import http.server
+import socketserver
+
+from .utils import ensuredir
+
+# Entries are /<xx>/<key>.tar, where key is a sha256 hex digest
+_entry_path_re = re.compile(r'^/([0-9a-f]{2})/(\1[0-9a-f]{62})\.tar$')
+
+class ArtifactRequestHandler(http.server.BaseHTTPRequestHandler):
+    """GET, HEAD and PUT of artifact cache entries.  An entry is
+    immutable once stored: a PUT of an existing key is accepted, but
+    keeps the first upload."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):
+        if not self.server.quiet:
+            http.server.BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    def _entry_path(self):
+        m = _entry_path_re.match(self.path)
+        if m is None:
+            self.send_error(404)
+            return None
+        return '{0}/{1}/{2}.tar'.format(self.server.root, m.group(1), m.group(2))
+
+    def _send_entry(self, with_body):
+        path = self._entry_path()
+        if path is None:
+            return
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            self.send_error(404)
+            return
+        with f:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-tar')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.end_headers()
+            if with_body:
+                shutil.copyfileobj(f, self.wfile)
+
+    def do_GET(self):
+        self._send_entry(True)
+
+    def do_HEAD(self):
+        self._send_entry(False)
+
+    def do_PUT(self):
+        path = self._entry_path()
+        if path is None:
+            return
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.send_error(411)
+            return
+        remaining = int(length)
+        ensuredir(os.path.dirname(path))
+        (fd, tmppath) = tempfile.mkstemp('.tmp', '', os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                while remaining > 0:
+                    buf = self.rfile.read(min(remaining, 1 << 20))
+                    if not buf:
+                        break
+                    f.write(buf)
+                    remaining -= len(buf)
+            if remaining > 0:
+                self.close_connection = True
+                self.send_error(400, 'Truncated upload')
+                return
+            os.chmod(tmppath, 0o644)
+            if not os.path.exists(path):
+                os.rename(tmppath, path)
+        finally:
+            if os.path.exists(tmppath):
+                os.unlink(tmppath)
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+class ArtifactServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """A reference artifact cache server storing entries under @root;
+    mainly for testing, or small setups on a trusted network."""
+    daemon_threads = True
+
+    def __init__(self, address, root, quiet=False):
+        http.server.HTTPServer.__init__(self, address, ArtifactRequestHandler)
+        self.root = os.path.abspath(root)
+        self.quiet = quiet
+        ensuredir(self.root)
+
+    @property
+    def url(self):
+        (host, port) = self.server_address[0:2]
+        return 'http://{0}:{1}'.format(host, port)
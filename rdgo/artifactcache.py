@@ -0,0 +1,208 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import re
+import stat
+import hashlib
+import tarfile
+import tempfile
+import subprocess
+import urllib.error
+import urllib.request
+
+from . import trace
+from .utils import log, rmrf
+from .dircache import DirCache, json_digest
+
+# Bump this whenever what goes into a key changes meaning
+ARTIFACT_KEY_VERSION = 2
+
+def tree_digest(path, exclude=('.git',)):
+    """Digest of the names, types, executable bits and contents of
+    everything under @path; names in @exclude are skipped at every
+    level."""
+    h = hashlib.sha256()
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        dirnames[:] = sorted(name for name in dirnames if name not in exclude)
+        for name in sorted(dirnames + [name for name in filenames if name not in exclude]):
+            fullpath = os.path.join(dirpath, name)
+            relpath = os.path.relpath(fullpath, path)
+            stbuf = os.lstat(fullpath)
+            h.update(relpath.encode('UTF-8', 'surrogateescape') + b'\0')
+            if stat.S_ISLNK(stbuf.st_mode):
+                h.update(b'l' + os.readlink(fullpath).encode('UTF-8', 'surrogateescape') + b'\0')
+            elif stat.S_ISDIR(stbuf.st_mode):
+                h.update(b'd\0')
+            else:
+                h.update(b'x' if stbuf.st_mode & stat.S_IXUSR else b'f')
+                with open(fullpath, 'rb') as f:
+                    while True:
+                        buf = f.read(1 << 20)
+                        if not buf:
+                            break
+                        h.update(buf)
+                h.update(b'\0')
+    return h.hexdigest()
+
+
+_mock_include_re = re.compile(r'''^\s*include\(\s*['"]([^'"]+)['"]\s*\)''', re.MULTILINE)
+
+def mock_config_text(root, configdir='/etc/mock'):
+    """The configuration mock uses for @root (a .cfg path or a root
+    name): its text, that of the templates it include()s, and that of
+    the site defaults it is combined with."""
+    if os.path.isfile(root):
+        path = os.path.abspath(root)
+    else:
+        path = '{0}/{1}.cfg'.format(configdir, root)
+    texts = []
+    seen = set()
+
+    def add(config):
+        # Like mock, resolve relative includes against the config dir
+        config = os.path.join(configdir, config)
+        if config in seen:
+            return
+        seen.add(config)
+        try:
+            with open(config) as f:
+                text = f.read()
+        except IOError:
+            texts.append(None)
+            return
+        texts.append(text)
+        for include in _mock_include_re.findall(text):
+            add(include)
+    add(path)
+    add('site-defaults.cfg')
+    return texts
+
+def copy_tree_linked(src, dest):
+    """Hardlink @src to @dest, falling back to a copy if they are on
+    different filesystems."""
+    try:
+        subprocess.check_call(['cp', '-al', src, dest], stderr=subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        rmrf(dest)
+        subprocess.check_call(['cp', '-a', '--reflink=auto', src, dest])
+
+def artifact_key(srcsnap_dir, mock_config, component, srpmroot_keys=None):
+    """Digest of the inputs of building @component from @srcsnap_dir
+    with the mock configuration @mock_config (see mock_config_text()),
+    in a root which also has the srpmroot packages installed whose
+    artifact keys, by package name, are @srpmroot_keys."""
+    return json_digest({'version': ARTIFACT_KEY_VERSION,
+                        'srcsnap': tree_digest(srcsnap_dir),
+                        'mock-config': mock_config,
+                        'srpmroot': bool(component.get('srpmroot')),
+                        'srpmroot-packages': srpmroot_keys or {},
+                        'rpmwith': component.get('rpmwith', []),
+                        'rpmwithout': component.get('rpmwithout', []),
+                        'rpmbuildopts': component.get('rpmbuildopts', []),
+                        'build-network': component.get('build-network', False)})
+
+class ArtifactCache(DirCache):
+    """Successful build results, shared between all the workdirs on a
+    host and keyed by the inputs of the build: the content of the
+    srcsnap, the mock configuration and the build options."""
+    def __init__(self, path, max_bytes=0):
+        DirCache.__init__(self, path, max_bytes=max_bytes, copy_tree=copy_tree_linked)
+
+    def copy_out(self, key, dest):
+        # The entry may be evicted by another workdir while we copy
+        try:
+            return DirCache.copy_out(self, key, dest)
+        except subprocess.CalledProcessError as e:
+            log("Failed to copy artifact cache entry {0}: {1}".format(key, e))
+            rmrf(dest)
+            return False
+
+
+# Where supported, also have tarfile itself refuse anything unsafe
+_extract_args = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+
+def _safe_member(member):
+    """Only plain files, directories and relative symlinks staying
+    inside the entry may be unpacked."""
+    name = os.path.normpath(member.name)
+    if name.startswith(('/', '..')):
+        return False
+    if member.issym():
+        target = os.path.normpath(os.path.join(os.path.dirname(name), member.linkname))
+        return not (member.linkname.startswith('/') or target.startswith('..'))
+    return member.isfile() or member.isdir()
+
+class RemoteArtifactCache(object):
+    """Build results shared between hosts through an HTTP server (see
+    artifact_server.py): each entry is an uncompressed tarball of a
+    build's result directory, fetched with GET from
+    <url>/<xx>/<key>.tar and uploaded with PUT.
+
+    The cache is an optimization, so network and server errors are
+    logged and treated as misses.
+    """
+    def __init__(self, url, timeout=60):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _entry_url(self, key):
+        return '{0}/{1}/{2}.tar'.format(self.url, key[0:2], key)
+
+    def fetch(self, key, dest):
+        """Unpack the entry for @key into the new directory @dest;
+        returns False on a miss."""
+        parent = os.path.dirname(dest)
+        tmpdir = tempfile.mkdtemp('.tmp', os.path.basename(dest), parent)
+        try:
+            with trace.span('artifact download', url=self._entry_url(key)):
+                with urllib.request.urlopen(self._entry_url(key), timeout=self.timeout) as resp:
+                    with tarfile.open(fileobj=resp, mode='r|') as tar:
+                        for member in tar:
+                            if not _safe_member(member):
+                                raise tarfile.TarError("Unsafe member {0}".format(member.name))
+                            tar.extract(member, tmpdir, set_attrs=not member.issym(), **_extract_args)
+            os.rename(tmpdir, dest)
+            return True
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                log("Failed to fetch {0}: {1}".format(self._entry_url(key), e))
+            return False
+        except (urllib.error.URLError, tarfile.TarError, IOError, OSError) as e:
+            log("Failed to fetch {0}: {1}".format(self._entry_url(key), e))
+            return False
+        finally:
+            rmrf(tmpdir)
+
+    def store(self, key, srcdir):
+        """Upload @srcdir as the entry for @key; returns success."""
+        with trace.span('artifact upload', url=self._entry_url(key)), tempfile.TemporaryFile() as f:
+            with tarfile.open(fileobj=f, mode='w', format=tarfile.GNU_FORMAT) as tar:
+                for name in sorted(os.listdir(srcdir)):
+                    tar.add(srcdir + '/' + name, arcname=name)
+            size = f.tell()
+            f.seek(0)
+            request = urllib.request.Request(self._entry_url(key), data=f, method='PUT',
+                                             headers={'Content-Type': 'application/x-tar',
+                                                      'Content-Length': str(size)})
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+                    resp.read()
+            except (urllib.error.URLError, IOError, OSError) as e:
+                log("Failed to upload {0}: {1}".format(self._entry_url(key), e))
+                return False
+        return True
@@ -19,9 +19,11 @@ import os
 import yaml
 import copy
 
-from .utils import fatal, convert_key_pair_into_commands
+from .utils import fatal, convert_key_pair_into_commands, lock_file
 from .task import Task
+from .archive import archive_settings
 from .git import GitRemote, GitMirror
+from .jobs import JobPool
 
 def require_key(conf, key):
     try:
@@ -35,6 +37,7 @@ class BaseTaskResolve(Task):
         self._valid_source_htypes = ['md5']
         self._overlay = None
         self._distgit_prefix = None
+        self.mirror = None
 
     def _url_to_projname(self, url):
         rcolon = url.rfind(':')
@@ -82,7 +85,7 @@ class BaseTaskResolve(Task):
         for key in component:
             if key not in ['src', 'name', 'spec', 'distgit', 'tag', 'branch', 'freeze', 'self-buildrequires',
                            'rpmwith', 'rpmwithout', 'srpmroot', 'override-version', 'defines',
-                           'build-network']:
+                           'build-network', 'archive']:
                 fatal("Unknown key {0} in component: {1}".format(key, component))
         # 'src' and 'distgit' mappings
         src = component.get('src')
@@ -149,12 +152,23 @@ class BaseTaskResolve(Task):
             if key not in ['patches', 'src', 'name', 'tag', 'branch', 'freeze']:
                 fatal("Unknown key {0} in component/distgit: {1}".format(key, component))
 
+        # Fail early on bad compression settings
+        self._component_archive(component)
+
         # rpmbuild --with and --without
         self._ensure_key_or(component, 'rpmwith', [])
         self._ensure_key_or(component, 'rpmwithout', [])
         self._ensure_key_or(component, 'rpmbuildopts', [])
         self._ensure_key_or(component, 'pkgname', pkgname_default)
 
+    def _component_archive(self, component):
+        """Return the (format, level) for the component's generated
+        upstream tarball; the overlay-wide 'archive' settings may be
+        overridden per component."""
+        config = dict(self._archive)
+        config.update(component.get('archive') or {})
+        return archive_settings(config)
+
     def _load_overlay(self):
         self.srcdir = self.workdir + '/src'
         self.mirror = GitMirror(self.srcdir)
@@ -170,19 +184,28 @@ class BaseTaskResolve(Task):
 
         self._distgit = require_key(self._overlay, 'distgit')
         self._distgit_prefix = require_key(self._distgit, 'prefix')
+        self._archive = self._overlay.get('archive', {})
+
+    def _lock_srcdir(self, exclusive=False, blocking=True):
+        """Lock src/ against garbage collection: resolve holds a shared
+        lock for as long as it runs, gc an exclusive one."""
+        return lock_file(self.srcdir + '/.lock', exclusive=exclusive, blocking=blocking)
 
     def _expand_overlay(self, fetchall=False, fetch=[],
                         parent_mirror=None,
                         override_giturl=None,
                         override_gitbranch=None,
                         override_gitrepo_from=None,
-                        override_gitrepo_from_rev=None):
+                        override_gitrepo_from_rev=None,
+                        jobs=1, probe_jobs=0):
 
         assert override_gitbranch is None or override_gitrepo_from is None
         assert (override_gitrepo_from is None) == (override_gitrepo_from_rev is None)
 
         expanded = copy.deepcopy(self._overlay)
         found_overrides = []
+        # Each entry is (dict to store 'revision' in, remote, ref, fetch)
+        mirror_requests = []
         for component in expanded['components']:
             self._expand_component(component)
             src = component.get('src')
@@ -202,17 +225,35 @@ class BaseTaskResolve(Task):
             do_fetch = is_overridden or fetchall or (component['name'] in fetch)
             src = component.get('src')
             if src is not None:
-                revision = self.mirror.mirror(src, ref, fetch=do_fetch,
-                                              parent_mirror=parent_mirror)
-                component['revision'] = revision
+                mirror_requests.append((component, src, ref, do_fetch))
 
             distgit = component.get('distgit')
             if distgit is not None:
                 ref = self._one_of_keys(distgit, 'freeze', 'branch', 'tag')
                 do_fetch = fetchall or (distgit['name'] in fetch)
-                revision = self.mirror.mirror(distgit['src'], ref, fetch=do_fetch,
-                                              parent_mirror=parent_mirror)
-                distgit['revision'] = revision
+                mirror_requests.append((distgit, distgit['src'], ref, do_fetch))
+
+        # Only fetch repositories whose upstream refs actually moved;
+        # probing is far cheaper than a fetch's negotiation.
+        to_probe = [i for (i, request) in enumerate(mirror_requests) if request[3]]
+        if probe_jobs > 0 and parent_mirror is None and len(to_probe) > 0:
+            changed = self.mirror.probe_many([mirror_requests[i][1:3] for i in to_probe], jobs=probe_jobs)
+            for (i, do_fetch) in zip(to_probe, changed):
+                mirror_requests[i] = mirror_requests[i][0:3] + (do_fetch,)
+
+        def do_mirror(request):
+            (_, remote, ref, do_fetch) = request
+            return self.mirror.mirror(remote, ref, fetch=do_fetch,
+                                      parent_mirror=parent_mirror)
+
+        # Mirroring is dominated by network round trips, so run it
+        # through a thread pool; results come back in request order.
+        # Submodules are mirrored through the same pool, which bounds
+        # the concurrency of the whole recursion.
+        self.mirror.pool = JobPool(jobs)
+        revisions = self.mirror.pool.map(do_mirror, mirror_requests)
+        for ((target, _, _, _), revision) in zip(mirror_requests, revisions):
+            target['revision'] = revision
 
         if override_giturl is not None:
             if len(found_overrides) == 0:
@@ -226,14 +267,12 @@ class BaseTaskResolve(Task):
 
         return expanded
 
-    def _find_spec(self, upstream_co):
-        basename = os.path.basename(upstream_co)
-        candidates = []
-        for (dirpath, dirnames, filenames) in os.walk(upstream_co):
-            for fname in filenames:
-                if not fname.endswith(('.spec', '.spec.in')):
-                    continue
-                candidates.append(dirpath + '/' + fname)
+    def _find_spec(self, basename, paths):
+        """Pick the spec file for project @basename from the file
+        @paths of its source tree."""
+        # Prefer files closer to the top, as a directory walk would
+        candidates = sorted((path for path in paths if path.endswith(('.spec', '.spec.in'))),
+                            key=lambda path: (path.count('/'), path))
         if len(candidates) == 0:
             return None
         firstcanddiate = candidates[0]
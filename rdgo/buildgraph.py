@@ -0,0 +1,152 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+class BuildGraph(object):
+    """Build-order dependencies between a set of packages.
+
+    Nodes are arbitrary hashable keys, kept in their input order;
+    deps[key] is the set of nodes that must be built before key.
+    """
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+        self._index = dict((node, i) for (i, node) in enumerate(self.nodes))
+        self.deps = dict((node, set()) for node in self.nodes)
+        # Nodes which BuildRequire something they provide themselves
+        self.self_deps = []
+        # Lists of nodes whose mutual dependencies were dropped
+        self.cycles = []
+
+    @classmethod
+    def from_requires(cls, nodes, buildrequires, provides):
+        """Create a graph where a node depends on every other node
+        providing one of its BuildRequires.  @buildrequires and
+        @provides map each node to an iterable of names."""
+        graph = cls(nodes)
+        providers = {}
+        for node in graph.nodes:
+            for name in provides.get(node, ()):
+                providers.setdefault(name, []).append(node)
+        for node in graph.nodes:
+            for name in buildrequires.get(node, ()):
+                for provider in providers.get(name, ()):
+                    if provider == node:
+                        if node not in graph.self_deps:
+                            graph.self_deps.append(node)
+                        continue
+                    graph.deps[node].add(provider)
+        graph.break_cycles()
+        return graph
+
+    def _strongly_connected(self):
+        """Tarjan's algorithm, iteratively; returns components with more
+        than one node, each in input order."""
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        counter = [0]
+        result = []
+        for start in self.nodes:
+            if start in index:
+                continue
+            work = [(start, iter(sorted(self.deps[start], key=self._index.get)))]
+            index[start] = lowlink[start] = counter[0]
+            counter[0] += 1
+            stack.append(start)
+            on_stack.add(start)
+            while work:
+                (node, children) = work[-1]
+                advanced = False
+                for child in children:
+                    if child not in index:
+                        index[child] = lowlink[child] = counter[0]
+                        counter[0] += 1
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(sorted(self.deps[child], key=self._index.get))))
+                        advanced = True
+                        break
+                    elif child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                if advanced:
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1:
+                        result.append(sorted(component, key=self._index.get))
+        return result
+
+    def break_cycles(self):
+        """Drop dependency edges within each cycle; the members of a
+        cycle are then built in input order."""
+        for component in self._strongly_connected():
+            members = set(component)
+            for node in component:
+                self.deps[node] -= members
+            self.cycles.append(component)
+
+    def order(self):
+        """A topological order of all nodes, preferring input order
+        among nodes whose dependencies are satisfied."""
+        remaining = dict((node, set(self.deps[node])) for node in self.nodes)
+        result = []
+        done = set()
+        while remaining:
+            for node in self.nodes:
+                if node in remaining and remaining[node] <= done:
+                    break
+            else:
+                raise ValueError("Dependency cycle among: {0}".format(list(remaining)))
+            del remaining[node]
+            done.add(node)
+            result.append(node)
+        return result
+
+    def transitive_deps(self, node):
+        """Everything @node depends on, directly or indirectly."""
+        seen = set()
+        pending = list(self.deps[node])
+        while pending:
+            dep = pending.pop()
+            if dep in seen:
+                continue
+            seen.add(dep)
+            pending.extend(self.deps[dep])
+        return seen
+
+    def critical_paths(self, cost):
+        """For each node, the largest total @cost (a function of a node)
+        along any chain of builds starting with it and ending with
+        something that transitively depends on it."""
+        dependents = dict((node, []) for node in self.nodes)
+        for node in self.nodes:
+            for dep in self.deps[node]:
+                dependents[dep].append(node)
+        result = {}
+        for node in reversed(self.order()):
+            result[node] = cost(node) + max([result[d] for d in dependents[node]] or [0])
+        return result
@@ -0,0 +1,155 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import json
+import time
+import errno
+import tempfile
+import threading
+import contextlib
+import collections
+
+from . import trace
+from .utils import log
+
+# Recent builds of a component that its estimate is averaged over
+HISTORY_LENGTH = 5
+# Assumed duration of a build when no component has any history yet
+DEFAULT_ESTIMATE = 600
+
+def component_name(filename):
+    """The component a srcsnap directory or srpm was built from; its
+    name without version-release, e.g. foo for foo-1.0-1.srcsnap/."""
+    name = os.path.basename(filename.rstrip('/'))
+    for suffix in ['.srcsnap', '.src.rpm']:
+        if name.endswith(suffix):
+            name = name[0:-len(suffix)]
+    return name.rsplit('-', 2)[0]
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return '{0}h{1:02d}m'.format(seconds // 3600, (seconds % 3600) // 60)
+    elif seconds >= 60:
+        return '{0}m{1:02d}s'.format(seconds // 60, seconds % 60)
+    return '{0}s'.format(seconds)
+
+class PhaseTimer(object):
+    """Accumulates the wall time spent in each phase of one build; each
+    phase is also traced."""
+    def __init__(self):
+        self.phases = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            with trace.span(name, cat='build'):
+                yield
+        finally:
+            self.add(name, time.time() - start)
+
+    def add(self, name, seconds):
+        """Count @seconds spent in phase @name, timed elsewhere."""
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+class BuildTimes(object):
+    """Wall times of past successful builds, per component, kept as
+    JSON in @path: the phases of the last build (e.g. srpm, chroot,
+    rpmbuild, createrepo) and the totals of the last few."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._components = {}
+        try:
+            with open(path) as f:
+                self._components = json.load(f).get('components', {})
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError as e:
+            log("Ignoring invalid build times in {0}: {1}".format(path, e))
+
+    def record(self, name, phases):
+        with self._lock:
+            entry = self._components.setdefault(name, {'history': []})
+            entry['phases'] = dict((phase, round(t, 1)) for (phase, t) in phases.items())
+            entry['history'] = (entry['history'] + [round(sum(phases.values()), 1)])[-HISTORY_LENGTH:]
+            self._save()
+
+    def _save(self):
+        """Called with _lock held"""
+        (fd, tmppath) = tempfile.mkstemp('.tmp', os.path.basename(self.path), os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'components': self._components}, f, sort_keys=True, indent=2)
+            os.rename(tmppath, self.path)
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+
+    def estimate(self, name):
+        """Average recent build time of @name, or None if unknown."""
+        with self._lock:
+            history = self._components.get(name, {}).get('history')
+            if not history:
+                return None
+            return sum(history) / float(len(history))
+
+    def estimates(self, names):
+        """Return a dict of estimates for @names.  Components never
+        built before are assumed to take as long as the median of all
+        known ones."""
+        known = sorted(t for t in map(self.estimate, list(self._components)) if t is not None)
+        if len(known) > 0:
+            default = known[len(known) // 2]
+        else:
+            default = DEFAULT_ESTIMATE
+        result = {}
+        for name in names:
+            estimate = self.estimate(name)
+            result[name] = estimate if estimate is not None else default
+        return result
+
+
+ScheduledBuild = collections.namedtuple('ScheduledBuild', ['node', 'start', 'end', 'worker'])
+
+def schedule(graph, costs, jobs=1):
+    """Simulate building every node of @graph, where node n takes
+    costs[n], on @jobs workers.  Whenever a worker is free it starts
+    the ready node with the longest critical path, as MockChain does.
+    Returns a list of ScheduledBuild, in start order."""
+    priority = graph.critical_paths(costs.get)
+    free_at = [0.0] * max(1, jobs)
+    done_at = {}
+    pending = list(graph.nodes)
+    result = []
+    while pending:
+        worker = free_at.index(min(free_at))
+        now = free_at[worker]
+        ready = [node for node in pending
+                 if all(dep in done_at and done_at[dep] <= now for dep in graph.deps[node])]
+        if len(ready) == 0:
+            # Idle until the next running build finishes
+            free_at[worker] = min(t for t in done_at.values() if t > now)
+            continue
+        node = max(ready, key=priority.get)
+        pending.remove(node)
+        done_at[node] = free_at[worker] = now + costs[node]
+        result.append(ScheduledBuild(node, now, done_at[node], worker))
+    return result
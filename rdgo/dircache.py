@@ -0,0 +1,143 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import errno
+import hashlib
+import json
+import shutil
+import subprocess
+import tempfile
+
+from .utils import log, ensuredir, rmrf
+
+def json_digest(dictval):
+    """Stable sha256 of a JSON-serializable value."""
+    serialized = json.dumps(dictval, sort_keys=True)
+    h = hashlib.sha256()
+    h.update(serialized.encode('utf-8'))
+    return h.hexdigest()
+
+def tree_size(path):
+    """Apparent size in bytes of everything under @path."""
+    total = 0
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for name in filenames + dirnames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+    return total
+
+def copy_tree_hardlinked(src, dest):
+    subprocess.check_call(['cp', '-al', src, dest])
+
+class DirCache(object):
+    """A store of directory trees keyed by a hex digest.
+
+    Entries are immutable once inserted, and are copied in and out
+    with hardlinks by default.  Each lookup hit refreshes the entry's
+    mtime, which prune() uses to evict the least recently used entries
+    once the store exceeds max_bytes (0 means unbounded).
+    """
+    def __init__(self, path, max_bytes=0, copy_tree=copy_tree_hardlinked):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.copy_tree = copy_tree
+        ensuredir(self.path)
+
+    def _entry_path(self, key):
+        return self.path + '/' + key[0:2] + '/' + key[2:]
+
+    def lookup(self, key):
+        path = self._entry_path(key)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path, None)
+        return path
+
+    def copy_out(self, key, dest):
+        """Copy the entry for @key to @dest; returns False on a miss."""
+        path = self.lookup(key)
+        if path is None:
+            return False
+        self.copy_tree(path, dest)
+        return True
+
+    def insert(self, key, srcdir):
+        path = self._entry_path(key)
+        if os.path.isdir(path):
+            return path
+        parent = os.path.dirname(path)
+        ensuredir(parent)
+        tmpdir = tempfile.mkdtemp('.tmp', os.path.basename(path), parent)
+        tmp_entry = tmpdir + '/entry'
+        try:
+            self.copy_tree(srcdir, tmp_entry)
+            try:
+                os.rename(tmp_entry, path)
+            except OSError as e:
+                # Someone else inserted the same key concurrently
+                if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise
+            # cp -a preserves the source mtime; mark it as just used
+            os.utime(path, None)
+        finally:
+            rmrf(tmpdir)
+        return path
+
+    def remove(self, key):
+        shutil.rmtree(self._entry_path(key), ignore_errors=True)
+
+    def entries(self):
+        """Yield (key, path) for every complete entry."""
+        for prefix in sorted(os.listdir(self.path)):
+            prefixpath = self.path + '/' + prefix
+            if len(prefix) != 2 or not os.path.isdir(prefixpath):
+                continue
+            for rest in sorted(os.listdir(prefixpath)):
+                if rest.endswith('.tmp'):
+                    continue
+                yield (prefix + rest, prefixpath + '/' + rest)
+
+    def prune(self, max_bytes=None, keep=(), used_since=None):
+        """Evict least recently used entries until the store fits in
+        @max_bytes (defaults to the store's limit).  Keys in @keep, and
+        entries used at or after the timestamp @used_since, are never
+        evicted.  Returns the number of bytes freed."""
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        if max_bytes <= 0:
+            return 0
+        sized = []
+        total = 0
+        for (key, path) in self.entries():
+            size = tree_size(path)
+            total += size
+            sized.append((os.stat(path).st_mtime, key, path, size))
+        sized.sort()
+        freed = 0
+        for (mtime, key, path, size) in sized:
+            if total - freed <= max_bytes:
+                break
+            if key in keep or (used_since is not None and mtime >= used_since):
+                continue
+            log("Evicting cache entry {0} ({1} bytes)".format(key, size))
+            shutil.rmtree(path, ignore_errors=True)
+            freed += size
+        return freed
@@ -21,10 +21,16 @@ import sys
 import re
 import collections
 import subprocess
-import tempfile
+import tarfile
+import threading
+import time
 import yaml
 
+from . import trace
 from .utils import log, fatal, run_sync, rmrf, ensuredir
+from .jobs import KeyedLocks, HostLimiter, JobPool
+from .gitquery import GitQuery, parse_git_config
+from .usageindex import UsageIndex
 
 class GitRemote(object):
     def __init__(self, url, cacertpath=None):
@@ -51,17 +57,24 @@ def make_absolute_url(parent, relpath):
     assert first_slash != -1
     while relpath.startswith('../'):
         i = parent.rfind('/')
-        if i == -1:
+        if i < first_slash:
             fatal("Relative submodule path {0} is too long for parent {1}".format(orig_relpath, orig_parent))
         relpath = relpath[3:]
         parent = parent[0:i]
-    parent = parent[0:first_slash] + parent
     if relpath == '':
         return parent
     return parent + '/' + relpath
 
+# The names `tar --exclude-vcs` leaves out, at any depth
+VCS_EXCLUDES = frozenset(['CVS', 'RCS', 'SCCS', '.git', '.gitignore', '.gitattributes',
+                          '.gitmodules', '.cvsignore', '.svn', '.arch-ids', '{arch}',
+                          '=RELEASE-ID', '=meta-update', '=update', '.bzr', '.bzrignore',
+                          '.bzrtags', '.hg', '.hgignore', '.hgtags', '_darcs'])
+
+_sha1_re = re.compile(r'^[0-9a-f]{40}$')
+
 GitSubmodule = collections.namedtuple('GitSubmodule',
-                                      ['checksum', 'name', 'url'])
+                                      ['checksum', 'name', 'path', 'url'])
 
 class GitMirror(object):
     _pathname_quote_re = re.compile(r'[/\.]')
@@ -70,6 +83,21 @@ class GitMirror(object):
         self.mirrordir = mirrordir
         self.tmpdir = mirrordir + '/_tmp'
         self.gitconfig = mirrordir + '/.gitconfig'
+        # Serializes operations on a single mirror directory, since
+        # several components (or submodules) may share one.
+        self._mirrordir_locks = KeyedLocks()
+        self.host_limiter = HostLimiter()
+        # Shared by mirror() calls and their submodule recursion
+        self.pool = JobPool(1)
+        self._queries = collections.OrderedDict()
+        self._queries_lock = threading.Lock()
+        self.max_query_processes = 64
+        # Last use of each mirror, for `rpmdistro-gitoverlay gc`
+        self.usage = UsageIndex(mirrordir)
+        # Per-run memo of mirror(): the revision each (ref, fetch) of
+        # a mirror directory resolved to, and the mirrors fetched.
+        self._resolved = {}
+        self._fetched = set()
         ensuredir(self.tmpdir)
 
     def _gitenv(self):
@@ -108,8 +136,32 @@ class GitMirror(object):
             prefix = prefix + b'/'
         return ((parent or self.mirrordir.encode()) + b'/' + prefix + scheme + b'/' + rest).decode('UTF-8')
 
+    def query(self, gitdir):
+        """Return the shared GitQuery for @gitdir."""
+        with self._queries_lock:
+            query = self._queries.pop(gitdir, None)
+            if query is None:
+                query = GitQuery(gitdir)
+            self._queries[gitdir] = query
+            # Bound the number of idle cat-file processes we keep
+            # around; a closed query restarts its process on demand.
+            for (_, old) in list(self._queries.items())[0:-self.max_query_processes]:
+                old.close()
+            return query
+
+    def close(self):
+        """Stop the git processes of every query."""
+        with self._queries_lock:
+            for query in self._queries.values():
+                query.close()
+            self._queries.clear()
+
+    def mirror_key(self, mirrordir):
+        """The usage index key of @mirrordir."""
+        return os.path.relpath(mirrordir, self.mirrordir)
+
     def _git_revparse(self, gitdir, branch):
-        return subprocess.check_output(['git', 'rev-parse', branch], cwd=gitdir).strip().decode('UTF-8')
+        return self.query(gitdir).rev_parse(branch)
 
     def _strip_file_url(self, url):
         """Remove the file:// prefix, which causes git to fall back to a
@@ -121,37 +173,101 @@ class GitMirror(object):
         else:
             return url
 
-    def _list_submodules_in(self, checkout, uri, rev='HEAD'):
-        self._run('checkout', '-q', '-f', rev, cwd=checkout)
-        proc = subprocess.Popen(['git', 'submodule', 'status'], cwd=checkout,
-                                stdout=subprocess.PIPE, env=self._gitenv())
+    def _list_submodules_at(self, gitdir, uri, rev, query=None):
+        """List the submodules of commit @rev in the repository (bare or
+        not) @gitdir, using only its object database."""
+        if query is None:
+            query = self.query(gitdir)
+        gitmodules = query.read_blob(rev + ':.gitmodules')
+        if gitmodules is None:
+            return []
+        modules = {}
+        for ((section, name, key), value) in parse_git_config(gitmodules.decode('UTF-8')).items():
+            if section == 'submodule' and name is not None and key in ('path', 'url'):
+                modules.setdefault(name, {})[key] = value
         submodules = []
-        for line in proc.stdout:
-            line = line.strip()
-            if line == b'':
+        for name in sorted(modules):
+            attrs = modules[name]
+            if 'path' not in attrs or 'url' not in attrs:
                 continue
-            line = line[1:].decode('UTF-8')
-            parts = line.split(' ', 2)
-            if len(parts) < 2:
+            entry = query.lookup_path(rev, attrs['path'])
+            # Entries in .gitmodules without a gitlink are ignored, as
+            # `git submodule` does.
+            if entry is None or entry[0] != '160000':
                 continue
-            sub_checksum, sub_name = parts[0:2]
-            sub_url = subprocess.check_output(['git', 'config', '-f', '.gitmodules',
-                                               'submodule.{0}.url'.format(sub_name).encode()],
-                                              cwd=checkout).strip().decode('UTF-8')
+            sub_url = attrs['url']
             if sub_url.startswith('../'):
                 sub_url = make_absolute_url(uri, sub_url)
-            submodules.append(GitSubmodule(sub_checksum, sub_name, sub_url))
+            submodules.append(GitSubmodule(entry[1], name, attrs['path'], sub_url))
         return submodules
 
-    def _list_submodules(self, gitdir, uri, branch):
-        current_rev = self._git_revparse(gitdir, branch)
-        tmpdir = tempfile.mkdtemp('', 'tmp-gitmirror', self.tmpdir)
-        tmp_clone = tmpdir + '/checkout'
+    def _has_commit(self, mirrordir, branch_or_tag):
+        """True if @branch_or_tag is a full commit id which @mirrordir
+        already has, in which case no fetch can change it."""
+        if _sha1_re.match(branch_or_tag) is None:
+            return False
+        return self.query(mirrordir).read_object(branch_or_tag + '^{commit}') is not None
+
+    def _ls_remote(self, mirrordir, remote, patterns):
+        """Return a dict mapping upstream ref names matching any of
+        @patterns (as `git ls-remote` matches them) to their object
+        ids."""
+        env = remote.to_git_env()
+        env.update(self._gitenv())
+        argv = ['git', 'ls-remote', 'origin'] + list(patterns)
+        with self.host_limiter.limit(remote.url):
+            with trace.span('git', cat='subprocess', argv=subprocess.list2cmdline(argv), cwd=mirrordir):
+                out = subprocess.check_output(argv, cwd=mirrordir, env=env)
+        refs = {}
+        for line in out.decode('UTF-8').splitlines():
+            (sha1, _, refname) = line.partition('\t')
+            # Skip peeled tags; we compare the tag objects themselves
+            if not refname.endswith('^{}'):
+                refs[refname] = sha1
+        return refs
+
+    def needs_fetch(self, remote, branch_or_tag):
+        """Cheaply check whether fetching could change what
+        @branch_or_tag resolves to in the mirror of @remote, or how it
+        is described, comparing the upstream refs it may name and the
+        upstream tags against ours.  When in doubt (including if the
+        probe fails), answers True."""
+        if not isinstance(remote, GitRemote):
+            remote = GitRemote(remote)
+        mirrordir = self._get_mirrordir(remote.url)
+        if not os.path.isdir(mirrordir):
+            return True
+        if _sha1_re.match(branch_or_tag):
+            return not self._has_commit(mirrordir, branch_or_tag)
         try:
-            self._run('clone', '-q', '--no-checkout', gitdir, tmp_clone)
-            return self._list_submodules_in(tmp_clone, uri, rev=current_rev)
-        finally:
-            rmrf(tmpdir)
+            # New tags change `git describe`, and so the version
+            upstream = self._ls_remote(mirrordir, remote, [branch_or_tag, 'refs/tags/*'])
+        except subprocess.CalledProcessError:
+            # Let the fetch report the problem
+            return True
+        # As ls-remote matches patterns, by trailing path components
+        if not any(refname == branch_or_tag or refname.endswith('/' + branch_or_tag) for refname in upstream):
+            return True
+        query = self.query(mirrordir)
+        local = query.refs()
+        for (refname, sha1) in upstream.items():
+            if refname == 'HEAD':
+                obj = query.read_object('HEAD')
+                if obj is None or obj[0] != sha1:
+                    return True
+            elif local.get(refname) != sha1:
+                return True
+        return False
+
+    def probe_many(self, requests, jobs=1):
+        """Run needs_fetch() for each (remote, branch_or_tag) in
+        @requests on a thread pool, returning the answers in order."""
+        start = time.time()
+        with trace.span('probe', cat='git', count=len(requests)):
+            results = JobPool(jobs).map(lambda request: self.needs_fetch(*request), requests)
+        log("Probed {0} repositories in {1:.1f}s: {2} unchanged, {3} to fetch".format(
+            len(requests), time.time() - start, results.count(False), results.count(True)))
+        return results
 
     def mirror(self, remote, branch_or_tag,
                fetch=False, fetch_continue=False,
@@ -159,64 +275,105 @@ class GitMirror(object):
         if not isinstance(remote, GitRemote):
             remote = GitRemote(remote)
         assert isinstance(remote, GitRemote)
+        with trace.span('mirror', cat='git', url=remote.url, ref=branch_or_tag, fetch=fetch):
+            return self._mirror(remote, branch_or_tag, fetch, fetch_continue, parent_mirror)
+
+    def _mirror(self, remote, branch_or_tag, fetch, fetch_continue, parent_mirror):
         url = remote.url
 
         # First, let's quickly handle the case where we have a parent mirror
         if parent_mirror is not None:
             self_mirrordir = self._get_mirrordir(url)
             parent_mirrordir = self._get_mirrordir(url, parent=parent_mirror)
-            if not os.path.isdir(self_mirrordir):
-                tmp_mirror = self_mirrordir + '.tmp'
-                self._run('clone', '--mirror', '--shared', parent_mirrordir, tmp_mirror,
-                          env=remote.to_git_env())
-                self._run('config', 'gc.auto', '0', cwd=tmp_mirror)
-                os.rename(tmp_mirror, self_mirrordir)
+            self.usage.touch([self.mirror_key(self_mirrordir)])
+            with self._mirrordir_locks.get(self_mirrordir):
+                if not os.path.isdir(self_mirrordir):
+                    tmp_mirror = self_mirrordir + '.tmp'
+                    self._run('clone', '--mirror', '--shared', parent_mirrordir, tmp_mirror,
+                              env=remote.to_git_env())
+                    self._run('config', 'gc.auto', '0', cwd=tmp_mirror)
+                    os.rename(tmp_mirror, self_mirrordir)
             return
 
         # Otherwise, the clone from usptream path
         mirrordir = self._get_mirrordir(url)
         tmp_mirror = os.path.dirname(mirrordir) + '/' + os.path.basename(mirrordir) + '.tmp'
-        
-        rmrf(tmp_mirror)
-        if remote.cacertpath:
-            print("Fetching from {} with CA cert: {}".format(remote.url, remote.cacertpath))
-        if not os.path.isdir(mirrordir):
-            self._run('clone', '--mirror', self._strip_file_url(url), tmp_mirror,
-                      env=remote.to_git_env())
-            self._run('config', 'gc.auto', '0', cwd=tmp_mirror)
-            os.rename(tmp_mirror, mirrordir)
-        elif fetch:
-            sys.stdout.write(os.path.basename(mirrordir) + ': ')
-            self._run('fetch', cwd=mirrordir, env=remote.to_git_env())
-        
-        rev = subprocess.check_output(['git', 'rev-parse', branch_or_tag], cwd=mirrordir).strip().decode('UTF-8')
-
-        # Cache making it more efficient to remirror the same commit
-        # multiple times
         cachepath = mirrordir + '/submodules-cache-stamp'
-        if os.path.exists(cachepath):
-            cached_rev = open(cachepath).read().strip()
-            if cached_rev == rev:
+
+        with self._mirrordir_locks.get(mirrordir):
+            # Components may share a repository, and repositories
+            # submodules; each is fetched and scanned once per run.
+            # An answer obtained after fetching also serves requests
+            # which don't ask for a fetch.
+            resolved = self._resolved.get(mirrordir, {})
+            rev = resolved.get((branch_or_tag, True))
+            if rev is None and not fetch:
+                rev = resolved.get((branch_or_tag, False))
+            if rev is not None:
                 return rev
+            self.usage.touch([self.mirror_key(mirrordir)])
+            rmrf(tmp_mirror)
+            if remote.cacertpath:
+                print("Fetching from {} with CA cert: {}".format(remote.url, remote.cacertpath))
+            if not os.path.isdir(mirrordir):
+                with self.host_limiter.limit(url):
+                    self._run('clone', '--mirror', self._strip_file_url(url), tmp_mirror,
+                              env=remote.to_git_env())
+                self._run('config', 'gc.auto', '0', cwd=tmp_mirror)
+                os.rename(tmp_mirror, mirrordir)
+                self.query(mirrordir).invalidate()
+                self._fetched.add(mirrordir)
+            elif fetch and mirrordir not in self._fetched and not self._has_commit(mirrordir, branch_or_tag):
+                sys.stdout.write(os.path.basename(mirrordir) + ': ')
+                with self.host_limiter.limit(url):
+                    self._run('fetch', cwd=mirrordir, env=remote.to_git_env())
+                self.query(mirrordir).invalidate()
+                self._fetched.add(mirrordir)
+                # What we resolved before the fetch may be stale
+                self._resolved.pop(mirrordir, None)
+
+            rev = self._git_revparse(mirrordir, branch_or_tag)
+            # Recorded before recursing into submodules, so that a
+            # submodule cycle terminates.
+            self._resolved.setdefault(mirrordir, {})[(branch_or_tag, fetch)] = rev
+
+            # Cache making it more efficient to remirror the same commit
+            # multiple times
+            if os.path.exists(cachepath):
+                cached_rev = open(cachepath).read().strip()
+                if cached_rev == rev:
+                    return rev
 
-        for module in self._list_submodules(mirrordir, url, branch_or_tag):
+            submodules = self._list_submodules_at(mirrordir, url, rev)
+
+        # Don't hold our lock while recursing, submodules have their own.
+        def mirror_submodule(module):
             log("Processing {0}".format(module))
             self.mirror(module.url, module.checksum,
                         fetch=fetch, fetch_continue=fetch_continue)
-        with open(cachepath + '.tmp', 'w') as f:
-            f.write(rev + '\n')
-        os.rename(cachepath + '.tmp', cachepath)
+        self.pool.map(mirror_submodule, submodules)
+        # Only stamp once every submodule (recursively) is mirrored
+        with self._mirrordir_locks.get(mirrordir):
+            with open(cachepath + '.tmp', 'w') as f:
+                f.write(rev + '\n')
+            os.rename(cachepath + '.tmp', cachepath)
         return rev
 
     def _process_checkout_submodules(self, checkout, url):
-        for module in self._list_submodules_in(checkout, url):
+        # Checkouts are short-lived, so use a private query object
+        query = GitQuery(checkout)
+        try:
+            submodules = self._list_submodules_at(checkout, url, 'HEAD', query=query)
+        finally:
+            query.close()
+        for module in submodules:
             sub_mirrordir = self._get_mirrordir(module.url)
             config_key = 'submodule.{0}.url'.format(module.name)
             run_sync(['git', 'config', '-f', '.gitmodules',
                       config_key, 'file://' + sub_mirrordir],
                      cwd=checkout)
-            run_sync(['git', 'submodule', '--quiet', 'update', '--init', module.name], cwd=checkout)
-            self._process_checkout_submodules(checkout + '/' + module.name, module.url)
+            run_sync(['git', 'submodule', '--quiet', 'update', '--init', module.path], cwd=checkout)
+            self._process_checkout_submodules(checkout + '/' + module.path, module.url)
 
     def checkout(self, remote, branch_or_tag, dest):
         if not isinstance(remote, GitRemote):
@@ -224,22 +381,115 @@ class GitMirror(object):
         assert isinstance(remote, GitRemote)
         url = remote.url
         mirrordir = self._get_mirrordir(url)
-        run_sync(['git', 'clone', '-q', '-s', '--origin', 'localmirror', mirrordir, dest])
-        run_sync(['git', 'checkout', '-q', branch_or_tag], cwd=dest)
-        self._process_checkout_submodules(dest, url)
+        with trace.span('checkout', cat='git', url=url, ref=branch_or_tag):
+            run_sync(['git', 'clone', '-q', '-s', '--origin', 'localmirror', mirrordir, dest])
+            run_sync(['git', 'checkout', '-q', branch_or_tag], cwd=dest)
+            self._process_checkout_submodules(dest, url)
         return dest
 
-    def describe(self, remote, branch_or_tag):
+    def _tarinfo(self, name, mtime, tartype, mode):
+        info = tarfile.TarInfo(name)
+        info.type = tartype
+        info.mode = mode
+        info.mtime = mtime
+        info.uid = info.gid = 0
+        info.uname = info.gname = 'root'
+        return info
+
+    def _archive_commit(self, tar, query, url, rev, prefix, mtime):
+        submodules = dict((module.path, module)
+                          for module in self._list_submodules_at(query.gitdir, url, rev, query=query))
+        tar.addfile(self._tarinfo(prefix, mtime, tarfile.DIRTYPE, 0o755))
+        self._archive_tree(tar, query, submodules, query.read_tree(rev), '', prefix, mtime)
+
+    def _archive_tree(self, tar, query, submodules, entries, dirpath, prefix, mtime):
+        for (mode, name, sha1) in entries:
+            if name in VCS_EXCLUDES:
+                continue
+            path = dirpath + name
+            tarpath = prefix + '/' + path
+            if mode == '40000':
+                tar.addfile(self._tarinfo(tarpath, mtime, tarfile.DIRTYPE, 0o755))
+                self._archive_tree(tar, query, submodules, query.read_tree(sha1),
+                                   path + '/', prefix, mtime)
+            elif mode == '160000':
+                module = submodules.get(path)
+                if module is None:
+                    # Not in .gitmodules; a checkout leaves it empty
+                    tar.addfile(self._tarinfo(tarpath, mtime, tarfile.DIRTYPE, 0o755))
+                    continue
+                sub_query = self.query(self._get_mirrordir(module.url))
+                self._archive_commit(tar, sub_query, module.url, module.checksum, tarpath, mtime)
+            elif mode == '120000':
+                info = self._tarinfo(tarpath, mtime, tarfile.SYMTYPE, 0o777)
+                info.linkname = query.read_blob(sha1).decode('UTF-8', 'surrogateescape')
+                tar.addfile(info)
+            else:
+                info = self._tarinfo(tarpath, mtime, tarfile.REGTYPE,
+                                     0o755 if mode == '100755' else 0o644)
+
+                def add_blob(_sha1, _objtype, size, stream, info=info):
+                    info.size = size
+                    tar.addfile(info, stream)
+                query.stream_object(sha1, add_blob)
+
+    def write_archive(self, remote, branch_or_tag, prefix, fileobj):
+        """Write an uncompressed tar archive of @branch_or_tag to the
+        file object @fileobj, with every path under the directory
+        @prefix.  Submodules are embedded, VCS metadata is left out as
+        with `tar --exclude-vcs`, and everything is read straight from
+        the mirrors without a checkout.  All entries are owned by root
+        and carry the commit's timestamp, so the output depends only on
+        the revision."""
+        if not isinstance(remote, GitRemote):
+            remote = GitRemote(remote)
+        query = self.query(self._get_mirrordir(remote.url))
+        rev = query.rev_parse(branch_or_tag)
+        mtime = query.commit_time(rev)
+        tar = tarfile.open(fileobj=fileobj, mode='w|', format=tarfile.GNU_FORMAT)
+        try:
+            self._archive_commit(tar, query, remote.url, rev, prefix, mtime)
+        finally:
+            tar.close()
+
+    def read_file(self, remote, branch_or_tag, path):
+        """Return the content of @path at @branch_or_tag, or None."""
+        query = self.query(self._remote_mirrordir(remote))
+        return query.read_blob(branch_or_tag + ':' + path)
+
+    def list_files(self, remote, branch_or_tag):
+        return self.query(self._remote_mirrordir(remote)).ls_files(branch_or_tag)
+
+    def _remote_mirrordir(self, remote):
         if not isinstance(remote, GitRemote):
             remote = GitRemote(remote)
         assert isinstance(remote, GitRemote)
-        url = remote.url
-        mirrordir = self._get_mirrordir(url)
-        description = subprocess.check_output(['git', 'describe', '--tags', '--long', '--abbrev=40', '--always', branch_or_tag],
-                                              cwd=mirrordir).strip().decode('UTF-8')
+        return self._get_mirrordir(remote.url)
+
+    def _parse_description(self, description):
         if len(description) == 40:
             return [None, description]
         else:
             rgdash = description.rfind('-g')
             assert rgdash >= 0
             return (description[0:rgdash], description[rgdash+2:])
+
+    def describe_many(self, requests):
+        """Describe each (remote, branch_or_tag) pair in @requests,
+        with one `git describe` per mirror.  The results are also
+        remembered, so later describe() calls for the same revisions
+        don't run git at all."""
+        by_mirrordir = collections.OrderedDict()
+        for (remote, branch_or_tag) in requests:
+            by_mirrordir.setdefault(self._remote_mirrordir(remote), []).append(branch_or_tag)
+        descriptions = {}
+        for (mirrordir, revs) in by_mirrordir.items():
+            with trace.span('describe', cat='git', mirror=self.mirror_key(mirrordir), count=len(revs)):
+                for (rev, description) in self.query(mirrordir).describe_many(revs).items():
+                    descriptions[(mirrordir, rev)] = description
+        return [self._parse_description(descriptions[(self._remote_mirrordir(remote), rev)])
+                for (remote, rev) in requests]
+
+    def describe(self, remote, branch_or_tag):
+        mirrordir = self._remote_mirrordir(remote)
+        return self._parse_description(self.query(mirrordir).describe(branch_or_tag))
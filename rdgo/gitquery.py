@@ -0,0 +1,319 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import re
+import binascii
+import threading
+import subprocess
+
+from .utils import fatal
+
+_sha1_re = re.compile(r'^[0-9a-f]{40}$')
+
+# The order in which `git rev-parse` tries to expand a short ref name
+_REF_RULES = ['{0}', 'refs/{0}', 'refs/tags/{0}', 'refs/heads/{0}',
+              'refs/remotes/{0}', 'refs/remotes/{0}/HEAD']
+
+def _config_unquote(value):
+    """Interpret quoting and escapes in a git config value."""
+    result = []
+    in_quote = False
+    i = 0
+    pending_space = ''
+    while i < len(value):
+        c = value[i]
+        if c == '"':
+            in_quote = not in_quote
+        elif c == '\\' and i + 1 < len(value):
+            i += 1
+            result.append(pending_space)
+            pending_space = ''
+            result.append({'n': '\n', 't': '\t', 'b': '\b'}.get(value[i], value[i]))
+        elif c in '#;' and not in_quote:
+            break
+        elif c.isspace() and not in_quote:
+            if result:
+                pending_space += c
+        else:
+            result.append(pending_space)
+            pending_space = ''
+            result.append(c)
+        i += 1
+    return ''.join(result)
+
+def parse_git_config(text):
+    """Parse git config file syntax into a dict mapping
+    (section, subsection, key) to the last value set for it.  Section
+    and key names are lowercased, as git treats them
+    case-insensitively; subsection is None for plain [section]
+    headers."""
+    result = {}
+    section = subsection = None
+    # Join continuation lines first
+    text = re.sub(r'\\\r?\n', '', text)
+    for line in text.splitlines():
+        line = line.strip()
+        if line == '' or line[0] in '#;':
+            continue
+        if line.startswith('['):
+            end = line.find(']')
+            if end == -1:
+                raise ValueError("Invalid config section header: " + line)
+            header = line[1:end].strip()
+            m = re.match(r'^([^\s"]+)\s+"((?:[^"\\]|\\.)*)"$', header)
+            if m is not None:
+                section = m.group(1).lower()
+                subsection = re.sub(r'\\(.)', r'\1', m.group(2))
+            else:
+                # Legacy [section.subsection] syntax
+                (section, _, subsection) = header.partition('.')
+                section = section.lower()
+                subsection = subsection.lower() if subsection else None
+            line = line[end+1:].strip()
+            if line == '' or line[0] in '#;':
+                continue
+        if section is None:
+            raise ValueError("Config key outside of a section: " + line)
+        (key, eq, value) = line.partition('=')
+        key = key.strip().lower()
+        if not eq:
+            # A bare key is boolean true
+            value = 'true'
+        else:
+            value = _config_unquote(value.strip())
+        result[(section, subsection, key)] = value
+    return result
+
+def parse_tree(data):
+    """Parse a raw tree object into a list of (mode, name, sha1)."""
+    entries = []
+    pos = 0
+    while pos < len(data):
+        space = data.index(b' ', pos)
+        nul = data.index(b'\0', space)
+        mode = data[pos:space].decode('ascii')
+        name = data[space+1:nul].decode('UTF-8', 'surrogateescape')
+        sha1 = binascii.hexlify(data[nul+1:nul+21]).decode('ascii')
+        entries.append((mode, name, sha1))
+        pos = nul + 21
+    return entries
+
+class GitQuery(object):
+    """Read-only queries against one git repository, served by a
+    long-lived `git cat-file --batch` process and a single cached
+    `git for-each-ref` listing, rather than a process per question.
+
+    Call invalidate() after anything (e.g. a fetch) changes the
+    repository.  A query object inherited across fork() transparently
+    starts its own process in the child.
+    """
+    def __init__(self, gitdir):
+        self.gitdir = gitdir
+        self._lock = threading.Lock()
+        self._proc = None
+        self._pid = None
+        self._refs = None
+        self._describe = {}
+
+    def _check_fork(self):
+        if self._pid is not None and self._pid != os.getpid():
+            # The pipes belong to our parent; forget them without
+            # touching the process.
+            self._lock = threading.Lock()
+            self._proc = None
+            self._pid = None
+
+    def _batch(self):
+        if self._proc is None:
+            self._proc = subprocess.Popen(['git', 'cat-file', '--batch'], cwd=self.gitdir,
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            self._pid = os.getpid()
+        return self._proc
+
+    def _close_unlocked(self):
+        if self._proc is not None and self._pid == os.getpid():
+            try:
+                self._proc.stdin.close()
+            except (IOError, OSError):
+                # Already exited
+                pass
+            self._proc.wait()
+            self._proc.stdout.close()
+        self._proc = None
+        self._pid = None
+
+    def close(self):
+        self._check_fork()
+        with self._lock:
+            self._close_unlocked()
+
+    def invalidate(self):
+        """Drop all cached state; the next query sees the repository
+        as it is now."""
+        self._check_fork()
+        with self._lock:
+            self._close_unlocked()
+            self._refs = None
+            self._describe = {}
+
+    def stream_object(self, rev, func):
+        """Look up the object named by the expression @rev and call
+        func(sha1, type, size, stream), which must read exactly size
+        bytes from the file object @stream; this avoids holding large
+        blobs in memory.  Returns what func returned, or None without
+        calling it if the object does not exist."""
+        self._check_fork()
+        with self._lock:
+            proc = self._batch()
+            try:
+                proc.stdin.write(rev.encode('UTF-8') + b'\n')
+                proc.stdin.flush()
+                header = proc.stdout.readline().decode('UTF-8')
+                if header == '':
+                    fatal("git cat-file exited unexpectedly in {0}".format(self.gitdir))
+                fields = header.split()
+                if fields[-1] in ('missing', 'ambiguous'):
+                    return None
+                (sha1, objtype, size) = fields
+                result = func(sha1, objtype, int(size), proc.stdout)
+                if proc.stdout.read(1) != b'\n':
+                    raise ValueError("Lost sync with git cat-file in {0}".format(self.gitdir))
+            except BaseException:
+                # We may be out of sync with the process; start over
+                self._close_unlocked()
+                raise
+            return result
+
+    def read_object(self, rev):
+        """Return (sha1, type, data) for the object named by the
+        expression @rev, or None if it does not exist."""
+        return self.stream_object(rev, lambda sha1, objtype, size, stream:
+                                  (sha1, objtype, stream.read(size)))
+
+    def read_tree(self, rev):
+        """Parse the tree named by @rev (a tree or commit), or return
+        None if there is no such tree."""
+        obj = self.read_object(rev + '^{tree}')
+        if obj is None:
+            return None
+        return parse_tree(obj[2])
+
+    def commit_time(self, rev):
+        """Return the committer timestamp of the commit named by @rev."""
+        obj = self.read_object(rev + '^{commit}')
+        if obj is None:
+            fatal("Unknown revision {0} in {1}".format(rev, self.gitdir))
+        for line in obj[2].decode('UTF-8', 'replace').split('\n'):
+            if line == '':
+                break
+            if line.startswith('committer '):
+                return int(line.split(' ')[-2])
+        fatal("Commit {0} in {1} has no committer".format(rev, self.gitdir))
+
+    def ls_files(self, rev):
+        """List the paths of all files in commit @rev, recursively."""
+        out = subprocess.check_output(['git', 'ls-tree', '-r', '-z', '--name-only', rev],
+                                      cwd=self.gitdir)
+        return [path for path in out.decode('UTF-8', 'surrogateescape').split('\0') if path != '']
+
+    def refs(self):
+        """Return a dict mapping each ref name to its object id."""
+        self._check_fork()
+        with self._lock:
+            if self._refs is None:
+                out = subprocess.check_output(['git', 'for-each-ref', '--format=%(objectname) %(refname)'],
+                                              cwd=self.gitdir)
+                refs = {}
+                for line in out.decode('UTF-8').splitlines():
+                    (sha1, _, refname) = line.partition(' ')
+                    refs[refname] = sha1
+                self._refs = refs
+            return self._refs
+
+    def rev_parse(self, rev):
+        """Like `git rev-parse`; a name which is a ref resolves to the
+        object it points to, which for an annotated tag is the tag
+        object itself."""
+        if _sha1_re.match(rev):
+            return rev
+        refs = self.refs()
+        for rule in _REF_RULES:
+            sha1 = refs.get(rule.format(rev))
+            if sha1 is not None:
+                return sha1
+        # HEAD, or an expression such as foo~1
+        obj = self.read_object(rev)
+        if obj is None:
+            fatal("Unknown revision {0} in {1}".format(rev, self.gitdir))
+        return obj[0]
+
+    def read_blob(self, rev):
+        """Return the content of the blob named by @rev (e.g.
+        "master:README"), or None if there is no such blob."""
+        obj = self.read_object(rev)
+        if obj is None or obj[1] != 'blob':
+            return None
+        return obj[2]
+
+    def ls_tree(self, rev, path=''):
+        """List the tree at @path in commit @rev as (mode, name, sha1)
+        tuples, or return None if it does not exist."""
+        obj = self.read_object(rev + '^{tree}' if path == '' else rev + ':' + path)
+        if obj is None or obj[1] != 'tree':
+            return None
+        return parse_tree(obj[2])
+
+    def lookup_path(self, rev, path):
+        """Return (mode, sha1) for @path in commit @rev without reading
+        the object it names, so gitlinks (submodules) can be resolved.
+        Returns None if the path does not exist."""
+        (dirname, _, basename) = path.rstrip('/').rpartition('/')
+        entries = self.ls_tree(rev, dirname)
+        if entries is None:
+            return None
+        for (mode, name, sha1) in entries:
+            if name == basename:
+                return (mode, sha1)
+        return None
+
+    def describe_many(self, revs):
+        """Return a dict mapping each of @revs to its
+        `git describe --tags --long --abbrev=40 --always` output,
+        running git once for all revisions not already known."""
+        self._check_fork()
+        with self._lock:
+            missing = sorted(set(rev for rev in revs if rev not in self._describe))
+        if len(missing) > 0:
+            argv = ['git', 'describe', '--tags', '--long', '--abbrev=40', '--always']
+            try:
+                out = subprocess.check_output(argv + missing, cwd=self.gitdir,
+                                              stderr=subprocess.DEVNULL)
+                descriptions = out.decode('UTF-8').splitlines()
+                assert len(descriptions) == len(missing)
+            except subprocess.CalledProcessError:
+                # One bad revision fails the whole batch; go one at a
+                # time so the failure is reported against it.
+                descriptions = [subprocess.check_output(argv + [rev], cwd=self.gitdir).strip().decode('UTF-8')
+                                for rev in missing]
+            with self._lock:
+                self._describe.update(zip(missing, descriptions))
+        with self._lock:
+            return dict((rev, self._describe[rev]) for rev in revs)
+
+    def describe(self, rev):
+        return self.describe_many([rev])[rev]
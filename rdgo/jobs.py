@@ -0,0 +1,119 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import sys
+import threading
+
+import six
+from six.moves.urllib_parse import urlsplit  # pylint: disable=import-error
+
+def url_host(url):
+    """Return the host part of a git URL, or '' for local paths."""
+    if url.find('://') >= 0:
+        return urlsplit(url).hostname or ''
+    # scp-like syntax: user@host:path
+    colon = url.find(':')
+    if colon > 0 and url.find('/', 0, colon) == -1:
+        return url[0:colon].split('@')[-1]
+    return ''
+
+class KeyedLocks(object):
+    """A lazily populated set of locks, one per key."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def get(self, key):
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+class _NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+class HostLimiter(object):
+    """Bound the number of concurrent operations against any one host.
+    A limit of 0 means unlimited."""
+    def __init__(self, per_host=0):
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def limit(self, url):
+        if self.per_host <= 0:
+            return _NullContext()
+        host = url_host(url)
+        with self._lock:
+            sem = self._semaphores.get(host)
+            if sem is None:
+                sem = self._semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return sem
+
+class JobPool(object):
+    """Run callables on a bounded number of threads.
+
+    The calling thread always participates: when no worker slot is
+    free, an item is run inline.  This means map() may safely be
+    called recursively from inside a job without deadlocking, and
+    with jobs=1 everything runs sequentially in the caller, exactly
+    as if no pool were involved.
+    """
+    def __init__(self, jobs=1):
+        self.jobs = max(1, jobs)
+        self._slots = threading.Semaphore(self.jobs - 1)
+
+    def map(self, func, items):
+        """Return [func(item) for item in items], in order.  If any call
+        raised, the first exception (in item order) is re-raised once
+        all calls have finished."""
+        items = list(items)
+        results = [None] * len(items)
+        errors = [None] * len(items)
+
+        def run(i, item):
+            try:
+                results[i] = func(item)
+            except BaseException:  # pylint: disable=broad-except
+                errors[i] = sys.exc_info()
+
+        def run_and_release(i, item):
+            try:
+                run(i, item)
+            finally:
+                self._slots.release()
+
+        threads = []
+        for i, item in enumerate(items):
+            if self._slots.acquire(False):
+                t = threading.Thread(target=run_and_release, args=(i, item))
+                t.daemon = True
+                t.start()
+                threads.append(t)
+            else:
+                run(i, item)
+        for t in threads:
+            t.join()
+        for error in errors:
+            if error is not None:
+                six.reraise(*error)
+        return results
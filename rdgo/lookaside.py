@@ -0,0 +1,381 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Note: this module is also used by the Python 2 rpkg-prep-sources.
+
+import os
+import re
+import time
+import errno
+import contextlib
+import fcntl
+import hashlib
+import json
+import subprocess
+import threading
+import multiprocessing
+import collections
+
+from six.moves import http_client  # pylint: disable=import-error
+from six.moves.urllib_parse import urlsplit, urljoin  # pylint: disable=import-error
+
+from .utils import log
+from .jobs import JobPool, HostLimiter
+
+# A source file to fetch into the lookaside mirror: @url is where to
+# download it, and @path where it lives in the mirror.
+LookasideObject = collections.namedtuple('LookasideObject',
+                                         ['url', 'hashtype', 'hash', 'path'])
+
+VALID_HASHTYPES = ['md5', 'sha512']
+
+def object_key(hashtype, hashval):
+    """Path of an object relative to a lookaside mirror:
+    <hashtype>/<xx>/<rest>."""
+    # For now, enforce this due to paranoia about potential unsafe
+    # code paths.
+    if hashtype not in VALID_HASHTYPES:
+        raise ValueError('Invalid hash type {0}'.format(hashtype))
+    if '/' in hashval or len(hashval) < 3:
+        raise ValueError('Invalid hash {0}'.format(hashval))
+    return '{0}/{1}/{2}'.format(hashtype, hashval[0:2], hashval[2:])
+
+def object_path(mirror, hashtype, hashval):
+    """Path of an object in a lookaside mirror."""
+    return mirror + '/' + object_key(hashtype, hashval)
+
+
+_sources_bsd_re = re.compile(r'^(\w+) \((.+)\) = ([0-9a-fA-F]+)$')
+
+def parse_sources(text):
+    """Parse a dist-git sources file, in either the old "<md5>  <file>"
+    or the BSD-style "<HASHTYPE> (<file>) = <hash>" format, into a list
+    of (hashtype, hash, filename)."""
+    entries = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line == '':
+            continue
+        m = _sources_bsd_re.match(line)
+        if m is not None:
+            entries.append((m.group(1).lower(), m.group(3).lower(), m.group(2)))
+            continue
+        (hashval, _, filename) = line.partition('  ')
+        if filename == '':
+            raise ValueError("Invalid sources line: {0}".format(line))
+        entries.append(('md5', hashval.lower(), filename))
+    return entries
+
+@contextlib.contextmanager
+def object_lock(path):
+    """Hold an exclusive lock on the mirror object @path, which
+    serializes its writers across threads and processes."""
+    with open(path + '.lock', 'a') as lockf:
+        fcntl.flock(lockf.fileno(), fcntl.LOCK_EX)
+        yield
+
+class DownloadError(Exception):
+    pass
+
+class ConnectionPool(object):
+    """Idle keep-alive HTTP(S) connections, by scheme, host and port."""
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def _key(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise DownloadError("Unsupported URL {0}".format(url))
+        return (parts.scheme, parts.hostname, parts.port)
+
+    def get(self, url):
+        """Return (connection, reused) for @url."""
+        key = self._key(url)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return (idle.pop(), True)
+        (scheme, host, port) = key
+        if scheme == 'https':
+            conn = http_client.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = http_client.HTTPConnection(host, port, timeout=self.timeout)
+        return (conn, False)
+
+    def put(self, url, conn):
+        with self._lock:
+            self._idle.setdefault(self._key(url), []).append(conn)
+
+    def close(self):
+        with self._lock:
+            for conns in self._idle.values():
+                for conn in conns:
+                    conn.close()
+            self._idle = {}
+
+def _request_path(url):
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return path
+
+def quarantine_object(path, tmppath):
+    """Move @tmppath, a failed download of the mirror object @path,
+    into the mirror's quarantine/ directory for inspection; returns
+    its new path."""
+    (mirror, hashtype, prefix, rest) = path.rsplit('/', 3)
+    quarantine_dir = '{0}/quarantine/{1}'.format(mirror, hashtype)
+    try:
+        os.makedirs(quarantine_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    dest = '{0}/{1}{2}.{3}'.format(quarantine_dir, prefix, rest, int(time.time()))
+    os.rename(tmppath, dest)
+    return dest
+
+
+_content_range_re = re.compile(r'^bytes (\d+)-\d+/(\d+|\*)$')
+
+class Downloader(object):
+    """Fetch lookaside objects concurrently, reusing connections and
+    bounding the number of concurrent requests per host.
+
+    Objects are downloaded to <path>.part, hashed as they arrive, and
+    renamed into place once verified; a lock file per object keeps
+    concurrent processes from downloading the same object twice.  An
+    interrupted download is resumed with a Range request, both within
+    a run (up to @retries times) and on the next one.  Data that fails
+    verification is moved to the mirror's quarantine/ directory, so it
+    can never be linked into a checkout.
+    """
+    max_redirects = 5
+
+    def __init__(self, jobs=4, per_host=4, timeout=60, retries=3):
+        self.jobs = jobs
+        self.retries = retries
+        self.pool = ConnectionPool(timeout=timeout)
+        self.host_limiter = HostLimiter(per_host)
+
+    def _get(self, url, headers):
+        """Issue a GET for @url, returning (connection, response) once
+        the response headers are in.  A reused connection that the
+        server has since closed is retried once on a fresh one."""
+        headers = dict(headers)
+        headers['Connection'] = 'keep-alive'
+        while True:
+            (conn, reused) = self.pool.get(url)
+            try:
+                conn.request('GET', _request_path(url), headers=headers)
+                return (conn, conn.getresponse())
+            except (http_client.HTTPException, IOError, OSError):
+                conn.close()
+                if not reused:
+                    raise
+
+    def _resume_state(self, partial, hashtype):
+        """Return (hasher, size) covering what is already in @partial."""
+        hasher = hashlib.new(hashtype)
+        size = 0
+        try:
+            f = open(partial, 'rb')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return (hasher, 0)
+        with f:
+            while True:
+                buf = f.read(65536)
+                if not buf:
+                    break
+                hasher.update(buf)
+                size += len(buf)
+        return (hasher, size)
+
+    def _fetch_to(self, url, partial, hashtype):
+        """Download @url into the file @partial, continuing from what it
+        already holds when the server allows; returns a hasher over the
+        complete file."""
+        (hasher, offset) = self._resume_state(partial, hashtype)
+        for _ in range(self.max_redirects + 2):
+            headers = {}
+            if offset > 0:
+                headers['Range'] = 'bytes={0}-'.format(offset)
+            with self.host_limiter.limit(url):
+                (conn, resp) = self._get(url, headers)
+                try:
+                    if resp.status in (301, 302, 303, 307, 308):
+                        location = resp.getheader('Location')
+                        resp.read()
+                        if location is None:
+                            raise DownloadError("Redirect without Location from {0}".format(url))
+                        url = urljoin(url, location)
+                        continue
+                    if resp.status == 206:
+                        m = _content_range_re.match(resp.getheader('Content-Range', ''))
+                        if m is None or int(m.group(1)) != offset:
+                            raise DownloadError("Invalid Content-Range from {0}".format(url))
+                        mode = 'ab'
+                    elif resp.status == 416 and offset > 0:
+                        # Whatever we have is unusable; start over
+                        resp.read()
+                        (hasher, offset) = (hashlib.new(hashtype), 0)
+                        continue
+                    elif resp.status == 200:
+                        # No range support, or a fresh download
+                        (hasher, offset) = (hashlib.new(hashtype), 0)
+                        mode = 'wb'
+                    else:
+                        resp.read()
+                        raise DownloadError("Failed to download {0}: HTTP {1} {2}".format(
+                            url, resp.status, resp.reason))
+                    expected = resp.getheader('Content-Length')
+                    received = 0
+                    with open(partial, mode) as f:
+                        while True:
+                            buf = resp.read(65536)
+                            if not buf:
+                                break
+                            hasher.update(buf)
+                            f.write(buf)
+                            received += len(buf)
+                    # read(amt) returns short data rather than raising
+                    # when the connection drops early.
+                    if expected is not None and received < int(expected):
+                        conn.close()
+                        raise http_client.IncompleteRead(b'', int(expected) - received)
+                    return hasher
+                finally:
+                    if resp.isclosed() and not resp.will_close and conn.sock is not None:
+                        self.pool.put(url, conn)
+                    else:
+                        conn.close()
+        raise DownloadError("Too many redirects for {0}".format(url))
+
+    def download(self, obj):
+        """Ensure @obj exists in the mirror; returns True if it was
+        downloaded, False if it was already present."""
+        if os.path.exists(obj.path):
+            return False
+        dirname = os.path.dirname(obj.path)
+        try:
+            os.makedirs(dirname)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with object_lock(obj.path):
+            # Someone else may have finished it while we waited
+            if os.path.exists(obj.path):
+                return False
+            partial = obj.path + '.part'
+            attempt = 0
+            while True:
+                try:
+                    hasher = self._fetch_to(obj.url, partial, obj.hashtype)
+                    break
+                except (http_client.HTTPException, IOError, OSError) as e:
+                    # The partial file is kept, so we pick up where
+                    # we left off.
+                    attempt += 1
+                    if attempt > self.retries:
+                        raise
+                    log("Retrying download of {0} after error: {1}".format(obj.url, e))
+            if hasher.hexdigest() != obj.hash:
+                dest = quarantine_object(obj.path, partial)
+                raise DownloadError("Checksum mismatch for {0}: expected {1} {2}, got {3}; moved to {4}".format(
+                    obj.url, obj.hashtype, obj.hash, hasher.hexdigest(), dest))
+            os.chmod(partial, 0o644)
+            os.rename(partial, obj.path)
+        return True
+
+    def download_all(self, objects):
+        """Download every object in @objects that is missing from the
+        mirror.  Returns a list of (object, error message) for the ones
+        that failed."""
+        # Several components may share a source file
+        unique = collections.OrderedDict()
+        for obj in objects:
+            unique.setdefault(obj.path, obj)
+
+        def fetch_one(obj):
+            try:
+                if self.download(obj):
+                    log("Downloaded {0}".format(obj.url))
+                return None
+            except (DownloadError, http_client.HTTPException, IOError, OSError) as e:
+                return (obj, str(e))
+        try:
+            results = JobPool(self.jobs).map(fetch_one, list(unique.values()))
+        finally:
+            self.pool.close()
+        return [result for result in results if result is not None]
+
+class PrepSourcesError(Exception):
+    pass
+
+class PrepSourcesClient(object):
+    """Client for a long-lived `rpkg-prep-sources --server` process.
+
+    The process is started on first use.  If that happens before the
+    srcsnap worker processes are forked, they all share it: requests
+    are serialized with a lock that works across processes.
+    """
+    def __init__(self, argv):
+        self.argv = list(argv) + ['--server']
+        self._lock = multiprocessing.Lock()
+        self._proc = None
+        self._pid = None
+        self._counter = 0
+
+    def start(self):
+        if self._proc is None:
+            self._proc = subprocess.Popen(self.argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          universal_newlines=True)
+            self._pid = os.getpid()
+
+    def request(self, op, **args):
+        """Send one request and wait for its reply; raises
+        PrepSourcesError if it failed."""
+        with self._lock:
+            self.start()
+            self._counter += 1
+            request_id = '{0}-{1}'.format(os.getpid(), self._counter)
+            request = dict(args)
+            request['op'] = op
+            request['id'] = request_id
+            self._proc.stdin.write(json.dumps(request) + '\n')
+            self._proc.stdin.flush()
+            line = self._proc.stdout.readline()
+            if not line:
+                raise PrepSourcesError("{0} exited unexpectedly".format(self.argv[0]))
+            response = json.loads(line)
+            if response.get('id') != request_id:
+                raise PrepSourcesError("Mismatched reply from {0}: {1}".format(self.argv[0], line))
+        if not response.get('ok'):
+            raise PrepSourcesError(response.get('error', 'unknown error'))
+
+    def close(self):
+        # Only the process that started the server shuts it down
+        if self._proc is None or self._pid != os.getpid():
+            return
+        self._proc.stdin.close()
+        self._proc.wait()
+        self._proc.stdout.close()
+        self._proc = None
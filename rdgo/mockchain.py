@@ -33,11 +33,25 @@ import os
 import tempfile
 import shutil
 import re
+import threading
+import time
 
-import mockbuild.util
-
-from . import specfile
+# Building needs mock and the rpm bindings, but scheduling builds
+# doesn't, so that can be tested without them.
+try:
+    import mockbuild.util
+except ImportError:
+    mockbuild = None
+try:
+    from . import specfile
+except ImportError:
+    specfile = None
+from . import trace
 from .utils import fatal, ensuredir, run_sync, rmrf
+from .jobs import JobPool
+from .buildgraph import BuildGraph
+from .buildtimes import PhaseTimer, component_name, format_duration, schedule
+from .dircache import DirCache, json_digest
 
 # all of the variables below are substituted by the build system
 __VERSION__ = "unreleased_version"
@@ -51,14 +65,25 @@ config_opts = {}
 
 SRPMBuild = collections.namedtuple('SRPMBuild', ['filename', 'rpmwith', 'rpmwithout', 'rpmbuildopts', 'networking'])
 
+# A mock chroot we can build in; each has its own --uniqueext and --configdir
+MockRoot = collections.namedtuple('MockRoot', ['uniqueext', 'config_path', 'mockcfg_path'])
+
 def log(msg):
     print(msg)
 
-def createrepo(path):
+def _pkg_name(filename):
+    return os.path.basename(filename.rstrip('/')).replace('.srcsnap', '')
+
+def createrepo(path, pkglist=None):
+    # mock's dnf only uses the XML metadata, so skip the sqlite
+    # databases; --update reuses the metadata of unchanged packages
+    # rather than reading every RPM again.
+    comm = ['/usr/bin/createrepo_c', '--no-database']
     if os.path.exists(path + '/repodata/repomd.xml'):
-        comm = ['/usr/bin/createrepo_c', '--update', path]
-    else:
-        comm = ['/usr/bin/createrepo_c', path]
+        comm.append('--update')
+    if pkglist is not None:
+        comm.extend(['--pkglist', pkglist])
+    comm.append(path)
     run_sync(comm)
 
 REPOS_ID = []
@@ -117,6 +142,50 @@ priority=1
         br_dest.write("config_opts[%r] = %r\n" % (k, v))
     br_dest.close()
 
+def copy_tree_reflinked(src, dest):
+    """Chroot contents may be modified in place, so they can't share
+    inodes; reflinks are copy-on-write where the filesystem supports
+    them, and a plain copy otherwise."""
+    subprocess.check_call(['cp', '-a', '--reflink=auto', src, dest])
+
+def built_rpms(resdir):
+    """Filenames of the binary packages in the mock result directory
+    @resdir."""
+    if not os.path.isdir(resdir):
+        return []
+    return sorted(fn for fn in os.listdir(resdir) if fn.endswith('.rpm') and not fn.endswith('.src.rpm'))
+
+def rpm_name(filename):
+    """The package name of the rpm @filename (name-version-release.arch.rpm)."""
+    return filename[:-len('.rpm')].rsplit('.', 1)[0].rsplit('-', 2)[0]
+
+class ChrootCache(DirCache):
+    """Populated mock chroots, keyed by the mock configuration and the
+    build dependencies installed in them.  Keys include a time bucket of
+    @max_age seconds, so updates to the base distribution are picked up
+    eventually."""
+    def __init__(self, path, max_bytes=0, max_age=24 * 60 * 60):
+        DirCache.__init__(self, path, max_bytes=max_bytes, copy_tree=copy_tree_reflinked)
+        self.max_age = max(1, max_age)
+
+    def key(self, mockcfg_path, local_repo, buildrequires, local_rpms=()):
+        """@local_rpms are the filenames, and so the versions, of
+        packages from @local_repo which will be installed in the
+        chroot."""
+        with open(mockcfg_path) as f:
+            config = f.read()
+        # The local repository alternates between build-0 and build-1;
+        # mock rewrites the package manager config on each run anyway.
+        config = config.replace(local_repo, '@LOCAL_REPO@')
+        return json_digest({'config': config,
+                            'buildrequires': sorted(buildrequires),
+                            'local-rpms': sorted(local_rpms),
+                            'epoch': int(time.time() // self.max_age)})
+
+def srpm_buildrequires(srpm):
+    out = subprocess.check_output(['rpm', '-qp', '--requires', srpm])
+    return [line.strip() for line in out.decode('UTF-8').split('\n') if line.strip() != '']
+
 def postprocess_mock_resultdir(resdir, success):
     statelog = resdir + '/state.log'
     status = 'unknown'
@@ -141,12 +210,48 @@ def postprocess_mock_resultdir(resdir, success):
     with open(resdir + '/status.json', 'w') as f:
         json.dump({'status': status}, f)
 
+def compute_build_graph(pkgs):
+    """Order @pkgs by the BuildRequires of each srcsnap's spec against
+    the Provides of the others.  Graph nodes are package filenames."""
+    buildrequires = {}
+    provides = {}
+    for pkg in pkgs:
+        fn = pkg.filename
+        if not fn.endswith('/'):
+            log("No build dependency information for {0}".format(os.path.basename(fn)))
+            continue
+        spec = specfile.Spec(fn + specfile.spec_fn(spec_dir=fn))
+        (buildrequires[fn], provides[fn]) = spec.get_build_deps(pkg.rpmwith, pkg.rpmwithout)
+    graph = BuildGraph.from_requires([pkg.filename for pkg in pkgs], buildrequires, provides)
+    for fn in graph.self_deps:
+        log("Ignoring self-BuildRequires of {0}".format(_pkg_name(fn)))
+    for cycle in graph.cycles:
+        log("Dependency cycle among {0}; building them in snapshot order".format(
+            ' '.join(_pkg_name(fn) for fn in cycle)))
+    for fn in graph.nodes:
+        if len(graph.deps[fn]) > 0:
+            log("{0} needs: {1}".format(_pkg_name(fn),
+                                        ' '.join(sorted(_pkg_name(dep) for dep in graph.deps[fn]))))
+    return graph
+
+def build_costs(graph, build_times):
+    """Estimated duration of building each node of @graph, from
+    @build_times (a BuildTimes)."""
+    estimates = build_times.estimates(set(component_name(fn) for fn in graph.nodes))
+    return dict((fn, estimates[component_name(fn)]) for fn in graph.nodes)
+
 class MockChain(object):
-    def __init__(self, root, local_repo, append_chroot_install=[]):
+    def __init__(self, root, local_repo, append_chroot_install=[], jobs=1,
+                 chroot_cache=None, build_times=None):
         self.root = root
         self.local_repo = local_repo
-
-        self._config_path = None
+        self._chroot_cache = chroot_cache
+        self._build_times = build_times
+        self._root_paths = {}
+        self._graph = None
+        # Critical path length of each package, used to pick which
+        # ready package to build next
+        self._priority = {}
 
         mock_pkgpythondir = None
         r = re.compile('^PKGPYTHONDIR="([^"]+)"')
@@ -162,60 +267,160 @@ class MockChain(object):
                         break
         if mock_pkgpythondir is None:
             fatal("Failed to parse PKGPYTHONDIR from /usr/sbin/mock")
+        if mockbuild is None:
+            fatal("Failed to import mockbuild; is mock installed?")
 
         global config_opts
         config_opts = mockbuild.util.load_config('/etc/mock', self.root, None, __VERSION__, mock_pkgpythondir)
 
-        self._uniqueext = 'mockchain-{}'.format(os.getpid())
-
         self._local_tmp_dir = tempfile.mkdtemp('mockchain')
 
         if not os.path.exists(self.local_repo):
             os.makedirs(self.local_repo, mode=0o755)
 
-        log("results dir: %s" % self.local_repo)
-        self._config_path = os.path.normpath(self._local_tmp_dir + '/configs/' + config_opts['chroot_name'] + '/')
+        # Packages built earlier which chroot_setup_cmd installs in
+        # every root, along with the rest of their builds
+        self._setup_rpms = []
+        for dirname in sorted(os.listdir(self.local_repo)):
+            rpms = built_rpms(os.path.join(self.local_repo, dirname))
+            if any(rpm_name(fn) in append_chroot_install for fn in rpms):
+                self._setup_rpms.extend(rpms)
 
-        if not os.path.exists(self._config_path):
-            os.makedirs(self._config_path, mode=0o755)
-        log("config dir: %s" % self._config_path)
+        log("results dir: %s" % self.local_repo)
 
         # Generate a new config
-        self._mockcfg_path = os.path.join(self._config_path, "{0}.cfg".format(config_opts['chroot_name']))
-        hackily_mutate_mock_config(config_opts['config_file'], self._mockcfg_path, 'file://' + self.local_repo, 'local_build_repo',
+        chroot_name = config_opts['chroot_name']
+        mockcfg_tmp = os.path.join(self._local_tmp_dir, "{0}.cfg".format(chroot_name))
+        hackily_mutate_mock_config(config_opts['config_file'], mockcfg_tmp, 'file://' + self.local_repo, 'local_build_repo',
                                    append_chroot_install)
 
-        # these files needed from the mock.config dir to make mock run
-        for fn in ['site-defaults.cfg', 'logging.ini']:
-            pth = '/etc/mock/' + fn
-            shutil.copyfile(pth, self._config_path + '/' + fn)
+        # Set up one chroot per concurrent build
+        self._roots = []
+        for i in range(max(1, jobs)):
+            config_path = os.path.normpath('{0}/configs-{1}/{2}/'.format(self._local_tmp_dir, i, chroot_name))
+            if not os.path.exists(config_path):
+                os.makedirs(config_path, mode=0o755)
+            log("config dir: %s" % config_path)
+            mockcfg_path = os.path.join(config_path, "{0}.cfg".format(chroot_name))
+            shutil.copyfile(mockcfg_tmp, mockcfg_path)
+            # these files needed from the mock.config dir to make mock run
+            for fn in ['site-defaults.cfg', 'logging.ini']:
+                pth = '/etc/mock/' + fn
+                shutil.copyfile(pth, config_path + '/' + fn)
+            self._roots.append(MockRoot('mockchain-{0}-{1}'.format(os.getpid(), i),
+                                        config_path, mockcfg_path))
+
+        # Builds in other roots may finish concurrently; only one
+        # createrepo may update local_repo at a time.
+        self._createrepo_lock = threading.Lock()
+        # Result directories mock is currently writing to
+        self._building = set()
+        # Packages built since the last createrepo
+        self._unindexed = set()
 
         # createrepo on it
-        createrepo(self.local_repo)
+        self._createrepo()
+
+    def _createrepo(self):
+        with self._createrepo_lock:
+            self._createrepo_unlocked()
+
+    def _createrepo_unlocked(self):
+        """Called with _createrepo_lock held"""
+        # Only index finished results; rpms in directories another root
+        # is building into may be partially written.
+        pkglist = []
+        for (dirpath, dirnames, filenames) in os.walk(self.local_repo):
+            if dirpath in self._building:
+                dirnames[:] = []
+                continue
+            dirnames[:] = [d for d in dirnames if d != 'repodata']
+            for fn in filenames:
+                if fn.endswith('.rpm'):
+                    pkglist.append(os.path.relpath(dirpath + '/' + fn, self.local_repo))
+        pkglist_path = self._local_tmp_dir + '/pkglist'
+        with open(pkglist_path, 'w') as f:
+            for fn in sorted(pkglist):
+                f.write(fn + '\n')
+        createrepo(self.local_repo, pkglist=pkglist_path)
+        self._unindexed.clear()
+
+    def _refresh_repo_for(self, needed):
+        """Run createrepo if any package in @needed (filenames) was built
+        since it last ran; if @needed is None, if anything was.  Returns
+        the seconds createrepo took, not counting waiting for other
+        roots' createrepo, or None if it didn't need to run."""
+        with self._createrepo_lock:
+            if len(self._unindexed) == 0:
+                return None
+            if needed is not None and len(self._unindexed & needed) == 0:
+                return None
+            log("Updating {0} for {1} newly built package(s)".format(self.local_repo, len(self._unindexed)))
+            start = time.time()
+            self._createrepo_unlocked()
+            return time.time() - start
+
+    def flush_repo(self):
+        """Ensure local_repo includes everything built so far."""
+        return self._refresh_repo_for(None)
+
+    def _pkg_resdir(self, pkg):
+        return self._resdir(pkg.filename)
+
+    def _resdir(self, filename):
+        if filename.endswith('/'):
+            pdn = os.path.basename(filename.replace('.srcsnap/', ''))
+        else:
+            pdn = os.path.basename(filename).replace('.temp.src.rpm', '')
+        return os.path.normpath('%s/%s' % (self.local_repo, pdn))
 
-    def _get_mock_base_argv(self):
+    def _get_mock_base_argv(self, root=None):
+        root = root or self._roots[0]
         return ['/usr/bin/mock',
-                '--configdir', self._config_path,
-                '--uniqueext', self._uniqueext, '-r', self._mockcfg_path]
+                '--configdir', root.config_path,
+                '--uniqueext', root.uniqueext, '-r', root.mockcfg_path]
 
-    def _run_mock_sync(self, *argv):
-        argv = self._get_mock_base_argv() + list(argv)
+    def _run_mock_sync(self, root, *argv):
+        argv = self._get_mock_base_argv(root) + list(argv)
         run_sync(argv)
 
-    def do_clean_root(self):
-        self._run_mock_sync('--clean')
+    def do_clean_root(self, root=None):
+        self._run_mock_sync(root, '--clean')
+
+    def _root_path(self, root):
+        path = self._root_paths.get(root.uniqueext)
+        if path is None:
+            argv = self._get_mock_base_argv(root) + ['--print-root-path']
+            path = subprocess.check_output(argv).decode('UTF-8').strip().rstrip('/')
+            self._root_paths[root.uniqueext] = path
+        return path
+
+    def _prepare_root(self, root, key, populate_argv):
+        """Set up @root from the chroot cache entry @key, or populate it
+        by running mock with @populate_argv and add it to the cache.
+        Returns the extra mock arguments needed to reuse it."""
+        if self._chroot_cache is None:
+            return []
+        root_path = self._root_path(root)
+        self.do_clean_root(root)
+        ensuredir(os.path.dirname(root_path))
+        if self._chroot_cache.copy_out(key, root_path):
+            log("Reusing cached chroot {0}".format(key))
+        else:
+            self._run_mock_sync(root, '--old-chroot', *populate_argv)
+            self._chroot_cache.insert(key, root_path)
+        return ['--no-clean']
 
-    def do_one_build(self, pkg):
+    def do_one_build(self, pkg, root=None, timer=None):
+        if timer is None:
+            timer = PhaseTimer()
         is_srcsnap = pkg.filename.endswith('/')
 
         if is_srcsnap:
-            pdn = os.path.basename(pkg.filename.replace('.srcsnap/', ''))
             srpm = None
         else:
-            pdn = os.path.basename(pkg.filename).replace('.temp.src.rpm', '')
-            srpm = pkg
-        resdir = '%s/%s' % (self.local_repo, pdn)
-        resdir = os.path.normpath(resdir)
+            srpm = pkg.filename
+        resdir = self._pkg_resdir(pkg)
         resdir_src = resdir + '/srpm'
         ensuredir(resdir_src)
 
@@ -232,25 +437,50 @@ class MockChain(object):
         if is_srcsnap:
             pkgdir = pkg.filename[:-1]
             spec_fn = pkg.filename + '/' + specfile.spec_fn(spec_dir=pkg.filename)
-            self._run_mock_sync('--old-chroot',
-                                '--buildsrpm',
-                                '--spec', spec_fn,
-                                '--sources', pkgdir,
-                                '--resultdir', resdir_src,
-                                '--no-cleanup-after')
+            # Building the srpm needs nothing beyond the base chroot, so
+            # every srcsnap shares one cached chroot for it.
+            reuse_args = []
+            if self._chroot_cache is not None:
+                key = self._chroot_cache.key(root.mockcfg_path, self.local_repo, ['(srpm)'],
+                                             self._setup_rpms)
+                with timer.phase('chroot'):
+                    reuse_args = self._prepare_root(root, key, ['--init'])
+            with timer.phase('srpm'):
+                self._run_mock_sync(root, '--old-chroot',
+                                    '--buildsrpm',
+                                    '--spec', spec_fn,
+                                    '--sources', pkgdir,
+                                    '--resultdir', resdir_src,
+                                    '--no-cleanup-after',
+                                    *reuse_args)
             for n in os.listdir(resdir_src):
                 if n.endswith('.src.rpm'):
                     srpm = resdir_src + '/' + n
                     break
             if srpm is None:
                 fatal("Failed to find .src.rpm in {0}".format(resdir_src))
-            self.do_clean_root()
-
-        mockcmd = self._get_mock_base_argv()
+            if self._chroot_cache is None:
+                self.do_clean_root(root)
+
+        reuse_args = []
+        if self._chroot_cache is not None:
+            # So are the exact packages of this build chain which may
+            # be installed, so rebuilding one invalidates the chroot.
+            local_rpms = list(self._setup_rpms)
+            if self._graph is not None and pkg.filename in self._graph.deps:
+                for fn in self._graph.transitive_deps(pkg.filename):
+                    local_rpms.extend(built_rpms(self._resdir(fn)))
+            key = self._chroot_cache.key(root.mockcfg_path, self.local_repo,
+                                         srpm_buildrequires(srpm), local_rpms)
+            with timer.phase('chroot'):
+                reuse_args = self._prepare_root(root, key, ['--installdeps', srpm])
+
+        mockcmd = self._get_mock_base_argv(root)
         mockcmd.extend(['--nocheck',  # Tests should run after builds
                         '--old-chroot', # Since we'll be running in a container
                         '--resultdir', resdir,
                         '--no-cleanup-after'])
+        mockcmd.extend(reuse_args)
 
         if pkg.rpmbuildopts:
             # Note: this implementation will have trouble when there
@@ -268,80 +498,180 @@ class MockChain(object):
             mockcmd.append('--enable-network')
         mockcmd.append(srpm)
         print('Executing: {0}'.format(subprocess.list2cmdline(mockcmd)))
-        cmd = subprocess.Popen(mockcmd)
-        cmd.wait()
+        with timer.phase('rpmbuild'):
+            cmd = subprocess.Popen(mockcmd)
+            cmd.wait()
         success = cmd.returncode == 0
         postprocess_mock_resultdir(resdir, success)
 
         if success:
             if 'PRESERVE_TEMP' not in os.environ:
                 rmrf(srpm)
+            # Failed builds often stop early, so only successes say
+            # how long a component takes.  The phases cover all of the
+            # mock work, from setting up the chroot (within the srpm
+            # and rpmbuild phases when there is no chroot cache) to
+            # rpmbuild, plus any createrepo this build triggered.
+            if self._build_times is not None:
+                self._build_times.record(component_name(pkg.filename), timer.phases)
 
         return 1 if success else 0
 
+    def _build_pass(self, pkgs, graph):
+        """Build @pkgs, spreading them across our roots.  A package is
+        only started once everything it depends on in @graph has been
+        built; packages whose dependencies failed are not attempted.
+        Returns the lists (built, failed, blocked), the latter two in
+        the same order as @pkgs."""
+        by_filename = dict((pkg.filename, pkg) for pkg in pkgs)
+        pending = [fn for fn in graph.order() if fn in by_filename]
+        unfinished = set(by_filename)
+        cond = threading.Condition()
+        built = []
+        failed = []
+        blocked = []
+
+        def next_ready():
+            """Called with cond held; returns the ready package with the
+            longest critical path, or None if the pass is complete."""
+            while True:
+                ready = []
+                for fn in list(pending):
+                    deps = graph.deps[fn]
+                    if any(dep in failed or dep in blocked for dep in deps):
+                        log("Not building {0}: a dependency failed".format(_pkg_name(fn)))
+                        pending.remove(fn)
+                        blocked.append(fn)
+                        unfinished.discard(fn)
+                        cond.notify_all()
+                        continue
+                    if not any(dep in unfinished for dep in deps):
+                        ready.append(fn)
+                if len(ready) > 0:
+                    fn = max(ready, key=lambda fn: self._priority.get(fn, 0))
+                    pending.remove(fn)
+                    return by_filename[fn]
+                if len(pending) == 0:
+                    return None
+                cond.wait()
+
+        def finish(pkg, result_list):
+            with cond:
+                if result_list is not None:
+                    result_list.append(pkg.filename)
+                unfinished.discard(pkg.filename)
+                cond.notify_all()
+
+        def root_worker(root):
+            while True:
+                with cond:
+                    pkg = next_ready()
+                if pkg is None:
+                    return
+                # Make sure anything this build needs is in the repo;
+                # without dependency information, assume it's everything.
+                # Only the time createrepo itself ran is recorded, not
+                # waiting for other roots to finish theirs.
+                timer = PhaseTimer()
+                with trace.span('createrepo', cat='build'):
+                    if pkg.filename in graph.deps:
+                        seconds = self._refresh_repo_for(graph.transitive_deps(pkg.filename))
+                    else:
+                        seconds = self.flush_repo()
+                if seconds is not None:
+                    timer.add('createrepo', seconds)
+                resdir = self._pkg_resdir(pkg)
+                with self._createrepo_lock:
+                    self._building.add(resdir)
+                try:
+                    log("Start build: {}".format(pkg))
+                    with trace.span('build', cat='build', package=_pkg_name(pkg.filename)):
+                        ret = self.do_one_build(pkg, root, timer)
+                    log("End build: {}".format(pkg))
+                except BaseException:
+                    finish(pkg, failed)
+                    raise
+                finally:
+                    with self._createrepo_lock:
+                        self._building.discard(resdir)
+                if ret == 0:
+                    log("Error building %s" % os.path.basename(pkg.filename))
+                    if 'PRESERVE_TEMP' not in os.environ:
+                        self.do_clean_root(root)
+                    finish(pkg, failed)
+                elif ret == 1:
+                    log("Success building %s" % os.path.basename(pkg.filename))
+                    self.do_clean_root(root)
+                    # createrepo is deferred until a build needs this
+                    with self._createrepo_lock:
+                        self._unindexed.add(pkg.filename)
+                    finish(pkg, built)
+                elif ret == 2:
+                    log("Skipping already built pkg %s" % os.path.basename(pkg.filename))
+                    finish(pkg, None)
+
+        roots = self._roots[0:max(1, min(len(self._roots), len(pkgs)))]
+        JobPool(len(roots)).map(root_worker, roots)
+
+        def in_order(fns):
+            return [pkg for pkg in pkgs if pkg.filename in fns]
+        return ([by_filename[fn] for fn in built], in_order(failed), in_order(blocked))
+
     def build(self, pkgs):
         _pkgs = []
         for pkg in pkgs:
             if not isinstance(pkg, SRPMBuild):
-                pkg = SRPMBuild(pkg, [], [], False)
+                pkg = SRPMBuild(pkg, [], [], [], False)
             _pkgs.append(pkg)
         pkgs = _pkgs
         for pkg in pkgs:
             if not pkg.filename.endswith(('.src.rpm', '/')):
                 fatal("%s doesn't appear to be an rpm or srcsnap directory - skipping" % pkg)
 
+        with trace.span('build graph'):
+            graph = self._graph = compute_build_graph(pkgs)
+        if self._build_times is not None:
+            costs = build_costs(graph, self._build_times)
+            self._priority = graph.critical_paths(costs.get)
+            plan = schedule(graph, costs, len(self._roots))
+            if len(plan) > 0:
+                log("Estimated build time: {0}".format(format_duration(max(b.end for b in plan))))
+
         built_pkgs = []
-        try_again = True
         to_be_built = pkgs
         return_code = 0
         num_of_tries = 0
-        while try_again:
+        while True:
             num_of_tries += 1
-            failed = []
-            for pkg in to_be_built:
-                log("Start build: {}".format(pkg))
-                ret = self.do_one_build(pkg)
-                log("End build: {}".format(pkg))
-                if ret == 0:
-                    failed.append(pkg)
-                    log("Error building %s" % os.path.basename(pkg.filename))
-                    if len(pkgs) > 1:
-                        log("Will try to build again (if some other package will succeed).")
-                        if 'PRESERVE_TEMP' not in os.environ:
-                            self.do_clean_root()
-                    else:
-                        if 'PRESERVE_TEMP' not in os.environ:
-                            self.do_clean_root()
-                elif ret == 1:
-                    log("Success building %s" % os.path.basename(pkg.filename))
-                    self.do_clean_root()
-                    built_pkgs.append(pkg)
-                    # createrepo with the new pkgs
-                    createrepo(self.local_repo)
-                elif ret == 2:
-                    log("Skipping already built pkg %s" % os.path.basename(pkg.filename))
-
-            if failed:
-                if len(failed) != len(to_be_built):
-                    to_be_built = failed
-                    try_again = True
-                    log('Some package succeeded, some failed.')
-                    log('Trying to rebuild %s failed pkgs, because --recurse is set.' % len(failed))
-                else:
-                    log("Tried %s times - following pkgs could not be successfully built:" % num_of_tries)
-                    for pkg in failed:
-                        log(pkg)
-                    try_again = False
-                    return_code = 2
+            (built, failed, blocked) = self._build_pass(to_be_built, graph)
+            built_pkgs.extend(built)
+
+            if not failed and not blocked:
+                break
+            unbuilt = [pkg for pkg in to_be_built if pkg in failed or pkg in blocked]
+            if failed and len(built) > 0:
+                # The graph only knows about declared BuildRequires; a
+                # failure may still be due to a dependency it missed
+                # (e.g. on a file or a macro-generated name), so give
+                # the failures one more chance against the new builds.
+                to_be_built = unbuilt
+                self.flush_repo()
+                log('Some package succeeded, some failed.')
+                log('Retrying %s unbuilt pkgs in case of undeclared build dependencies.' % len(unbuilt))
             else:
-                try_again = False
-                if failed:
-                    return_code = 2
-
+                log("Tried %s times - following pkgs could not be successfully built:" % num_of_tries)
+                for pkg in unbuilt:
+                    log(pkg)
+                return_code = 2
+                break
+
+        self.flush_repo()
+        if self._chroot_cache is not None:
+            self._chroot_cache.prune()
         log("Results out to: %s" % self.local_repo)
         log("Pkgs built: %s" % len(built_pkgs))
         if built_pkgs:
-            if failed:
+            if return_code != 0:
                 if len(built_pkgs):
                     log("Some packages successfully built in this order:")
             else:
@@ -0,0 +1,127 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Profiling of a whole subcommand; see the global --profile option in
+# main.in.  Deterministic profiles (cProfile, of the main thread) are
+# written in pstats format; with a .collapsed or .folded file name,
+# the stacks of all threads are instead sampled and written in the
+# collapsed format used by flamegraph.pl and speedscope.
+
+import os
+import sys
+import pstats
+import cProfile
+import threading
+import collections
+
+ENV_VAR = 'RDGO_PROFILE'
+COLLAPSED_SUFFIXES = ('.collapsed', '.folded')
+DEFAULT_TOP = 20
+
+def default_path(command):
+    return 'rpmdistro-gitoverlay-{0}.prof'.format(command)
+
+def pop_option(argv, environ=os.environ):
+    """Remove leading --profile[=FILE] options from @argv (after the
+    program name).  Returns None if profiling isn't requested, '' for
+    the default file, or the file name; $RDGO_PROFILE is used likewise
+    if no option is given, with 1 meaning the default file."""
+    profile = environ.get(ENV_VAR)
+    if profile == '1':
+        profile = ''
+    elif profile is not None and profile.strip() == '':
+        profile = None
+    while len(argv) > 1 and (argv[1] == '--profile' or argv[1].startswith('--profile=')):
+        profile = argv.pop(1)[len('--profile='):]
+    return profile
+
+def _frame_name(code):
+    return '{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+class StackSampler(object):
+    """Counts the stacks of every other thread, sampled every @interval
+    seconds from a background thread."""
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        me = threading.current_thread().ident
+        while not self._stop.wait(self.interval):
+            for (tid, frame) in sys._current_frames().items():  # pylint: disable=protected-access
+                if tid == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as f:
+            for (stack, count) in sorted(self.stacks.items()):
+                f.write('{0} {1}\n'.format(stack, count))
+
+    def print_summary(self, stream, top=DEFAULT_TOP):
+        own = collections.Counter()
+        total = collections.Counter()
+        for (stack, count) in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        samples = sum(self.stacks.values())
+        stream.write("{0} samples; functions with the most samples on top of the stack:\n".format(samples))
+        stream.write("  own%  total%  function\n")
+        for (name, count) in own.most_common(top):
+            stream.write("{0:5.1f}  {1:6.1f}  {2}\n".format(100.0 * count / samples,
+                                                            100.0 * total[name] / samples, name))
+
+def profile_call(func, path, top=DEFAULT_TOP, stream=None):
+    """Return func(), profiled.  The profile is written to @path, and a
+    summary of the @top entries to @stream (default stderr), even if
+    func() raises or exits."""
+    if stream is None:
+        stream = sys.stderr
+    if path.endswith(COLLAPSED_SUFFIXES):
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            return func()
+        finally:
+            sampler.stop()
+            sampler.write_collapsed(path)
+            sampler.print_summary(stream, top)
+            stream.write("Wrote sampled profile to {0}\n".format(path))
+    else:
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func)
+        finally:
+            profiler.dump_stats(path)
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(top)
+            stream.write("Wrote profile to {0}\n".format(path))
@@ -59,6 +59,21 @@ def release_parts(release):
 def has_macros(s):
     return s.find('%{') != -1
 
+def _dep_names(value):
+    """Names from a dependency list like "foo >= 1.0, bar baz"."""
+    names = []
+    for part in re.split(r'[\s,]+', value.strip()):
+        if part == '' or part[0] in '<>=' or part[0].isdigit():
+            continue
+        names.append(part)
+    return names
+
+def _header_strings(header, tag):
+    values = header[tag] or []
+    if isinstance(values, (bytes, str)):
+        values = [values]
+    return [v.decode('utf-8') if isinstance(v, bytes) else v for v in values]
+
 class Spec(object):
     """
     Lazy .spec file parser and editor.
@@ -97,6 +112,48 @@ class Spec(object):
                 raise Exception("Error parsing spec: {0}".format(e))
         return self._rpmspec
 
+    def get_build_deps(self, rpmwith=(), rpmwithout=()):
+        """Return (buildrequires, provides) as sets of names, for the
+        given --with/--without conditionals.  This uses rpm's parser
+        when possible, and falls back to scanning the text, which
+        can't evaluate macros or conditionals."""
+        for w in rpmwith:
+            rpm.addMacro('_with_' + w, '--with-' + w)
+        for w in rpmwithout:
+            rpm.addMacro('_without_' + w, '--without-' + w)
+        try:
+            self._rpmspec = None
+            spec = self.rpmspec
+            buildrequires = set(_header_strings(spec.sourceHeader, rpm.RPMTAG_REQUIRENAME))
+            provides = set()
+            for pkg in spec.packages:
+                provides.update(_header_strings(pkg.header, rpm.RPMTAG_NAME))
+                provides.update(_header_strings(pkg.header, rpm.RPMTAG_PROVIDENAME))
+            return (buildrequires, provides)
+        except Exception:  # pylint: disable=broad-except
+            return self._scan_build_deps()
+        finally:
+            self._rpmspec = None
+            for w in rpmwith:
+                rpm.delMacro('_with_' + w)
+            for w in rpmwithout:
+                rpm.delMacro('_without_' + w)
+
+    def _scan_build_deps(self):
+        buildrequires = set()
+        for m in re.finditer(r'^BuildRequires:\s*(.+)$', self.txt, flags=re.M):
+            buildrequires.update(_dep_names(m.group(1)))
+        name = self.get_tag('Name', expand_macros=False)
+        provides = set([name])
+        for m in re.finditer(r'^%package\s+(-n\s+)?(\S+)', self.txt, flags=re.M):
+            if m.group(1):
+                provides.add(m.group(2))
+            else:
+                provides.add(name + '-' + m.group(2))
+        for m in re.finditer(r'^Provides:\s*(.+)$', self.txt, flags=re.M):
+            provides.update(_dep_names(m.group(1)))
+        return (buildrequires, provides)
+
     def expand_macro(self, macro):
         return rpm.expandMacro(macro)
 
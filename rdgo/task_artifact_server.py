@@ -0,0 +1,41 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import argparse
+
+from .utils import log
+from .task import Task
+from .artifact_server import ArtifactServer
+
+class TaskArtifactServer(Task):
+    def run(self, argv):
+        parser = argparse.ArgumentParser(description="Serve a build artifact cache over HTTP, for build --artifact-cache-url")
+        parser.add_argument('root', help='Directory to store cached builds in')
+        parser.add_argument('--bind', action='store', default='127.0.0.1',
+                            help='Address to listen on (default 127.0.0.1)')
+        parser.add_argument('--port', action='store', type=int, default=8080,
+                            help='Port to listen on (default 8080)')
+        opts = parser.parse_args(argv)
+
+        server = ArtifactServer((opts.bind, opts.port), opts.root)
+        log("Serving {0} on {1}".format(server.root, server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -24,11 +24,14 @@ import subprocess
 import shutil
 import hashlib
 
+from . import trace
 from .swappeddir import SwappedDirectory
-from .utils import log, fatal, rmrf, ensure_clean_dir, run_sync
+from .utils import log, fatal, rmrf, ensure_clean_dir, run_sync, parse_size
 from .task import Task
 from .git import GitMirror
-from .mockchain import MockChain, SRPMBuild
+from .mockchain import MockChain, SRPMBuild, ChrootCache, compute_build_graph, build_costs
+from .buildtimes import BuildTimes, component_name, format_duration, schedule
+from .artifactcache import ArtifactCache, RemoteArtifactCache, artifact_key, mock_config_text
 
 def require_key(conf, key):
     try:
@@ -95,6 +98,57 @@ class TaskBuild(Task):
         if len(retained) > 0:
             log("Retaining partial sucessful builds: {0}".format(' '.join(retained)))
 
+    def _load_buildstate(self, path):
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _srpm_build(self, component):
+        return SRPMBuild(self.snapshotdir + '/' + component['srcsnap'] + '/',
+                         component['rpmwith'],
+                         component['rpmwithout'],
+                         component['rpmbuildopts'],
+                         component.get('build-network', False))
+
+    def _plan(self, snapshot, caches, build_times, jobs):
+        """Print the builds which are needed, in the order they would
+        likely start, and an estimate of how long they will take."""
+        needed = []
+        for component in snapshot['components']:
+            reusable = False
+            for cache in caches:
+                cachedstate = cache.get(component['pkgname'])
+                if cachedstate is None:
+                    continue
+                if component.get('self-buildrequires', False) or cachedstate['hashv0'] == self._json_hash(component):
+                    reusable = True
+                    break
+            if not reusable:
+                needed.append(component)
+        if len(needed) == 0:
+            print("No build needed.")
+            return
+        # As in run(), srpmroot packages are built first, on their own
+        phases = [[c for c in needed if c.get('srpmroot') is True],
+                  [c for c in needed if c.get('srpmroot') is not True]]
+        offset = 0
+        for components in phases:
+            if len(components) == 0:
+                continue
+            graph = compute_build_graph([self._srpm_build(c) for c in components])
+            costs = build_costs(graph, build_times)
+            plan = schedule(graph, costs, jobs)
+            for build in plan:
+                name = component_name(build.node)
+                note = '' if build_times.estimate(name) is not None else '  (no history)'
+                print("{0:>8} {1:>8}  {2}{3}".format(format_duration(offset + build.start),
+                                                     format_duration(offset + build.end),
+                                                     name, note))
+            offset += max(build.end for build in plan)
+        print("Estimated build time for {0} components with {1} jobs: {2}".format(
+            len(needed), jobs, format_duration(offset)))
+
     def _copy_previous_build(self, cachedstate, fromdir):
         cached_dirname = cachedstate['dirname']
         oldrpmdir = fromdir + '/' + cached_dirname
@@ -111,8 +165,37 @@ class TaskBuild(Task):
                             help='Create or update timestamp on target path if a change occurred')
         parser.add_argument('--logdir', action='store', default=None,
                             help='Store build logs in this directory')
+        parser.add_argument('-j', '--jobs', action='store', type=int, default=1,
+                            help='Number of packages to build concurrently, each in its own mock root')
+        parser.add_argument('--chroot-cache', action='store', default=None,
+                            help='Reuse populated mock chroots stored in this directory')
+        parser.add_argument('--chroot-cache-size', action='store', type=parse_size, default=parse_size('20G'),
+                            help='Evict least recently used cached chroots beyond this size (default 20G)')
+        parser.add_argument('--artifact-cache', action='store', default=None,
+                            help='Share successful builds through this directory, e.g. between workdirs on this host')
+        parser.add_argument('--artifact-cache-size', action='store', type=parse_size, default=parse_size('50G'),
+                            help='Evict least recently used cached builds beyond this size (default 50G)')
+        parser.add_argument('--artifact-cache-url', action='store', default=None,
+                            help='Share successful builds through this HTTP server (see artifact-server)')
+        parser.add_argument('--artifact-cache-no-upload', action='store_true',
+                            help='Only download from --artifact-cache-url, never upload to it')
+        parser.add_argument('--chroot-cache-max-age', action='store', type=float, default=24,
+                            help='Hours after which cached chroots are repopulated, to pick up distribution updates (default 24)')
+        parser.add_argument('--plan', action='store_true',
+                            help='Only print the needed builds and an estimate of how long they take, from the times of past builds; artifact caches are not consulted')
+        parser.add_argument('--trace', action='store', default=None,
+                            help='Write timings of each step to this file, in Chrome trace event format')
         opts = parser.parse_args(argv)
 
+        if opts.trace is not None:
+            trace.enable(opts.trace)
+        try:
+            with trace.span('build'):
+                self._build(opts)
+        finally:
+            trace.write()
+
+    def _build(self, opts):
         snapshot = self.get_snapshot()
 
         root = require_key(snapshot, 'root')
@@ -125,9 +208,21 @@ class TaskBuild(Task):
         self.builddir = SwappedDirectory(self.workdir + '/build')
         # Contains any artifacts from a previous run that did succeed
         self.partialbuilddir = self.workdir + '/build.partial'
-        
+        build_times = BuildTimes(self.workdir + '/buildtimes.json')
+
+        if opts.plan:
+            self._plan(snapshot, [self._load_buildstate(self.builddir.path + '/buildstate.json'),
+                                  self._load_buildstate(self.partialbuilddir + '/buildstate.json')],
+                       build_times, opts.jobs)
+            return
+
         self.newbuilddir = self.builddir.prepare(save_partial_dir=self.partialbuilddir)
 
+        chroot_cache = None
+        if opts.chroot_cache is not None:
+            chroot_cache = ChrootCache(opts.chroot_cache, max_bytes=opts.chroot_cache_size,
+                                       max_age=int(opts.chroot_cache_max_age * 60 * 60))
+
         # Support including mock .cfg files next to overlay.yml
         if root_mock.endswith('.cfg') and not os.path.isabs(root_mock):
             target_root_mock = os.path.join(self.workdir, root_mock)
@@ -137,16 +232,28 @@ class TaskBuild(Task):
                 contextdir = os.path.dirname(os.path.realpath(self.workdir + '/overlay.yml'))
                 root_mock = os.path.join(contextdir, root_mock)
 
-        oldcache_path = self.builddir.path + '/buildstate.json'
-        oldcache = {}
-        if os.path.exists(oldcache_path):
-            with open(oldcache_path) as f:
-                oldcache = json.load(f)
-        partial_path = self.partialbuilddir + '/buildstate.json'
-        partial_cache = {}
-        if os.path.exists(partial_path):
-            with open(partial_path) as f:
-                partial_cache = json.load(f)
+        artifact_cache = None
+        if opts.artifact_cache is not None:
+            artifact_cache = ArtifactCache(opts.artifact_cache, max_bytes=opts.artifact_cache_size)
+        remote_cache = None
+        if opts.artifact_cache_url is not None:
+            remote_cache = RemoteArtifactCache(opts.artifact_cache_url)
+        use_artifacts = artifact_cache is not None or remote_cache is not None
+        mock_config = None
+        # Every other build root has the srpmroot packages installed,
+        # so their keys are part of the key of every other build.
+        srpmroot_keys = {}
+        if use_artifacts:
+            mock_config = mock_config_text(root_mock)
+            for component in snapshot['components']:
+                if component.get('srpmroot') is True:
+                    srpmroot_keys[component['pkgname']] = artifact_key(self.snapshotdir + '/' + component['srcsnap'],
+                                                                       mock_config, component)
+        # Artifact cache keys of the builds we use, and of those we run
+        artifact_keys = {}
+
+        oldcache = self._load_buildstate(self.builddir.path + '/buildstate.json')
+        partial_cache = self._load_buildstate(self.partialbuilddir + '/buildstate.json')
         newcache = {}
         newcache_path = self.newbuilddir + '/buildstate.json'
 
@@ -189,11 +296,25 @@ class TaskBuild(Task):
             srcsnap = component['srcsnap']
             newcache[distgit_name] = {'hashv0': component_hash,
                                       'dirname': srcsnap.replace('.srcsnap','')}
-            needed_builds.append((component, SRPMBuild(self.snapshotdir + '/' + srcsnap + '/',
-                                                       component['rpmwith'],
-                                                       component['rpmwithout'],
-                                                       component['rpmbuildopts'],
-                                                       component.get('build-network', False))))
+            if use_artifacts and not component.get('self-buildrequires', False):
+                if component.get('srpmroot') is True:
+                    key = srpmroot_keys[distgit_name]
+                else:
+                    key = artifact_key(self.snapshotdir + '/' + srcsnap, mock_config, component, srpmroot_keys)
+                artifact_keys[distgit_name] = key
+                dirname = newcache[distgit_name]['dirname']
+                artifact_dir = self.newbuilddir + '/' + dirname
+                if artifact_cache is not None and artifact_cache.copy_out(key, artifact_dir):
+                    log("Reusing build from artifact cache: {0}".format(dirname))
+                    need_createrepo = True
+                    continue
+                if remote_cache is not None and remote_cache.fetch(key, artifact_dir):
+                    log("Reusing build from {0}: {1}".format(remote_cache.url, dirname))
+                    if artifact_cache is not None:
+                        artifact_cache.insert(key, artifact_dir)
+                    need_createrepo = True
+                    continue
+            needed_builds.append((component, self._srpm_build(component)))
             need_createrepo = True
 
         # At this point we've consumed any previous partial results, so clean up the dir.
@@ -209,8 +330,10 @@ class TaskBuild(Task):
                     regbuilds.append((component, build))
             if len(srpmroot_builds) > 0:
                 print("Performing SRPM root bootstrap for {}".format([x[0]['pkgname'] for x in srpmroot_builds]))
-                mc = MockChain(root_mock, self.newbuilddir)
-                rc = mc.build([x[1] for x in srpmroot_builds])
+                with trace.span('mockchain', srpmroot=True):
+                    mc = MockChain(root_mock, self.newbuilddir, jobs=opts.jobs,
+                                   chroot_cache=chroot_cache, build_times=build_times)
+                    rc = mc.build([x[1] for x in srpmroot_builds])
                 if rc != 0:
                     fatal("{0} failed: bootstrap mockchain exited with code {1}".format(os.path.basename(self.newbuilddir), rc))
             # This assumes that the srpm generates a binary of the same name.
@@ -219,12 +342,26 @@ class TaskBuild(Task):
                 if component.get('srpmroot') is True:
                     srpmroot_pkgnames.append(component['pkgname'])
             print("Extra SRPM root packages: {}".format(srpmroot_pkgnames))
-            mc = MockChain(root_mock, self.newbuilddir, append_chroot_install=srpmroot_pkgnames)
-            rc = mc.build([x[1] for x in regbuilds])
+            with trace.span('mockchain', srpmroot=False):
+                mc = MockChain(root_mock, self.newbuilddir, append_chroot_install=srpmroot_pkgnames,
+                               jobs=opts.jobs, chroot_cache=chroot_cache, build_times=build_times)
+                rc = mc.build([x[1] for x in regbuilds])
             if opts.logdir is not None:
                 ensure_clean_dir(opts.logdir)
             self._postprocess_results(self.newbuilddir, snapshot=snapshot, needed_builds=needed_builds,
                                       newcache=newcache, logdir=opts.logdir)
+            for (component, _) in needed_builds:
+                distgit_name = component['pkgname']
+                # Failed builds were dropped from newcache
+                if distgit_name not in newcache or distgit_name not in artifact_keys:
+                    continue
+                key = artifact_keys[distgit_name]
+                artifact_dir = self.newbuilddir + '/' + newcache[distgit_name]['dirname']
+                if artifact_cache is not None:
+                    artifact_cache.insert(key, artifact_dir)
+                if remote_cache is not None and not opts.artifact_cache_no_upload:
+                    if remote_cache.store(key, artifact_dir):
+                        log("Uploaded {0} to {1}".format(os.path.basename(artifact_dir), remote_cache.url))
             with open(newcache_path, 'w') as f:
                 json.dump(newcache, f, sort_keys=True)
             if rc != 0:
@@ -232,9 +369,14 @@ class TaskBuild(Task):
         elif need_createrepo:
             log("No build neeeded, but component set changed")
 
+        if artifact_cache is not None:
+            artifact_cache.prune(keep=set(artifact_keys.values()))
+
         if need_createrepo:
-            run_sync(['createrepo_c', '--no-database', '--update', '.'], cwd=self.newbuilddir)
+            # After builds, MockChain has already left the repodata
+            # up to date.
             if len(needed_builds) == 0:
+                run_sync(['createrepo_c', '--no-database', '--update', '.'], cwd=self.newbuilddir)
                 with open(newcache_path, 'w') as f:
                     json.dump(newcache, f, sort_keys=True)
 
@@ -0,0 +1,252 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+import os
+import errno
+import time
+import argparse
+import collections
+
+from .utils import fatal, log, rmrf, parse_size
+from .basetask_resolve import BaseTaskResolve
+from .dircache import tree_size
+from .lookaside import VALID_HASHTYPES, object_key, parse_sources
+from .usageindex import UsageIndex
+
+# A collectable entry of one of the stores in src/: @store is 'mirror'
+# or 'object', @key its usage index key.
+GCEntry = collections.namedtuple('GCEntry', ['store', 'key', 'path', 'size', 'last_used'])
+
+# Top-level directories of src/ which do not hold git mirrors
+_NON_MIRROR_DIRS = ['lookaside', 'srcsnap-cache', '_tmp']
+
+def select_evictions(entries, referenced, max_bytes):
+    """Pick entries to remove so that the total size of @entries fits
+    in @max_bytes, least recently used first.  Entries whose
+    (store, key) is in @referenced are never picked, even if that
+    means staying over budget."""
+    total = sum(entry.size for entry in entries)
+    evict = []
+    for entry in sorted(entries, key=lambda entry: (entry.last_used, entry.key)):
+        if total <= max_bytes:
+            break
+        if (entry.store, entry.key) in referenced:
+            continue
+        evict.append(entry)
+        total -= entry.size
+    return evict
+
+class TaskGC(BaseTaskResolve):
+    def __init__(self):
+        BaseTaskResolve.__init__(self)
+        self.dry_run = False
+
+    def _remove(self, path, reason):
+        log("{0} {1}: {2}".format('Would remove' if self.dry_run else 'Removing', reason,
+                                  os.path.relpath(path, self.srcdir)))
+        if not self.dry_run:
+            rmrf(path)
+
+    def _remove_empty_parents(self, path, top):
+        path = os.path.dirname(path)
+        while path != top and path.startswith(top + '/'):
+            try:
+                os.rmdir(path)
+            except OSError as e:
+                if e.errno in (errno.ENOTEMPTY, errno.EEXIST, errno.ENOENT):
+                    return
+                raise
+            path = os.path.dirname(path)
+
+    def _referenced(self, snapshot):
+        """Return the set of (store, key) which the snapshot needs: the
+        mirrors of every component and distgit (and, recursively, of
+        their submodules at the snapshotted revisions), and the
+        lookaside objects listed in the distgits' sources files."""
+        referenced = set()
+        pending = []
+        for component in snapshot['components']:
+            if component.get('src') is not None:
+                pending.append((component['src'], component['revision']))
+            distgit = component.get('distgit')
+            if distgit is None:
+                continue
+            pending.append((distgit['src'], distgit['revision']))
+            if '://' not in distgit['src']:
+                continue
+            mirrordir = self.mirror._get_mirrordir(distgit['src'])
+            if not os.path.isdir(mirrordir):
+                continue
+            sources = self.mirror.query(mirrordir).read_blob(distgit['revision'] + ':sources')
+            if sources is None:
+                continue
+            for (hashtype, hashval, filename) in parse_sources(sources.decode('UTF-8')):
+                try:
+                    referenced.add(('object', object_key(hashtype, hashval)))
+                except ValueError as e:
+                    log("Ignoring source {0} of {1}: {2}".format(filename, distgit['name'], e))
+        visited = set()
+        while pending:
+            (url, rev) = pending.pop()
+            # Local overrides are not mirrored
+            if '://' not in url or (url, rev) in visited:
+                continue
+            visited.add((url, rev))
+            mirrordir = self.mirror._get_mirrordir(url)
+            referenced.add(('mirror', self.mirror.mirror_key(mirrordir)))
+            if not os.path.isdir(mirrordir):
+                continue
+            for module in self.mirror._list_submodules_at(mirrordir, url, rev):
+                pending.append((module.url, module.checksum))
+        return referenced
+
+    def _find_mirrors(self, dirpath, stale):
+        """Yield the path of every mirror under @dirpath; leftovers of
+        interrupted clones are appended to @stale."""
+        for name in sorted(os.listdir(dirpath)):
+            path = dirpath + '/' + name
+            if name.startswith('.') or not os.path.isdir(path) or os.path.islink(path):
+                continue
+            if dirpath == self.srcdir and name in _NON_MIRROR_DIRS:
+                continue
+            if name.endswith('.tmp'):
+                stale.append(path)
+            elif os.path.isfile(path + '/HEAD') and os.path.isdir(path + '/objects'):
+                yield path
+            else:
+                for mirrordir in self._find_mirrors(path, stale):
+                    yield mirrordir
+
+    def _find_objects(self, stale, partial):
+        """Yield (key, path) of every object in the lookaside mirror;
+        lock files are appended to @stale and partial downloads to
+        @partial."""
+        for hashtype in VALID_HASHTYPES:
+            typedir = self.lookaside_mirror + '/' + hashtype
+            if not os.path.isdir(typedir):
+                continue
+            for prefix in sorted(os.listdir(typedir)):
+                prefixdir = typedir + '/' + prefix
+                if not os.path.isdir(prefixdir):
+                    continue
+                for name in sorted(os.listdir(prefixdir)):
+                    path = prefixdir + '/' + name
+                    if name.endswith('.lock'):
+                        stale.append(path)
+                    elif name.endswith('.part'):
+                        partial.append(path)
+                    else:
+                        yield ('{0}/{1}/{2}'.format(hashtype, prefix, name), path)
+
+    def _clean_temporary(self, stale, partial, max_age):
+        """Remove what interrupted runs left behind.  Partial downloads
+        can still be resumed, so like quarantined objects they are only
+        removed once older than @max_age seconds."""
+        now = time.time()
+        tmpdir = self.srcdir + '/_tmp'
+        if os.path.isdir(tmpdir):
+            for name in sorted(os.listdir(tmpdir)):
+                self._remove(tmpdir + '/' + name, 'temporary file')
+        for path in stale:
+            self._remove(path, 'stale temporary file')
+        aged = list(partial)
+        quarantine = self.lookaside_mirror + '/quarantine'
+        for (dirpath, _, filenames) in os.walk(quarantine):
+            aged.extend(dirpath + '/' + name for name in sorted(filenames))
+        for path in aged:
+            if now - os.lstat(path).st_mtime > max_age:
+                self._remove(path, 'old download')
+
+    def run(self, argv):
+        parser = argparse.ArgumentParser(description="Remove unused git mirrors and source objects from src/")
+        parser.add_argument('--max-size', action='store', type=parse_size, default=0,
+                            help='Keep the most recently used mirrors and source objects within this total size '
+                                 '(e.g. 50G); those the current snapshot uses are always kept. '
+                                 'The default 0 removes everything the snapshot does not use.')
+        parser.add_argument('--temp-max-age', action='store', type=float, default=7,
+                            help='Remove partial downloads and quarantined objects older than this many days')
+        parser.add_argument('-n', '--dry-run', action='store_true',
+                            help='Only print what would be removed')
+
+        opts = parser.parse_args(argv)
+        self.dry_run = opts.dry_run
+
+        srcdir = self.workdir + '/src'
+        if not os.path.isdir(srcdir):
+            fatal("Missing src/ directory; run 'rpmdistro-gitoverlay init'?")
+        if os.path.islink(srcdir):
+            fatal("src/ directory is a symbolic link; is this a thin clone?")
+
+        self._load_overlay()
+
+        lock = self._lock_srcdir(exclusive=True, blocking=False)
+        if lock is None:
+            fatal("src/ is in use; is resolve running?")
+        try:
+            snapshot = self.get_snapshot()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            fatal("Missing snapshot/snapshot.json; run 'rpmdistro-gitoverlay resolve' first")
+
+        try:
+            referenced = self._referenced(snapshot)
+        finally:
+            self.mirror.close()
+
+        stale = []
+        partial = []
+        mirrors = list(self._find_mirrors(self.srcdir, stale))
+        objects = list(self._find_objects(stale, partial))
+        self._clean_temporary(stale, partial, opts.temp_max_age * 24 * 60 * 60)
+
+        # Entries from before the usage index existed fall back to
+        # their modification time.
+        mirror_usage = self.mirror.usage.load()
+        object_usage = UsageIndex(self.lookaside_mirror)
+        object_times = object_usage.load()
+        entries = []
+        for path in mirrors:
+            key = self.mirror.mirror_key(path)
+            last_used = mirror_usage.get(key) or os.stat(path).st_mtime
+            entries.append(GCEntry('mirror', key, path, tree_size(path), last_used))
+        for (key, path) in objects:
+            stbuf = os.lstat(path)
+            entries.append(GCEntry('object', key, path, stbuf.st_size,
+                                   object_times.get(key) or stbuf.st_mtime))
+
+        evict = select_evictions(entries, referenced, opts.max_size)
+        for entry in evict:
+            self._remove(entry.path, 'unused ' + ('git mirror' if entry.store == 'mirror' else 'source object'))
+            if not self.dry_run:
+                self._remove_empty_parents(entry.path, self.srcdir if entry.store == 'mirror'
+                                           else self.lookaside_mirror)
+
+        if not self.dry_run:
+            evicted = set((entry.store, entry.key) for entry in evict)
+            present = set((entry.store, entry.key) for entry in entries) - evicted
+            self.mirror.usage.compact(lambda key: ('mirror', key) in present)
+            object_usage.compact(lambda key: ('object', key) in present)
+
+        total = sum(entry.size for entry in entries)
+        freed = sum(entry.size for entry in evict)
+        log("{0} {1} mirror(s) and {2} source object(s) ({3} bytes); {4} bytes remain".format(
+            'Would remove' if self.dry_run else 'Removed',
+            len([entry for entry in evict if entry.store == 'mirror']),
+            len([entry for entry in evict if entry.store == 'object']),
+            freed, total - freed))
+        lock.close()
@@ -22,11 +22,28 @@ import subprocess
 import errno
 import shutil
 import tempfile
-
-from .utils import log, fatal, ensuredir, rmrf, ensure_clean_dir, run_sync
+import time
+import sys
+import traceback
+import collections
+import multiprocessing
+
+from . import trace
+from .utils import log, fatal, ensuredir, rmrf, ensure_clean_dir, parse_size
 from .basetask_resolve import BaseTaskResolve
 from . import specfile 
 from .git import GitRemote
+from .jobs import HostLimiter
+from .dircache import DirCache, json_digest
+from .lookaside import PrepSourcesClient, PrepSourcesError
+from .archive import ARCHIVE_FORMATS, compress_writer, default_threads
+
+# Bump this whenever a change here alters the content of generated
+# srcsnaps, so that cached srcsnaps from older versions aren't reused.
+SRCSNAP_FORMAT_VERSION = 3
+
+# Exit status of `resolve --check` when the snapshot is out of date
+CHECK_CHANGED_EXIT_CODE = 10
 
 def require_key(conf, key):
     try:
@@ -34,10 +51,39 @@ def require_key(conf, key):
     except KeyError:
         fatal("Missing config key {0}".format(key))
 
+
+# The TaskResolve instance used by srcsnap worker processes; inherited
+# across fork() rather than pickled.
+_srcsnap_worker_task = None
+
+def _srcsnap_worker_init(task, worker_topdir):
+    global _srcsnap_worker_task
+    _srcsnap_worker_task = task
+    # Each worker gets a private temporary directory
+    task.tmpdir = tempfile.mkdtemp('', 'worker', worker_topdir)
+    # The parent already has whatever was traced before the fork
+    trace.take_events()
+
+def _srcsnap_worker(component):
+    """Returns (srcsnap, error, trace events)."""
+    try:
+        return (_srcsnap_worker_task._generate_srcsnap(component), None, trace.take_events())
+    except SystemExit as e:
+        # fatal() has already printed the message
+        return (None, 'exited with code {0}'.format(e.code), trace.take_events())
+    except Exception:  # pylint: disable=broad-except
+        return (None, traceback.format_exc(), trace.take_events())
+
 class TaskResolve(BaseTaskResolve):
     def __init__(self):
         BaseTaskResolve.__init__(self)
         self._srpm_mock_initialized = None
+        self.srcsnap_cache = None
+        self.archive_threads = default_threads()
+        # Exec as an external binary because pyrpkg is python 2 only, and
+        # mock is Python 3 only.  Sigh.  One long-lived process serves
+        # the whole resolve.
+        self.prep_sources = PrepSourcesClient([PKGLIBDIR + '/rpkg-prep-sources'])  # noqa pylint: disable=undefined-variable
 
     def _json_dumper(self, obj):
         if isinstance(obj, GitRemote):
@@ -45,11 +91,14 @@ class TaskResolve(BaseTaskResolve):
         else:
             return obj
 
-    def _tar_czf_with_prefix(self, dirpath, prefix, output):
-        dn = os.path.dirname(dirpath)
-        bn = os.path.basename(dirpath)
-        run_sync(['tar', '--exclude-vcs', '-czf', output, '--transform', 's,^' + bn + ',' + prefix + ',', bn],
-                 cwd=dn)
+    def _write_upstream_tarball(self, upstream_src, upstream_rev, prefix, output, fmt, level):
+        """Stream a compressed tarball of the upstream revision straight
+        from the git mirrors, with no working tree in between."""
+        log("Writing {0}".format(os.path.basename(output)))
+        with trace.span('tar', format=fmt, output=os.path.basename(output)):
+            with open(output, 'wb') as f:
+                with compress_writer(fmt, level, f, threads=self.archive_threads) as compressed:
+                    self.mirror.write_archive(upstream_src, upstream_rev, prefix, compressed)
 
     def _strip_all_prefixes(self, s, prefixes):
         for prefix in prefixes:
@@ -76,7 +125,7 @@ class TaskResolve(BaseTaskResolve):
         rpm_version = rpm_version.replace('-', '.')
         return [rpm_version, gitdesc]
 
-    def _generate_srcsnap_impl(self, component, upstream_tag, upstream_rev, upstream_co,
+    def _generate_srcsnap_impl(self, component, upstream_tag, upstream_rev, upstream_src,
                                distgit_desc, distgit_co, target):
         distgit = component.get('distgit')
         if distgit is not None:
@@ -90,114 +139,271 @@ class TaskResolve(BaseTaskResolve):
 
         [rpm_version, rpm_release] = self._rpm_verrel(component, upstream_tag, upstream_rev, distgit_desc)
 
-        spec_fn = specfile.spec_fn(spec_dir=distgit_co)
-        spec = specfile.Spec(distgit_co + '/' + spec_fn)
-
         if upstream_desc is not None:
             tar_dirname = '{0}-{1}'.format(component['name'], upstream_desc)
-            tarname = tar_dirname + '.tar.gz'
+            (archive_format, archive_level) = self._component_archive(component)
+            tarname = tar_dirname + ARCHIVE_FORMATS[archive_format].suffix
             tmp_tarpath = distgit_co + '/' + tarname
-            self._tar_czf_with_prefix(upstream_co, tar_dirname, tmp_tarpath)
-            rmrf(upstream_co)
-            has_zero = spec.get_tag('Source0', allow_empty=True) is not None
-            source_tag = 'Source'
-            if has_zero:
-                source_tag += '0'
-            spec.set_tag(source_tag, tarname)
-            # This is a currently ad-hoc convention
-            spec.set_global('commit', upstream_rev)
-            spec.set_tag('Version', rpm_version)
-            spec.set_setup_dirname(tar_dirname)
-            spec.set_tag('Release', rpm_release + '%{?dist}')
-
-        # Anything useful there you should find in upstream dist-git or equivalent.
-        spec.delete_changelog()
-        # Forcibly override
-        # spec.set_tag('Epoch', '99')
-        if patches_action in (None, 'keep'):
-            pass
-        elif patches_action == 'drop':
-            spec.wipe_patches()
-        else:
-            fatal("Component '{0}': Unknown patches action '{1}'".format(component['name'],
-                                                                         patches_action))
-        spec.save()
-        spec._txt = '# NOTE: AUTO-GENERATED by rpmdistro-gitoverlay; DO NOT EDIT\n' + spec._txt
+            self._write_upstream_tarball(upstream_src, upstream_rev, tar_dirname, tmp_tarpath,
+                                         archive_format, archive_level)
+
+        with trace.span('spec'):
+            spec_fn = specfile.spec_fn(spec_dir=distgit_co)
+            spec = specfile.Spec(distgit_co + '/' + spec_fn)
+
+            if upstream_desc is not None:
+                has_zero = spec.get_tag('Source0', allow_empty=True) is not None
+                source_tag = 'Source'
+                if has_zero:
+                    source_tag += '0'
+                spec.set_tag(source_tag, tarname)
+                # This is a currently ad-hoc convention
+                spec.set_global('commit', upstream_rev)
+                spec.set_tag('Version', rpm_version)
+                spec.set_setup_dirname(tar_dirname)
+                spec.set_tag('Release', rpm_release + '%{?dist}')
+
+            # Anything useful there you should find in upstream dist-git or equivalent.
+            spec.delete_changelog()
+            # Forcibly override
+            # spec.set_tag('Epoch', '99')
+            if patches_action in (None, 'keep'):
+                pass
+            elif patches_action == 'drop':
+                spec.wipe_patches()
+            else:
+                fatal("Component '{0}': Unknown patches action '{1}'".format(component['name'],
+                                                                             patches_action))
+            spec.save()
+            spec._txt = '# NOTE: AUTO-GENERATED by rpmdistro-gitoverlay; DO NOT EDIT\n' + spec._txt
 
         sources_path = distgit_co + '/sources'
         if os.path.exists(sources_path):
-            # Exec as an external binary because pyrpkg is python 2 only, and
-            # mock is Python 3 only.  Sigh.
-            subprocess.check_call([PKGLIBDIR + '/rpkg-prep-sources',  # noqa pylint: disable=undefined-variable
-                                   '--distgit-name='+distgit['name'],
-                                   '--distgit-url='+distgit['src'].url,
-                                   '--distgit-co='+distgit_co,
-                                   '--lookaside-mirror='+self.lookaside_mirror])
-                     
+            with trace.span('lookaside'):
+                self._prep_sources_request('prep',
+                                           **{'distgit-name': distgit['name'],
+                                              'distgit-url': distgit['src'].url,
+                                              'distgit-co': distgit_co,
+                                              'lookaside-mirror': self.lookaside_mirror})
+
         shutil.move(distgit_co, self.tmp_snapshotdir + '/' + target)
 
     def _generate_srcsnap(self, component):
-        upstream_src = component.get('src')
-        if upstream_src is not None:
-            upstream_rev = component['revision']
-            [upstream_tag, upstream_rev] = self.mirror.describe(upstream_src, upstream_rev)
-            upstream_desc = upstream_rev
-            if upstream_tag is not None:
-                upstream_desc = upstream_tag + '-' + upstream_desc
-        else:
-            upstream_rev = upstream_tag = upstream_desc = None
-
-        distgit = component.get('distgit')
-        if distgit is not None:
-            distgit_src = distgit['src']
-            distgit_rev = distgit['revision']
-            [distgit_tag, distgit_rev] = self.mirror.describe(distgit_src, distgit_rev)
-            distgit_desc = distgit_rev
-            if distgit_tag is not None:
-                distgit_desc = distgit_tag + '-' + distgit_desc
-        else:
-            distgit_desc = None
-
-        assert (upstream_desc or distgit_desc) is not None
-
-        [rpm_version, rpm_release] = self._rpm_verrel(component, upstream_tag, upstream_rev, distgit_desc)
-
-        srcsnap_name = "{0}-{1}-{2}.srcsnap".format(component['pkgname'], rpm_version, rpm_release)
-        tmpdir = tempfile.mkdtemp('', 'rdgo-srpms', self.tmpdir)
-        try:
+        with trace.span('srcsnap', component=component['name']):
+            upstream_src = component.get('src')
             if upstream_src is not None:
-                upstream_co = tmpdir + '/' + component['name']
-                self.mirror.checkout(upstream_src, upstream_rev, upstream_co)
+                upstream_rev = component['revision']
+                [upstream_tag, upstream_rev] = self.mirror.describe(upstream_src, upstream_rev)
+                upstream_desc = upstream_rev
+                if upstream_tag is not None:
+                    upstream_desc = upstream_tag + '-' + upstream_desc
             else:
-                upstream_co = None
+                upstream_rev = upstream_tag = upstream_desc = None
 
+            distgit = component.get('distgit')
             if distgit is not None:
-                distgit_topdir = tmpdir + '/' + 'distgit'
-                ensure_clean_dir(distgit_topdir)
-                # Create a directory whose name matches the module
-                # name, which helps fedpkg/rhpkg.
-                distgit_co = distgit_topdir + '/' + distgit['name']
-                self.mirror.checkout(distgit_src, distgit_rev, distgit_co)
+                distgit_src = distgit['src']
+                distgit_rev = distgit['revision']
+                [distgit_tag, distgit_rev] = self.mirror.describe(distgit_src, distgit_rev)
+                distgit_desc = distgit_rev
+                if distgit_tag is not None:
+                    distgit_desc = distgit_tag + '-' + distgit_desc
             else:
-                specfn = self._find_spec(upstream_co)
-                if specfn is None:
-                    fatal("Failed to find .spec (or .spec.in) file")
-                if specfn.endswith('.in'):
-                    dest_specfn = tmpdir + '/' + os.path.basename(specfn[:-3])
+                distgit_desc = None
+
+            assert (upstream_desc or distgit_desc) is not None
+
+            [rpm_version, rpm_release] = self._rpm_verrel(component, upstream_tag, upstream_rev, distgit_desc)
+
+            srcsnap_name = "{0}-{1}-{2}.srcsnap".format(component['pkgname'], rpm_version, rpm_release)
+            srcsnap_path = self.tmp_snapshotdir + '/' + srcsnap_name
+
+            cache_key = None
+            if self.srcsnap_cache is not None:
+                cache_key = self._srcsnap_cache_key(component, upstream_desc, distgit_desc, srcsnap_name)
+                if self.srcsnap_cache.copy_out(cache_key, srcsnap_path):
+                    log("Reusing cached srcsnap: {0}".format(srcsnap_name))
+                    return srcsnap_name
+
+            tmpdir = tempfile.mkdtemp('', 'rdgo-srpms', self.tmpdir)
+            try:
+                if distgit is not None:
+                    distgit_topdir = tmpdir + '/' + 'distgit'
+                    ensure_clean_dir(distgit_topdir)
+                    # Create a directory whose name matches the module
+                    # name, which helps fedpkg/rhpkg.
+                    distgit_co = distgit_topdir + '/' + distgit['name']
+                    self.mirror.checkout(distgit_src, distgit_rev, distgit_co)
                 else:
-                    dest_specfn = tmpdir
-                shutil.copy2(specfn, dest_specfn)
-                distgit_co = tmpdir
+                    specfn = self._find_spec(component['name'],
+                                             self.mirror.list_files(upstream_src, upstream_rev))
+                    if specfn is None:
+                        fatal("Failed to find .spec (or .spec.in) file")
+                    dest_specfn = tmpdir + '/' + os.path.basename(specfn)
+                    if specfn.endswith('.in'):
+                        dest_specfn = dest_specfn[:-3]
+                    with open(dest_specfn, 'wb') as f:
+                        f.write(self.mirror.read_file(upstream_src, upstream_rev, specfn))
+                    distgit_co = tmpdir
+
+                self._generate_srcsnap_impl(component, upstream_tag, upstream_rev, upstream_src,
+                                            distgit_desc, distgit_co,
+                                            srcsnap_name)
+            finally:
+                if 'PRESERVE_TEMP' not in os.environ:
+                    rmrf(tmpdir)
+            if cache_key is not None:
+                self.srcsnap_cache.insert(cache_key, srcsnap_path)
+            return srcsnap_name
+
+    def _srcsnap_cache_key(self, component, upstream_desc, distgit_desc, srcsnap_name):
+        """Digest of every input that affects a srcsnap's contents."""
+        distgit = component.get('distgit') or {}
+        src = component.get('src')
+        if isinstance(src, GitRemote):
+            src = src.url
+        return json_digest({'format': SRCSNAP_FORMAT_VERSION,
+                            'srcsnap': srcsnap_name,
+                            'name': component['name'],
+                            'spec': component.get('spec'),
+                            'src': src,
+                            'revision': component.get('revision'),
+                            'upstream-desc': upstream_desc,
+                            'distgit': distgit['src'].url if distgit else None,
+                            'distgit-revision': distgit.get('revision'),
+                            'distgit-desc': distgit_desc,
+                            'patches': distgit.get('patches'),
+                            'override-version': component.get('override-version'),
+                            'defines': component.get('defines'),
+                            'archive': self._component_archive(component)})
+
+    def _prep_sources_request(self, op, **args):
+        try:
+            self.prep_sources.request(op, **args)
+        except PrepSourcesError as e:
+            fatal("rpkg-prep-sources {0} failed: {1}".format(op, e))
+
+    def _prefetch_lookaside(self, components, jobs, jobs_per_host):
+        """Download every component's missing dist-git sources in one
+        concurrent batch, reading the sources files straight from the
+        mirrors; srcsnap generation then finds them all cached."""
+        tmpdir = tempfile.mkdtemp('', 'rdgo-lookaside', self.tmpdir)
+        try:
+            bulk = []
+            for component in components:
+                distgit = component.get('distgit')
+                if distgit is None:
+                    continue
+                sources = self.mirror.read_file(distgit['src'], distgit['revision'], 'sources')
+                if not sources:
+                    continue
+                # Name the directory after the module, as for checkouts
+                sources_dir = '{0}/{1}/{2}'.format(tmpdir, len(bulk), distgit['name'])
+                ensuredir(sources_dir)
+                with open(sources_dir + '/sources', 'wb') as f:
+                    f.write(sources)
+                bulk.append({'distgit-name': distgit['name'],
+                             'distgit-url': distgit['src'].url,
+                             'sources': sources_dir + '/sources'})
+            if len(bulk) == 0:
+                return
+            # This also starts the server before any srcsnap workers
+            # are forked, so they share it.
+            self._prep_sources_request('prefetch',
+                                       **{'components': bulk,
+                                          'lookaside-mirror': self.lookaside_mirror,
+                                          'jobs': jobs,
+                                          'jobs-per-host': jobs_per_host})
+        finally:
+            rmrf(tmpdir)
 
-            self._generate_srcsnap_impl(component, upstream_tag, upstream_rev, upstream_co,
-                                        distgit_desc, distgit_co,
-                                        srcsnap_name)
+    def _generate_srcsnaps_parallel(self, components, jobs):
+        """Generate srcsnaps in a pool of worker processes, returning
+        their names in the same order as @components.  Every component
+        is attempted; failures are reported together at the end."""
+        worker_topdir = tempfile.mkdtemp('', 'rdgo-srcsnap-workers', self.tmpdir)
+        try:
+            ctx = multiprocessing.get_context('fork')
+            pool = ctx.Pool(jobs, initializer=_srcsnap_worker_init,
+                            initargs=(self, worker_topdir))
+            try:
+                results = pool.map(_srcsnap_worker, components, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
         finally:
             if 'PRESERVE_TEMP' not in os.environ:
-                rmrf(tmpdir)
-        return srcsnap_name
+                rmrf(worker_topdir)
+        failed = []
+        for (component, (_, error, events)) in zip(components, results):
+            trace.add_events(events)
+            if error is not None:
+                log("Failed to generate srcsnap for {0}: {1}".format(component['name'], error))
+                failed.append(component['name'])
+        if len(failed) > 0:
+            fatal("Failed to generate srcsnaps for {0} component(s): {1}".format(len(failed), ' '.join(failed)))
+        return [srcsnap for (srcsnap, _, _) in results]
+
+    def _snapshot_changes(self, snapshot, expanded):
+        """Compare a freshly expanded overlay against @snapshot,
+        returning a list of descriptions of what differs."""
+        new = json.loads(json.dumps(expanded, default=self._json_dumper))
+        changes = []
+        old_components = collections.OrderedDict((c['name'], c) for c in snapshot.get('components', []))
+        new_names = set()
+        for component in new['components']:
+            name = component['name']
+            new_names.add(name)
+            old = old_components.get(name)
+            if old is None:
+                changes.append('{0}: new component'.format(name))
+                continue
+            old = dict(old)
+            old.pop('srcsnap', None)
+            if old == component:
+                continue
+            details = []
+            if old.get('revision') != component.get('revision'):
+                details.append('revision {0} -> {1}'.format(old.get('revision'), component.get('revision')))
+            old_distgit = old.get('distgit') or {}
+            new_distgit = component.get('distgit') or {}
+            if old_distgit.get('revision') != new_distgit.get('revision'):
+                details.append('distgit revision {0} -> {1}'.format(old_distgit.get('revision'),
+                                                                    new_distgit.get('revision')))
+            if len(details) == 0:
+                details.append('configuration changed')
+            changes.append('{0}: {1}'.format(name, ', '.join(details)))
+        for name in old_components:
+            if name not in new_names:
+                changes.append('{0}: removed'.format(name))
+        for key in sorted((set(snapshot) | set(new)) - set(['components'])):
+            if snapshot.get(key) != new.get(key):
+                changes.append('overlay setting {0} changed'.format(key))
+        return changes
+
+    def _check(self, expanded):
+        """Report whether the snapshot is out of date, exiting with
+        CHECK_CHANGED_EXIT_CODE if so."""
+        try:
+            snapshot = self.get_snapshot()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            log("No snapshot/snapshot.json yet")
+            sys.exit(CHECK_CHANGED_EXIT_CODE)
+        changes = self._snapshot_changes(snapshot, expanded)
+        if len(changes) == 0:
+            log("No changes.")
+            return
+        for change in changes:
+            log("  " + change)
+        log("{0} change(s) since the current snapshot".format(len(changes)))
+        sys.exit(CHECK_CHANGED_EXIT_CODE)
 
     def run(self, argv):
+        """Returns the argv of a build to run next, if any.  That is
+        left to the caller to exec, once it has finished with this
+        process (e.g. written the profile of it)."""
         parser = argparse.ArgumentParser(description="Create snapshot.json")
         parser.add_argument('--tempdir', action='store', default=None,
                             help='Path to directory for temporary working files')
@@ -214,18 +420,69 @@ class TaskResolve(BaseTaskResolve):
                             help='Use with --override-gitrepo-from to specify an expected revision')
         parser.add_argument('--touch-if-changed', action='store', default=None,
                             help='Create or update timestamp on target path if a change occurred')
+        parser.add_argument('--check', action='store_true',
+                            help='Only resolve (and fetch) revisions and compare them with the current snapshot; '
+                                 'exits with status {0} if it is out of date'.format(CHECK_CHANGED_EXIT_CODE))
         parser.add_argument('-b', '--build', action='store_true', 
                             help='If fetch changes, automatically do a build')
+        parser.add_argument('-j', '--jobs', action='store', type=int, default=1,
+                            help='Number of concurrent git mirror operations and srcsnap worker processes')
+        parser.add_argument('--jobs-per-host', action='store', type=int, default=4,
+                            help='Maximum concurrent clones/fetches against a single host (0 for no limit)')
+        parser.add_argument('--probe-jobs', action='store', type=int, default=16,
+                            help='Number of concurrent ls-remote probes deciding which repositories to fetch (0 to always fetch)')
+        parser.add_argument('--download-jobs', action='store', type=int, default=8,
+                            help='Number of concurrent dist-git source downloads')
+        parser.add_argument('--no-srcsnap-cache', action='store_true',
+                            help='Regenerate every srcsnap rather than reusing unchanged ones from src/srcsnap-cache')
+        parser.add_argument('--srcsnap-cache-size', action='store', type=parse_size, default=0,
+                            help='Evict least recently used cached srcsnaps beyond this size (e.g. 20G; default unbounded)')
+        parser.add_argument('--trace', action='store', default=None,
+                            help='Write timings of each step to this file, in Chrome trace event format')
 
         opts = parser.parse_args(argv)
 
+        if opts.trace is not None:
+            trace.enable(opts.trace)
+        try:
+            with trace.span('resolve'):
+                build = self._resolve(opts)
+        finally:
+            if self.mirror is not None:
+                self.mirror.close()
+            trace.write()
+        if build:
+            return ['rpmdistro-gitoverlay', 'build']
+        return None
+
+    def _resolve(self, opts):
+        """Returns True if a build should follow."""
+
         srcdir = self.workdir + '/src'
         if not os.path.isdir(srcdir):
             fatal("Missing src/ directory; run 'rpmdistro-gitoverlay init'?")
         if os.path.islink(srcdir):
             fatal("src/ directory is a symbolic link; is this a thin clone?")
 
-        self._load_overlay()
+        if opts.check and opts.build:
+            fatal("--check and --build are mutually exclusive")
+
+        with trace.span('load overlay'):
+            self._load_overlay()
+        # Held until we exit (or exec a build)
+        self._srcdir_lock = self._lock_srcdir()
+
+        self.mirror.host_limiter = HostLimiter(opts.jobs_per_host)
+        with trace.span('expand overlay'):
+            expanded = self._expand_overlay(fetchall=opts.fetch_all, fetch=opts.fetch,
+                                            override_giturl=opts.override_giturl,
+                                            override_gitbranch=opts.override_gitbranch,
+                                            override_gitrepo_from=opts.override_gitrepo_from,
+                                            override_gitrepo_from_rev=opts.override_gitrepo_from_rev,
+                                            jobs=opts.jobs, probe_jobs=opts.probe_jobs)
+        if opts.check:
+            self._check(expanded)
+            return False
 
         self.tmpdir = opts.tempdir
         self.old_snapshotdir = self.workdir + '/old-snapshot'
@@ -235,15 +492,40 @@ class TaskResolve(BaseTaskResolve):
 
         ensuredir(self.lookaside_mirror)
 
-        expanded = self._expand_overlay(fetchall=opts.fetch_all, fetch=opts.fetch,
-                                        override_giturl=opts.override_giturl,
-                                        override_gitbranch=opts.override_gitbranch,
-                                        override_gitrepo_from=opts.override_gitrepo_from,
-                                        override_gitrepo_from_rev=opts.override_gitrepo_from_rev)
+        if not opts.no_srcsnap_cache:
+            self.srcsnap_cache = DirCache(self.srcdir + '/srcsnap-cache',
+                                          max_bytes=opts.srcsnap_cache_size)
+
+        # Share the CPUs between srcsnap workers' compressors
+        self.archive_threads = max(1, default_threads() // max(1, opts.jobs))
+
+        components = expanded['components']
+        # Describe every revision up front, one git process per mirror;
+        # srcsnap generation (including forked workers) then hits the
+        # memoized results.
+        describe_requests = []
+        for component in components:
+            if component.get('src') is not None:
+                describe_requests.append((component['src'], component['revision']))
+            distgit = component.get('distgit')
+            if distgit is not None:
+                describe_requests.append((distgit['src'], distgit['revision']))
+        self.mirror.describe_many(describe_requests)
 
-        for component in expanded['components']:
-            srcsnap = self._generate_srcsnap(component)
+        srcsnaps_start = time.time()
+        try:
+            with trace.span('prefetch lookaside'):
+                self._prefetch_lookaside(components, opts.download_jobs, opts.jobs_per_host)
+            if opts.jobs > 1:
+                srcsnaps = self._generate_srcsnaps_parallel(components, opts.jobs)
+            else:
+                srcsnaps = [self._generate_srcsnap(component) for component in components]
+        finally:
+            self.prep_sources.close()
+        for (component, srcsnap) in zip(components, srcsnaps):
             component['srcsnap'] = os.path.basename(srcsnap)
+        if self.srcsnap_cache is not None:
+            self.srcsnap_cache.prune(used_since=srcsnaps_start)
 
         snapshot_path = self.snapshotdir + '/snapshot.json'
         snapshot_tmppath = self.tmp_snapshotdir + '/snapshot.json'
@@ -267,8 +549,8 @@ class TaskResolve(BaseTaskResolve):
                 with open(opts.touch_if_changed, 'a'):
                     log("Updated timestamp of {}".format(opts.touch_if_changed))
                     os.utime(opts.touch_if_changed, None)
-            if opts.build:
-                os.execlp('rpmdistro-gitoverlay', 'rpmdistro-gitoverlay', 'build')
+            return opts.build
         else:
             rmrf(self.tmp_snapshotdir)
             log("No changes.")
+            return False
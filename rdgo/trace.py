@@ -0,0 +1,104 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Nested timed spans, written out in the Chrome trace event format
+# (load the file in chrome://tracing or https://ui.perfetto.dev).
+# Tracing is process-wide and off unless enable() is called; span()
+# is then a no-op.
+
+import os
+import json
+import time
+import threading
+import contextlib
+
+_lock = threading.Lock()
+# None when tracing is disabled
+_events = None
+_path = None
+# (pid, tid) -> thread name
+_threads = {}
+
+def enable(path):
+    """Start collecting spans, to be written to @path by write()."""
+    global _events, _path
+    with _lock:
+        _events = []
+        _path = path
+        _threads.clear()
+
+def enabled():
+    return _events is not None
+
+def _now():
+    # Wall clock rather than a monotonic one, so that events from
+    # forked worker processes line up with ours.
+    return time.time() * 1000000
+
+@contextlib.contextmanager
+def span(name, cat='rdgo', **args):
+    """Record the time spent in the body as a span named @name, with
+    the JSON-serializable @args attached."""
+    if _events is None:
+        yield
+        return
+    start = _now()
+    try:
+        yield
+    finally:
+        add_event({'name': name, 'cat': cat, 'ph': 'X',
+                   'ts': start, 'dur': _now() - start, 'args': args})
+
+def add_event(event):
+    thread = threading.current_thread()
+    event = dict(event, pid=os.getpid(), tid=thread.ident)
+    with _lock:
+        if _events is None:
+            return
+        _events.append(event)
+        _threads[(event['pid'], event['tid'])] = thread.name
+
+def take_events():
+    """Remove and return the events collected so far, e.g. to pass them
+    from a worker process to its parent."""
+    global _events
+    with _lock:
+        if _events is None:
+            return []
+        events = _events
+        _events = []
+        for ((pid, tid), name) in sorted(_threads.items()):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid,
+                           'args': {'name': name}})
+        _threads.clear()
+        return events
+
+def add_events(events):
+    """Merge @events from take_events() in another process."""
+    with _lock:
+        if _events is not None:
+            _events.extend(events)
+
+def write():
+    """Write the collected events to the path given to enable()."""
+    if _events is None:
+        return
+    events = take_events()
+    tmppath = _path + '.tmp'
+    with open(tmppath, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    os.rename(tmppath, _path)
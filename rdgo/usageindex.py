@@ -0,0 +1,92 @@
+# Copyright (C) 2016 Colin Walters <walters@verbum.org>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+# Note: this module is also used by the Python 2 rpkg-prep-sources.
+
+import os
+import time
+
+from .utils import lock_file
+
+# The index file kept at the top of each store
+INDEX_NAME = '.usage-index'
+
+class UsageIndex(object):
+    """Last-use times of the entries in a store (git mirrors, lookaside
+    objects), keyed by path relative to the store.
+
+    The index is an append-only journal of "<timestamp> <key>" lines,
+    so any number of processes can record uses cheaply and without
+    coordination; compact() rewrites it, and is what the garbage
+    collector uses.
+    """
+    def __init__(self, storedir):
+        self.storedir = storedir
+        self.path = storedir + '/' + INDEX_NAME
+
+    def _lock(self, exclusive):
+        return lock_file(self.path + '.lock', exclusive=exclusive)
+
+    def touch(self, keys, now=None):
+        """Record that @keys were used at @now (default: now)."""
+        if now is None:
+            now = time.time()
+        data = ''.join('{0} {1}\n'.format(int(now), key) for key in keys)
+        if data == '':
+            return
+        with self._lock(exclusive=False):
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                # A single O_APPEND write keeps concurrent records whole
+                os.write(fd, data.encode('UTF-8'))
+            finally:
+                os.close(fd)
+
+    def _read(self):
+        result = {}
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return result
+        with f:
+            for line in f:
+                (timestamp, _, key) = line.decode('UTF-8', 'replace').rstrip('\n').partition(' ')
+                try:
+                    timestamp = int(timestamp)
+                except ValueError:
+                    # A torn write from a crash; ignore it
+                    continue
+                if key != '' and timestamp > result.get(key, 0):
+                    result[key] = timestamp
+        return result
+
+    def load(self):
+        """Return a dict mapping each key to its last use time."""
+        with self._lock(exclusive=False):
+            return self._read()
+
+    def compact(self, keep):
+        """Rewrite the index with one record per key, dropping keys for
+        which @keep(key) is false."""
+        with self._lock(exclusive=True):
+            entries = self._read()
+            tmppath = self.path + '.tmp'
+            with open(tmppath, 'w') as f:
+                for key in sorted(entries):
+                    if keep(key):
+                        f.write('{0} {1}\n'.format(entries[key], key))
+            os.rename(tmppath, self.path)
@@ -20,9 +20,12 @@ import sys
 import stat
 import shutil
 import errno
+import fcntl
 import subprocess
 import os
 
+from . import trace
+
 def fatal(msg):
     sys.stderr.write(msg + '\n')
     sys.exit(1)
@@ -53,10 +56,24 @@ def convert_key_pair_into_commands(key_value_pairs):
     output = " ".join(output_string_list)
     return output
 
+def parse_size(value):
+    """Parse a byte count with an optional K, M, G or T suffix (powers
+    of 1024), as used by the cache size options."""
+    suffixes = {'K': 1, 'M': 2, 'G': 3, 'T': 4}
+    value = value.strip().upper()
+    if value.endswith('B'):
+        value = value[:-1]
+    exponent = 0
+    if value and value[-1] in suffixes:
+        exponent = suffixes[value[-1]]
+        value = value[:-1]
+    return int(float(value) * (1024 ** exponent))
+
 def run_sync(args, **kwargs):
     """Wraps subprocess.check_call(), logging the command line too."""
     if isinstance(args, six.string_types):
         argstr = args
+        name = args.split()[0]
     else:
         uargs = []
         for arg in args:
@@ -67,8 +84,10 @@ def run_sync(args, **kwargs):
         args = uargs
         print("{}".format(args))
         argstr = subprocess.list2cmdline(args)
+        name = args[0]
     log("Running: {0}".format(argstr))
-    subprocess.check_call(args, **kwargs)
+    with trace.span(os.path.basename(name), cat='subprocess', argv=argstr, cwd=kwargs.get('cwd')):
+        subprocess.check_call(args, **kwargs)
 
 def rmrf(path):
     try:
@@ -84,6 +103,23 @@ def rmrf(path):
             if e.errno != errno.ENOENT:
                 raise
 
+def lock_file(path, exclusive=True, blocking=True):
+    """Take a flock() on @path, creating it if needed.  Returns the open
+    file, which holds the lock until it is closed (or the process
+    exits), or None if @blocking is False and the lock is taken."""
+    f = open(path, 'a')
+    flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    if not blocking:
+        flags |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(f.fileno(), flags)
+    except IOError as e:
+        f.close()
+        if e.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        return None
+    return f
+
 def hardlink_or_copy(src, dest):
     try:
         os.link(src, dest)
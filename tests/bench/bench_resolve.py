@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+#pylint: skip-file
+"""Benchmarks of resolve against synthetic overlays of local file://
+git repositories.
+
+Each component has an upstream repository, with a chain of nested
+submodules, and a dist-git repository with a spec file and a sources
+file.  This times _expand_overlay(), _generate_srcsnap() and a full
+resolve, each both cold (a new workdir) and warm (run again), and
+writes the results as JSON.  Given a previous run's results as a
+baseline, it exits with status 1 if anything got slower by more than
+the threshold:
+
+    PYTHONPATH=. python3 tests/bench/bench_resolve.py --repos 50 --output base.json
+    PYTHONPATH=. python3 tests/bench/bench_resolve.py --repos 50 --baseline base.json
+
+There is no lookaside server; the objects listed in the sources files
+are put straight into each workdir's lookaside mirror, so only linking
+them into place is measured.  That still runs rpkg-prep-sources, which
+needs pyrpkg; use --sources 0 where it is not installed.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import subprocess
+import contextlib
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, TOPDIR)
+
+import builtins
+if not hasattr(builtins, 'PKGLIBDIR'):
+    builtins.PKGLIBDIR = TOPDIR + '/rdgo'
+
+from rdgo import lookaside
+from rdgo.dircache import DirCache
+from rdgo.task_resolve import TaskResolve
+from rdgo.utils import ensuredir, ensure_clean_dir, rmrf
+
+RESULTS_VERSION = 1
+BENCHMARKS = ['expand', 'srcsnap', 'resolve']
+
+# Fixed identities and dates make every commit id, and so every
+# srcsnap name, the same from one run to the next.
+GIT_ENV = dict(os.environ,
+               GIT_AUTHOR_NAME='Bench', GIT_AUTHOR_EMAIL='bench@example.com',
+               GIT_COMMITTER_NAME='Bench', GIT_COMMITTER_EMAIL='bench@example.com',
+               GIT_AUTHOR_DATE='2016-01-01T00:00:00Z', GIT_COMMITTER_DATE='2016-01-01T00:00:00Z')
+
+SPEC_TEMPLATE = """Name: {name}
+Version: 0
+Release: 1%{{?dist}}
+Summary: Synthetic benchmark package
+License: MIT
+Source0: {name}.tar.gz
+{sources}
+%description
+Synthetic benchmark package.
+
+%prep
+%setup -q
+
+%build
+
+%install
+
+%files
+
+%changelog
+* Fri Jan 01 2016 Bench <bench@example.com> - 0-1
+- Initial package
+"""
+
+def run_git(cwd, *args):
+    subprocess.check_call(['git', '-c', 'protocol.file.allow=always'] + list(args),
+                          cwd=cwd, env=GIT_ENV, stdout=subprocess.DEVNULL)
+
+def write_file(path, content):
+    ensuredir(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(content)
+
+class SyntheticOverlay(object):
+    """An overlay of @repos components, generated under @path.  Upstream
+    repositories have @files files of @file_size bytes, @commits
+    commits after their v1.0 tag, and a chain of @submodule_depth
+    nested submodules; dist-git sources files list @sources objects."""
+    def __init__(self, path, repos=10, submodule_depth=1, files=20, file_size=4096,
+                 commits=5, sources=1, seed=0):
+        self.path = path
+        self.repos = repos
+        self.submodule_depth = submodule_depth
+        self.files = files
+        self.file_size = file_size
+        self.commits = commits
+        self.sources = sources
+        self._random = random.Random(seed)
+        # (hashtype, hash, content) of each lookaside object
+        self.objects = []
+
+    def config(self):
+        return {'repos': self.repos, 'submodule_depth': self.submodule_depth,
+                'files': self.files, 'file_size': self.file_size,
+                'commits': self.commits, 'sources': self.sources}
+
+    def _data(self, size):
+        return bytes(self._random.getrandbits(8) for _ in range(size))
+
+    def _make_repo(self, name, files):
+        path = self.path + '/repos/' + name
+        ensuredir(path)
+        run_git(path, 'init', '-q')
+        run_git(path, 'symbolic-ref', 'HEAD', 'refs/heads/master')
+        for (filename, content) in files.items():
+            write_file(path + '/' + filename, content)
+        run_git(path, 'add', '.')
+        run_git(path, 'commit', '-q', '-m', 'Initial import')
+        return path
+
+    def _make_upstream(self, i):
+        # Innermost submodule first
+        submodule = None
+        for depth in range(self.submodule_depth, 0, -1):
+            name = 'upstream{0}-sub{1}'.format(i, depth)
+            path = self._make_repo(name, {'README': name.encode('UTF-8')})
+            if submodule is not None:
+                run_git(path, 'submodule', 'add', '-q', '../' + submodule, submodule)
+                run_git(path, 'commit', '-q', '-m', 'Add submodule')
+            submodule = name
+        name = 'upstream{0}'.format(i)
+        files = dict(('src/file{0}.dat'.format(j), self._data(self.file_size))
+                     for j in range(self.files))
+        path = self._make_repo(name, files)
+        run_git(path, 'tag', '-a', '-m', 'v1.0', 'v1.0')
+        if submodule is not None:
+            run_git(path, 'submodule', 'add', '-q', '../' + submodule, 'vendor/' + submodule)
+            run_git(path, 'commit', '-q', '-m', 'Add submodule')
+        for j in range(self.commits):
+            with open(path + '/ChangeLog', 'a') as f:
+                f.write('Change {0}\n'.format(j))
+            run_git(path, 'add', 'ChangeLog')
+            run_git(path, 'commit', '-q', '-m', 'Change {0}'.format(j))
+
+    def _make_distgit(self, i):
+        name = 'bench{0}'.format(i)
+        spec_sources = ''
+        sources = ''
+        for j in range(self.sources):
+            filename = 'data{0}-{1}.bin'.format(i, j)
+            content = self._data(self.file_size)
+            digest = hashlib.sha512(content).hexdigest()
+            self.objects.append(('sha512', digest, content))
+            spec_sources += 'Source{0}: {1}\n'.format(j + 1, filename)
+            sources += 'SHA512 ({0}) = {1}\n'.format(filename, digest)
+        files = {name + '.spec': SPEC_TEMPLATE.format(name=name, sources=spec_sources).encode('UTF-8')}
+        if self.sources > 0:
+            files['sources'] = sources.encode('UTF-8')
+        self._make_repo(name, files)
+
+    def generate(self):
+        for i in range(self.repos):
+            self._make_upstream(i)
+            self._make_distgit(i)
+        with open(self.path + '/overlay.yml', 'w') as f:
+            f.write('aliases:\n'
+                    '  - name: bench\n'
+                    '    url: file://{0}/repos/\n'
+                    'distgit:\n'
+                    '  prefix: bench\n'
+                    '  branch: master\n'
+                    'root:\n'
+                    '  mock: fedora-25-$arch\n'
+                    'components:\n'.format(self.path))
+            for i in range(self.repos):
+                f.write('  - src: bench:upstream{0}\n'
+                        '    distgit: bench{0}\n'.format(i))
+
+    def make_workdir(self, path):
+        """Create an initialized workdir for the overlay at @path, with
+        a lookaside mirror holding every source object."""
+        rmrf(path)
+        ensuredir(path + '/src')
+        with open(self.path + '/overlay.yml') as f:
+            write_file(path + '/overlay.yml', f.read().encode('UTF-8'))
+        for (hashtype, digest, content) in self.objects:
+            write_file(lookaside.object_path(path + '/src/lookaside', hashtype, digest), content)
+        return path
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """Send standard output, including that of subprocesses, to
+    /dev/null."""
+    if not enabled:
+        yield
+        return
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+def timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+def new_task(workdir):
+    # Tasks find their workdir from the current directory
+    os.chdir(workdir)
+    task = TaskResolve()
+    task._load_overlay()
+    return task
+
+def bench_expand(overlay, workdir, jobs):
+    def expand():
+        task = new_task(workdir)
+        task._expand_overlay(fetchall=True, jobs=jobs, probe_jobs=16)
+    return {'expand_overlay_cold': timed(expand),
+            'expand_overlay_warm': timed(expand)}
+
+def bench_srcsnap(overlay, workdir, jobs):
+    """Average time per component; warm runs hit the srcsnap cache."""
+    task = new_task(workdir)
+    components = task._expand_overlay(fetchall=True, jobs=jobs)['components']
+    # As TaskResolve.run() does
+    task.tmpdir = None
+    task.tmp_snapshotdir = workdir + '/snapshot.tmp'
+    ensuredir(task.lookaside_mirror)
+    task.srcsnap_cache = DirCache(task.srcdir + '/srcsnap-cache')
+    def generate():
+        ensure_clean_dir(task.tmp_snapshotdir)
+        for component in components:
+            task._generate_srcsnap(component)
+    try:
+        cold = timed(generate)
+        warm = timed(generate)
+    finally:
+        task.prep_sources.close()
+    return {'generate_srcsnap_cold': cold / len(components),
+            'generate_srcsnap_warm': warm / len(components)}
+
+def bench_resolve(overlay, workdir, jobs):
+    argv = ['--fetch-all', '-j', str(jobs)]
+    def resolve():
+        os.chdir(workdir)
+        TaskResolve().run(argv)
+    return {'resolve_cold': timed(resolve),
+            'resolve_warm': timed(resolve)}
+
+def run_benchmarks(overlay, topdir, benchmarks, jobs, repeat, verbose=False):
+    """Return the best time of @repeat runs of each benchmark, each run
+    in a new workdir."""
+    functions = {'expand': bench_expand, 'srcsnap': bench_srcsnap, 'resolve': bench_resolve}
+    results = {}
+    for name in benchmarks:
+        for i in range(repeat):
+            workdir = overlay.make_workdir('{0}/work-{1}-{2}'.format(topdir, name, i))
+            with quiet(not verbose):
+                times = functions[name](overlay, workdir, jobs)
+            os.chdir(topdir)
+            rmrf(workdir)
+            for (key, value) in times.items():
+                results[key] = min(value, results.get(key, value))
+    return results
+
+def compare(results, baseline, threshold, min_delta=0.05):
+    """Return a description of each result which is slower than in
+    @baseline by more than the fraction @threshold, and by more than
+    @min_delta seconds, which filters out noise in tiny timings."""
+    regressions = []
+    for (name, value) in sorted(results.items()):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if value > old * (1 + threshold) and value - old > min_delta:
+            regressions.append("{0}: {1:.3f}s, was {2:.3f}s (+{3:.0f}%)".format(
+                name, value, old, 100.0 * (value - old) / max(old, 1e-9)))
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark resolve with a synthetic overlay")
+    parser.add_argument('--repos', type=int, default=10, help='Number of components (default 10)')
+    parser.add_argument('--submodule-depth', type=int, default=1,
+                        help='Depth of the chain of nested submodules in each upstream (default 1)')
+    parser.add_argument('--files', type=int, default=20, help='Files in each upstream (default 20)')
+    parser.add_argument('--file-size', type=int, default=4096,
+                        help='Size in bytes of each upstream file and source object (default 4096)')
+    parser.add_argument('--commits', type=int, default=5,
+                        help='Commits in each upstream after its tag (default 5)')
+    parser.add_argument('--sources', type=int, default=1,
+                        help='Objects listed in each dist-git sources file (default 1)')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='Value for resolve -j (default 4)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs of each benchmark; the fastest is reported (default 3)')
+    parser.add_argument('--benchmarks', default=','.join(BENCHMARKS),
+                        help='Comma-separated benchmarks to run (default {0})'.format(','.join(BENCHMARKS)))
+    parser.add_argument('--output', default=None, help='Write results to this file instead of stdout')
+    parser.add_argument('--baseline', default=None,
+                        help='Results of an earlier run to compare with; exits with status 1 on a regression')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Slowdown, as a fraction, counted as a regression (default 0.2)')
+    parser.add_argument('--tempdir', default=None, help='Directory for the overlay and workdirs')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show the output of resolve')
+    opts = parser.parse_args(argv)
+
+    benchmarks = opts.benchmarks.split(',')
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark {0}".format(name))
+
+    baseline = None
+    if opts.baseline is not None:
+        with open(opts.baseline) as f:
+            baseline = json.load(f)
+
+    # Submodules use file:// URLs too
+    os.environ.update({'GIT_CONFIG_COUNT': '1',
+                       'GIT_CONFIG_KEY_0': 'protocol.file.allow',
+                       'GIT_CONFIG_VALUE_0': 'always'})
+    cwd = os.getcwd()
+    topdir = tempfile.mkdtemp('', 'rdgo-bench', opts.tempdir)
+    try:
+        overlay = SyntheticOverlay(topdir + '/overlay', repos=opts.repos,
+                                   submodule_depth=opts.submodule_depth, files=opts.files,
+                                   file_size=opts.file_size, commits=opts.commits,
+                                   sources=opts.sources)
+        generate_time = timed(overlay.generate)
+        sys.stderr.write("Generated {0} components in {1:.1f}s\n".format(opts.repos, generate_time))
+        results = run_benchmarks(overlay, topdir, benchmarks, opts.jobs, opts.repeat,
+                                 verbose=opts.verbose)
+    finally:
+        os.chdir(cwd)
+        rmrf(topdir)
+
+    config = dict(overlay.config(), jobs=opts.jobs)
+    output = {'version': RESULTS_VERSION, 'config': config, 'results': results}
+    for (name, value) in sorted(results.items()):
+        sys.stderr.write("{0:24} {1:8.3f}s\n".format(name, value))
+    if opts.output is not None:
+        with open(opts.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if baseline is not None:
+        if baseline.get('version') != RESULTS_VERSION or baseline.get('config') != config:
+            sys.stderr.write("Baseline {0} was run with different parameters: {1}\n".format(
+                opts.baseline, baseline.get('config')))
+            return 2
+        regressions = compare(results, baseline['results'], opts.threshold)
+        if len(regressions) > 0:
+            sys.stderr.write("Regressions beyond {0:.0f}%:\n".format(100 * opts.threshold))
+            for regression in regressions:
+                sys.stderr.write("  " + regression + "\n")
+            return 1
+        sys.stderr.write("No regressions beyond {0:.0f}%\n".format(100 * opts.threshold))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,40 @@
+#pylint: skip-file
+
+import gzip
+import io
+import os
+import unittest
+
+from rdgo import archive
+
+class TestArchive(unittest.TestCase):
+    """
+    Unit tests for source archive compression
+    """
+
+    def compress(self, data, threads, writes=7):
+        out = io.BytesIO()
+        with archive.ParallelGzipWriter(out, level=6, threads=threads, chunk_size=1000) as writer:
+            step = len(data) // writes + 1
+            for i in range(0, len(data), step):
+                writer.write(data[i:i+step])
+        return out.getvalue()
+
+    def test_parallel_gzip_roundtrip(self):
+        data = os.urandom(2500) + b'x' * 10000
+        self.assertEqual(gzip.decompress(self.compress(data, 4)), data)
+        self.assertEqual(gzip.decompress(self.compress(b'', 4)), b'')
+
+    def test_parallel_gzip_is_deterministic(self):
+        data = os.urandom(5000) * 3
+        self.assertEqual(self.compress(data, 1), self.compress(data, 8, writes=3))
+
+    def test_archive_settings(self):
+        self.assertEqual(archive.archive_settings({}), ('gz', 6))
+        self.assertEqual(archive.archive_settings({'format': 'zst', 'level': 19}), ('zst', 19))
+        self.assertRaises(SystemExit, archive.archive_settings, {'format': 'bz2'})
+        self.assertRaises(SystemExit, archive.archive_settings, {'format': 'gz', 'level': 0})
+        self.assertRaises(SystemExit, archive.archive_settings, {'compression': 'xz'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#pylint: skip-file
+
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from rdgo import artifactcache
+from rdgo.artifact_server import ArtifactServer
+
+class TestArtifactServer(unittest.TestCase):
+    """
+    Unit tests for the remote artifact cache and its reference server
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = ArtifactServer(('127.0.0.1', 0), self.tmpdir + '/store', quiet=True)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.cache = artifactcache.RemoteArtifactCache(self.server.url)
+        self.key = 'ab' + 'c' * 62
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def _make_build(self):
+        build = self.tmpdir + '/foo-1.0-1'
+        os.makedirs(build + '/srpm')
+        with open(build + '/foo-1.0-1.x86_64.rpm', 'wb') as f:
+            f.write(b'rpm' * 10000)
+        with open(build + '/srpm/foo-1.0-1.src.rpm', 'wb') as f:
+            f.write(b'srpm')
+        with open(build + '/status.json', 'w') as f:
+            f.write('{"status": "success"}')
+        os.symlink('foo-1.0-1.x86_64.rpm', build + '/link')
+        return build
+
+    def test_store_and_fetch(self):
+        build = self._make_build()
+        dest = self.tmpdir + '/out'
+        self.assertFalse(self.cache.fetch(self.key, dest))
+        self.assertFalse(os.path.exists(dest))
+        self.assertTrue(self.cache.store(self.key, build))
+        # Entries are immutable; a second upload is accepted but ignored
+        self.assertTrue(self.cache.store(self.key, self.tmpdir + '/foo-1.0-1/srpm'))
+        self.assertTrue(self.cache.fetch(self.key, dest))
+        self.assertEqual(sorted(os.listdir(dest)), ['foo-1.0-1.x86_64.rpm', 'link', 'srpm', 'status.json'])
+        with open(dest + '/foo-1.0-1.x86_64.rpm', 'rb') as f:
+            self.assertEqual(f.read(), b'rpm' * 10000)
+        with open(dest + '/srpm/foo-1.0-1.src.rpm', 'rb') as f:
+            self.assertEqual(f.read(), b'srpm')
+        self.assertEqual(os.readlink(dest + '/link'), 'foo-1.0-1.x86_64.rpm')
+        self.assertEqual([name for name in os.listdir(self.tmpdir) if name.endswith('.tmp')], [])
+
+    def test_invalid_paths(self):
+        for path in ['/', '/ab/../../etc/passwd', '/cd/' + self.key + '.tar', '/ab/' + self.key]:
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                urllib.request.urlopen(self.server.url + path)
+            self.assertEqual(cm.exception.code, 404)
+
+    def test_unsafe_entry(self):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w') as tar:
+            info = tarfile.TarInfo('../escape')
+            info.size = 1
+            tar.addfile(info, io.BytesIO(b'x'))
+        os.makedirs(self.server.root + '/ab')
+        with open(self.server.root + '/ab/' + self.key + '.tar', 'wb') as f:
+            f.write(buf.getvalue())
+        self.assertFalse(self.cache.fetch(self.key, self.tmpdir + '/out'))
+        self.assertFalse(os.path.exists(self.tmpdir + '/escape'))
+        self.assertFalse(os.path.exists(self.tmpdir + '/out'))
+
+    def test_unreachable(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertFalse(self.cache.fetch(self.key, self.tmpdir + '/out'))
+        self.assertFalse(self.cache.store(self.key, self._make_build()))
+        # tearDown shuts it down again
+        self.server = ArtifactServer(('127.0.0.1', 0), self.tmpdir + '/store', quiet=True)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
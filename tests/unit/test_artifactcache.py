@@ -0,0 +1,81 @@
+#pylint: skip-file
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rdgo import artifactcache
+
+class TestArtifactCache(unittest.TestCase):
+    """
+    Unit tests for the host-wide build artifact cache
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.srcsnap = self.tmpdir + '/foo.srcsnap'
+        os.makedirs(self.srcsnap + '/.git')
+        self._write(self.srcsnap + '/foo.spec', 'Name: foo\n')
+        self._write(self.srcsnap + '/foo-1.0.tar.gz', 'data')
+        self._write(self.srcsnap + '/.git/HEAD', 'ref: refs/heads/master\n')
+        self.mockcfg = self.tmpdir + '/root.cfg'
+        self._write(self.mockcfg, "config_opts['root'] = 'test'\n")
+        self.cache = artifactcache.ArtifactCache(self.tmpdir + '/cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_tree_digest(self):
+        digest = artifactcache.tree_digest(self.srcsnap)
+        # Version control metadata isn't a build input
+        self._write(self.srcsnap + '/.git/HEAD', 'something else')
+        self.assertEqual(artifactcache.tree_digest(self.srcsnap), digest)
+        os.chmod(self.srcsnap + '/foo-1.0.tar.gz', 0o755)
+        executable = artifactcache.tree_digest(self.srcsnap)
+        self.assertNotEqual(executable, digest)
+        self._write(self.srcsnap + '/foo-1.0.tar.gz', 'datb')
+        self.assertNotEqual(artifactcache.tree_digest(self.srcsnap), executable)
+        os.rename(self.srcsnap + '/foo-1.0.tar.gz', self.srcsnap + '/foo-1.1.tar.gz')
+        os.symlink('foo-1.1.tar.gz', self.srcsnap + '/link')
+        self.assertNotEqual(artifactcache.tree_digest(self.srcsnap), executable)
+
+    def test_key(self):
+        config = artifactcache.mock_config_text(self.mockcfg)
+        self.assertEqual(config[0], "config_opts['root'] = 'test'\n")
+        component = {'pkgname': 'foo', 'rpmwith': [], 'rpmwithout': [], 'rpmbuildopts': []}
+        key = artifactcache.artifact_key(self.srcsnap, config, component)
+        # Things which don't change the build don't change the key
+        self.assertEqual(artifactcache.artifact_key(self.srcsnap, config, dict(component, srcsnap='x')), key)
+        others = [artifactcache.artifact_key(self.srcsnap, config, dict(component, rpmwith=['docs'])),
+                  artifactcache.artifact_key(self.srcsnap, config, dict(component, rpmwithout=['docs'])),
+                  artifactcache.artifact_key(self.srcsnap, config, dict(component, rpmbuildopts=['--define "a b"'])),
+                  artifactcache.artifact_key(self.srcsnap, config, dict(component, **{'build-network': True})),
+                  artifactcache.artifact_key(self.srcsnap, config, component, {'bootstrap': 'a'}),
+                  artifactcache.artifact_key(self.srcsnap, config, component, {'bootstrap': 'b'}),
+                  artifactcache.artifact_key(self.srcsnap, ['other', None], component)]
+        self.assertEqual(len(set(others + [key])), len(others) + 1)
+
+    def test_mock_config_includes(self):
+        os.makedirs(self.tmpdir + '/templates')
+        self._write(self.tmpdir + '/templates/base.tpl', "include('templates/base.tpl')\n")
+        self._write(self.mockcfg, "include('templates/base.tpl')\nconfig_opts['root'] = 'test'\n")
+        config = artifactcache.mock_config_text(self.mockcfg, configdir=self.tmpdir)
+        self.assertEqual(len(config), 3)
+        self._write(self.tmpdir + '/templates/base.tpl', "config_opts['releasever'] = '26'\n")
+        self.assertNotEqual(artifactcache.mock_config_text(self.mockcfg, configdir=self.tmpdir), config)
+
+    def test_insert_and_copy_out(self):
+        build = self.tmpdir + '/build/foo-1.0-1'
+        os.makedirs(build)
+        self._write(build + '/foo-1.0-1.x86_64.rpm', 'rpm')
+        key = artifactcache.artifact_key(self.srcsnap, ['cfg'], {})
+        self.assertFalse(self.cache.copy_out(key, self.tmpdir + '/out'))
+        self.cache.insert(key, build)
+        self.assertTrue(self.cache.copy_out(key, self.tmpdir + '/out'))
+        self.assertEqual(os.stat(build + '/foo-1.0-1.x86_64.rpm').st_ino,
+                         os.stat(self.tmpdir + '/out/foo-1.0-1.x86_64.rpm').st_ino)
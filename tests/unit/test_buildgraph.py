@@ -0,0 +1,46 @@
+#pylint: skip-file
+
+import unittest
+
+from rdgo.buildgraph import BuildGraph
+
+class TestBuildGraph(unittest.TestCase):
+    """
+    Unit tests for BuildRequires-based build ordering
+    """
+
+    def test_order_follows_buildrequires(self):
+        graph = BuildGraph.from_requires(['app', 'lib', 'tool'],
+                                         {'app': ['lib-devel', 'gcc'], 'lib': ['tool']},
+                                         {'lib': ['lib', 'lib-devel'], 'tool': ['tool']})
+        self.assertEqual(graph.deps['app'], set(['lib']))
+        self.assertEqual(graph.order(), ['tool', 'lib', 'app'])
+        self.assertEqual(graph.transitive_deps('app'), set(['lib', 'tool']))
+
+    def test_independent_nodes_keep_input_order(self):
+        graph = BuildGraph.from_requires(['c', 'b', 'a'], {}, {})
+        self.assertEqual(graph.order(), ['c', 'b', 'a'])
+
+    def test_self_buildrequires(self):
+        graph = BuildGraph.from_requires(['rust'], {'rust': ['rust']}, {'rust': ['rust']})
+        self.assertEqual(graph.self_deps, ['rust'])
+        self.assertEqual(graph.deps['rust'], set())
+
+    def test_cycles_are_broken(self):
+        graph = BuildGraph.from_requires(['x', 'b', 'a', 'y'],
+                                         {'a': ['b'], 'b': ['a'], 'y': ['a'], 'x': ['y']},
+                                         {'a': ['a'], 'b': ['b'], 'y': ['y']})
+        self.assertEqual(graph.cycles, [['b', 'a']])
+        self.assertEqual(graph.deps['y'], set(['a']))
+        self.assertEqual(graph.order(), ['b', 'a', 'y', 'x'])
+
+    def test_critical_paths(self):
+        graph = BuildGraph.from_requires(['app', 'lib', 'tool', 'docs'],
+                                         {'app': ['lib'], 'lib': ['tool']},
+                                         {'lib': ['lib'], 'tool': ['tool']})
+        costs = {'app': 1, 'lib': 10, 'tool': 2, 'docs': 5}
+        self.assertEqual(graph.critical_paths(costs.get),
+                         {'app': 1, 'lib': 11, 'tool': 13, 'docs': 5})
+
+if __name__ == '__main__':
+    unittest.main()
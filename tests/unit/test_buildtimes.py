@@ -0,0 +1,68 @@
+#pylint: skip-file
+
+import json
+import shutil
+import tempfile
+import unittest
+
+from rdgo import buildtimes
+from rdgo.buildgraph import BuildGraph
+
+class TestBuildTimes(unittest.TestCase):
+    """
+    Unit tests for build time history and build scheduling
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = self.tmpdir + '/buildtimes.json'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_component_name(self):
+        self.assertEqual(buildtimes.component_name('/w/snapshot/foo-bar-1.0-1.srcsnap/'), 'foo-bar')
+        self.assertEqual(buildtimes.component_name('/tmp/foo-1.0-1.fc30.src.rpm'), 'foo')
+
+    def test_record_and_estimate(self):
+        times = buildtimes.BuildTimes(self.path)
+        self.assertEqual(times.estimates(['a']), {'a': buildtimes.DEFAULT_ESTIMATE})
+        times.record('a', {'srpm': 10, 'rpmbuild': 90})
+        times.record('a', {'srpm': 10, 'rpmbuild': 190})
+        times.record('b', {'rpmbuild': 20})
+        times.record('c', {'rpmbuild': 30})
+        with open(self.path) as f:
+            self.assertEqual(json.load(f)['components']['a']['phases'], {'srpm': 10, 'rpmbuild': 190})
+        times = buildtimes.BuildTimes(self.path)
+        self.assertEqual(times.estimate('a'), 150)
+        self.assertEqual(times.estimate('new'), None)
+        # Unknown components take as long as the median one
+        self.assertEqual(times.estimates(['a', 'new']), {'a': 150, 'new': 30})
+        for i in range(buildtimes.HISTORY_LENGTH):
+            times.record('a', {'rpmbuild': 50})
+        self.assertEqual(times.estimate('a'), 50)
+
+    def test_invalid_file(self):
+        with open(self.path, 'w') as f:
+            f.write('{')
+        self.assertEqual(buildtimes.BuildTimes(self.path).estimate('a'), None)
+
+    def test_schedule(self):
+        # A long chain which snapshot order would start last
+        graph = BuildGraph.from_requires(['small1', 'small2', 'base', 'top'],
+                                         {'top': ['base']}, {'base': ['base']})
+        costs = {'small1': 10, 'small2': 10, 'base': 50, 'top': 50}
+        plan = buildtimes.schedule(graph, costs, jobs=2)
+        self.assertEqual([b.node for b in plan], ['base', 'small1', 'small2', 'top'])
+        self.assertEqual(max(b.end for b in plan), 100)
+        self.assertEqual(plan[-1], buildtimes.ScheduledBuild('top', 50, 100, 0))
+        plan = buildtimes.schedule(graph, costs, jobs=1)
+        self.assertEqual(max(b.end for b in plan), 120)
+
+    def test_format_duration(self):
+        self.assertEqual(buildtimes.format_duration(42), '42s')
+        self.assertEqual(buildtimes.format_duration(125), '2m05s')
+        self.assertEqual(buildtimes.format_duration(5400), '1h30m')
+
+if __name__ == '__main__':
+    unittest.main()
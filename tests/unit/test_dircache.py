@@ -0,0 +1,56 @@
+#pylint: skip-file
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rdgo import dircache, utils
+
+class TestDirCache(unittest.TestCase):
+    """
+    Unit tests for the digest-keyed LRU directory store
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = dircache.DirCache(self.tmpdir + '/cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _make_tree(self, name, size):
+        path = self.tmpdir + '/' + name
+        os.mkdir(path)
+        with open(path + '/data', 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_insert_and_copy_out(self):
+        key = dircache.json_digest({'a': 1})
+        self.assertFalse(self.cache.copy_out(key, self.tmpdir + '/out'))
+        src = self._make_tree('src', 10)
+        self.cache.insert(key, src)
+        self.assertTrue(self.cache.copy_out(key, self.tmpdir + '/out'))
+        self.assertEqual(os.stat(src + '/data').st_ino,
+                         os.stat(self.tmpdir + '/out/data').st_ino)
+        self.assertEqual([k for (k, _) in self.cache.entries()], [key])
+
+    def test_prune_evicts_least_recently_used(self):
+        keys = [dircache.json_digest(i) for i in range(3)]
+        for (i, key) in enumerate(keys):
+            path = self.cache.insert(key, self._make_tree('t{0}'.format(i), 1000))
+            os.utime(path, (i, i))
+        self.cache.lookup(keys[0])
+        self.cache.prune(max_bytes=2500)
+        remaining = set(k for (k, _) in self.cache.entries())
+        self.assertEqual(remaining, set([keys[0], keys[2]]))
+
+    def test_parse_size(self):
+        self.assertEqual(utils.parse_size('512'), 512)
+        self.assertEqual(utils.parse_size('2k'), 2048)
+        self.assertEqual(utils.parse_size('1.5G'), 1536 * 1024 * 1024)
+        self.assertEqual(utils.parse_size('10MB'), 10 * 1024 * 1024)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+#pylint: skip-file
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from rdgo import task_gc, usageindex, lookaside
+from rdgo.task_gc import GCEntry
+
+class TestGC(unittest.TestCase):
+    """
+    Unit tests for storage-budgeted garbage collection of src/
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.srcdir = self.tmpdir + '/src'
+        os.mkdir(self.srcdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _task(self):
+        task = task_gc.TaskGC()
+        task.srcdir = self.srcdir
+        task.lookaside_mirror = self.srcdir + '/lookaside'
+        return task
+
+    def _write(self, path, data=b'x'):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def test_usage_index(self):
+        index = usageindex.UsageIndex(self.srcdir)
+        self.assertEqual(index.load(), {})
+        index.touch(['a', 'b'], now=100)
+        index.touch(['a'], now=200)
+        index.touch(['b'], now=50)
+        with open(index.path, 'a') as f:
+            f.write('garbage\n12')
+        self.assertEqual(index.load(), {'a': 200, 'b': 100})
+        index.compact(lambda key: key != 'b')
+        self.assertEqual(index.load(), {'a': 200})
+        with open(index.path) as f:
+            self.assertEqual(f.read(), '200 a\n')
+
+    def test_parse_sources(self):
+        text = ('0123456789abcdef0123456789abcdef  foo-1.0.tar.gz\n'
+                '\n'
+                'SHA512 (bar (copy).tar.xz) = ABCDEF01\n')
+        self.assertEqual(lookaside.parse_sources(text),
+                         [('md5', '0123456789abcdef0123456789abcdef', 'foo-1.0.tar.gz'),
+                          ('sha512', 'abcdef01', 'bar (copy).tar.xz')])
+        self.assertEqual(lookaside.object_key('sha512', 'abcdef01'), 'sha512/ab/cdef01')
+        self.assertRaises(ValueError, lookaside.parse_sources, 'nonsense')
+
+    def test_select_evictions(self):
+        entries = [GCEntry('mirror', 'old', None, 40, 1),
+                   GCEntry('object', 'pinned', None, 50, 2),
+                   GCEntry('mirror', 'middle', None, 30, 3),
+                   GCEntry('object', 'new', None, 20, 4)]
+        referenced = set([('object', 'pinned')])
+        # Least recently used first, skipping what the snapshot uses
+        self.assertEqual([e.key for e in task_gc.select_evictions(entries, referenced, 90)],
+                         ['old', 'middle'])
+        self.assertEqual([e.key for e in task_gc.select_evictions(entries, referenced, 100)],
+                         ['old'])
+        self.assertEqual(task_gc.select_evictions(entries, referenced, 140), [])
+        # Referenced entries stay even if that leaves us over budget
+        self.assertEqual([e.key for e in task_gc.select_evictions(entries, referenced, 0)],
+                         ['old', 'middle', 'new'])
+
+    def test_find_and_clean(self):
+        task = self._task()
+        mirror = self.srcdir + '/https/example.com/foo.git'
+        self._write(mirror + '/HEAD')
+        os.mkdir(mirror + '/objects')
+        # Nested mirrors are not descended into
+        self._write(mirror + '/objects/HEAD')
+        self._write(self.srcdir + '/https/example.com/bar.git.tmp/HEAD')
+        self._write(self.srcdir + '/srcsnap-cache/ab/cdef/HEAD')
+        os.mkdir(self.srcdir + '/srcsnap-cache/ab/cdef/objects')
+        self._write(self.srcdir + '/_tmp/tmp-x/file')
+
+        objpath = lookaside.object_path(task.lookaside_mirror, 'md5', 'abcdef')
+        self._write(objpath)
+        self._write(objpath + '.lock')
+        old_part = lookaside.object_path(task.lookaside_mirror, 'md5', '012345') + '.part'
+        self._write(old_part)
+        old = time.time() - 3600
+        os.utime(old_part, (old, old))
+        new_part = lookaside.object_path(task.lookaside_mirror, 'md5', '999999') + '.part'
+        self._write(new_part)
+        quarantined = task.lookaside_mirror + '/quarantine/md5/abcdef.1'
+        self._write(quarantined)
+        os.utime(quarantined, (old, old))
+
+        stale = []
+        partial = []
+        self.assertEqual(list(task._find_mirrors(self.srcdir, stale)), [mirror])
+        self.assertEqual(list(task._find_objects(stale, partial)), [('md5/ab/cdef', objpath)])
+        self.assertEqual(sorted(stale), [self.srcdir + '/https/example.com/bar.git.tmp',
+                                         objpath + '.lock'])
+        self.assertEqual(sorted(partial), [old_part, new_part])
+
+        task._clean_temporary(stale, partial, 60)
+        for path in [objpath + '.lock', self.srcdir + '/https/example.com/bar.git.tmp',
+                     self.srcdir + '/_tmp/tmp-x', old_part, quarantined]:
+            self.assertFalse(os.path.exists(path), path)
+        for path in [objpath, new_part, mirror, self.srcdir + '/_tmp']:
+            self.assertTrue(os.path.exists(path), path)
+
+    def test_remove_empty_parents(self):
+        task = self._task()
+        path = self.srcdir + '/https/example.com/a/b.git'
+        os.makedirs(path)
+        self._write(self.srcdir + '/https/other/HEAD')
+        shutil.rmtree(path)
+        task._remove_empty_parents(path, self.srcdir)
+        self.assertFalse(os.path.exists(self.srcdir + '/https/example.com'))
+        self.assertTrue(os.path.isdir(self.srcdir + '/https/other'))
@@ -0,0 +1,181 @@
+#pylint: skip-file
+
+import io
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import unittest
+
+from rdgo import git, jobs
+
+GIT_ENV = dict(os.environ,
+               GIT_AUTHOR_NAME='Test', GIT_AUTHOR_EMAIL='test@example.com',
+               GIT_COMMITTER_NAME='Test', GIT_COMMITTER_EMAIL='test@example.com')
+
+def run_git(cwd, *args):
+    return subprocess.check_output(['git', '-c', 'protocol.file.allow=always'] + list(args),
+                                   cwd=cwd, env=GIT_ENV).decode('UTF-8').strip()
+
+def make_repo(path, files):
+    os.makedirs(path)
+    run_git(path, 'init', '-q')
+    for (name, content) in files.items():
+        with open(path + '/' + name, 'w') as f:
+            f.write(content)
+    run_git(path, 'add', '.')
+    run_git(path, 'commit', '-q', '-m', 'initial')
+    return run_git(path, 'rev-parse', 'HEAD')
+
+class TestGitMirror(unittest.TestCase):
+    """
+    Unit tests for submodule discovery and URL handling
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.mirrors = []
+
+    def tearDown(self):
+        for mirror in self.mirrors:
+            mirror.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _mirror(self):
+        mirror = git.GitMirror(self.tmpdir + '/mirrors')
+        self.mirrors.append(mirror)
+        return mirror
+
+    def test_make_absolute_url(self):
+        self.assertEqual(git.make_absolute_url('https://github.com/a/b', '../c'),
+                         'https://github.com/a/c')
+        self.assertEqual(git.make_absolute_url('https://github.com/a/b.git/', '../../x/c'),
+                         'https://github.com/x/c')
+        self.assertEqual(git.make_absolute_url('file:///srv/git/a', '../b'),
+                         'file:///srv/git/b')
+
+    def test_list_submodules_from_bare_mirror(self):
+        sub_rev = make_repo(self.tmpdir + '/sub', {'README': 'sub'})
+        make_repo(self.tmpdir + '/top', {'README': 'top'})
+        top = self.tmpdir + '/top'
+        run_git(top, 'submodule', 'add', '-q', '--name', 'vendored', '../sub', 'vendor/sub')
+        run_git(top, 'commit', '-q', '-m', 'add submodule')
+        rev = run_git(top, 'rev-parse', 'HEAD')
+        run_git(self.tmpdir, 'clone', '-q', '--mirror', top, 'top-mirror.git')
+
+        mirror = self._mirror()
+        uri = 'file://' + top
+        submodules = mirror._list_submodules_at(self.tmpdir + '/top-mirror.git', uri, rev)
+        self.assertEqual(submodules, [git.GitSubmodule(sub_rev, 'vendored', 'vendor/sub',
+                                                       'file://' + self.tmpdir + '/sub')])
+        # No .gitmodules at all
+        first = run_git(top, 'rev-list', '--max-parents=0', 'HEAD')
+        self.assertEqual(mirror._list_submodules_at(top, uri, first), [])
+
+    def test_write_archive(self):
+        make_repo(self.tmpdir + '/sub', {'README': 'sub', '.gitignore': '*.o'})
+        make_repo(self.tmpdir + '/top', {'README': 'top', '.gitignore': '*.o'})
+        top = self.tmpdir + '/top'
+        os.symlink('README', top + '/link')
+        os.makedirs(top + '/bin')
+        with open(top + '/bin/run', 'w') as f:
+            f.write('#!/bin/sh\n')
+        os.chmod(top + '/bin/run', 0o755)
+        run_git(top, 'submodule', 'add', '-q', '../sub', 'vendor/sub')
+        run_git(top, 'add', '.')
+        run_git(top, 'commit', '-q', '-m', 'more')
+        commit_time = int(run_git(top, 'log', '-1', '--format=%ct'))
+
+        mirror = self._mirror()
+        mirror.mirror('file://' + top, 'HEAD')
+        buf = io.BytesIO()
+        mirror.write_archive('file://' + top, 'HEAD', 'top-1.0', buf)
+        buf.seek(0)
+        with tarfile.open(fileobj=buf) as tar:
+            members = dict((m.name, m) for m in tar.getmembers())
+            self.assertEqual(sorted(members), ['top-1.0', 'top-1.0/README', 'top-1.0/bin',
+                                               'top-1.0/bin/run', 'top-1.0/link',
+                                               'top-1.0/vendor', 'top-1.0/vendor/sub',
+                                               'top-1.0/vendor/sub/README'])
+            self.assertEqual(tar.extractfile('top-1.0/vendor/sub/README').read(), b'sub')
+            self.assertEqual(members['top-1.0/bin/run'].mode, 0o755)
+            self.assertEqual(members['top-1.0/link'].linkname, 'README')
+            self.assertEqual(set(m.mtime for m in members.values()), set([commit_time]))
+
+    def test_needs_fetch(self):
+        first = make_repo(self.tmpdir + '/up', {'README': 'up'})
+        up = self.tmpdir + '/up'
+        branch = run_git(up, 'symbolic-ref', '--short', 'HEAD')
+        run_git(up, 'tag', '-a', '-m', 'v1', 'v1')
+        url = 'file://' + up
+
+        mirror = self._mirror()
+        # Not mirrored yet
+        self.assertTrue(mirror.needs_fetch(url, branch))
+        mirror.mirror(url, branch)
+        self.assertFalse(mirror.needs_fetch(url, branch))
+        self.assertFalse(mirror.needs_fetch(url, 'v1'))
+        self.assertFalse(mirror.needs_fetch(url, first))
+        self.assertTrue(mirror.needs_fetch(url, 'nosuchbranch'))
+
+        run_git(up, 'commit', '-q', '--allow-empty', '-m', 'more')
+        second = run_git(up, 'rev-parse', 'HEAD')
+        self.assertTrue(mirror.needs_fetch(url, branch))
+        self.assertTrue(mirror.needs_fetch(url, second))
+        self.assertFalse(mirror.needs_fetch(url, 'v1'))
+        self.assertEqual(mirror.probe_many([(url, 'v1'), (url, branch)], jobs=2), [False, True])
+
+        # Within a run, the fresh clone is as good as a fetch
+        self.assertEqual(mirror.mirror(url, branch, fetch=True), first)
+        # A new run fetches, once
+        mirror = self._mirror()
+        self.assertEqual(mirror.mirror(url, branch, fetch=True), second)
+        self.assertFalse(mirror.needs_fetch(url, branch))
+        self.assertFalse(mirror.needs_fetch(url, second))
+        run_git(up, 'commit', '-q', '--allow-empty', '-m', 'again')
+        self.assertEqual(mirror.mirror(url, branch, fetch=True), second)
+        self.assertEqual(mirror.mirror(url, branch), second)
+
+        # A new tag changes the description of an unchanged branch
+        third = run_git(up, 'rev-parse', 'HEAD')
+        mirror = self._mirror()
+        mirror.mirror(url, branch, fetch=True)
+        self.assertFalse(mirror.needs_fetch(url, branch))
+        run_git(up, 'tag', 'v2', third)
+        self.assertTrue(mirror.needs_fetch(url, branch))
+        self.assertTrue(mirror.needs_fetch(url, 'v1'))
+        mirror = self._mirror()
+        mirror.mirror(url, branch, fetch=True)
+        self.assertFalse(mirror.needs_fetch(url, branch))
+
+    def test_mirror_submodules_concurrently(self):
+        common = make_repo(self.tmpdir + '/common', {'README': 'common'})
+        subs = []
+        for i in range(4):
+            path = self.tmpdir + '/sub{0}'.format(i)
+            make_repo(path, {'README': str(i)})
+            # Every submodule shares a nested one
+            run_git(path, 'submodule', 'add', '-q', '../common', 'common')
+            run_git(path, 'commit', '-q', '-m', 'add common')
+            subs.append(path)
+        top = self.tmpdir + '/top'
+        make_repo(top, {'README': 'top'})
+        for i in range(4):
+            run_git(top, 'submodule', 'add', '-q', '../sub{0}'.format(i), 'sub{0}'.format(i))
+        run_git(top, 'commit', '-q', '-m', 'add submodules')
+
+        mirror = self._mirror()
+        mirror.pool = jobs.JobPool(4)
+        rev = mirror.mirror('file://' + top, 'HEAD')
+        for path in subs + [top, self.tmpdir + '/common']:
+            mirrordir = mirror._get_mirrordir('file://' + path)
+            self.assertTrue(os.path.isdir(mirrordir + '/objects'), path)
+            self.assertFalse(os.path.exists(mirrordir + '.tmp'))
+        with open(mirror._get_mirrordir('file://' + top) + '/submodules-cache-stamp') as f:
+            self.assertEqual(f.read().strip(), rev)
+        with open(mirror._get_mirrordir('file://' + self.tmpdir + '/common') + '/submodules-cache-stamp') as f:
+            self.assertEqual(f.read().strip(), common)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#pylint: skip-file
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from rdgo import gitquery
+
+GIT_ENV = dict(os.environ,
+               GIT_AUTHOR_NAME='Test', GIT_AUTHOR_EMAIL='test@example.com',
+               GIT_COMMITTER_NAME='Test', GIT_COMMITTER_EMAIL='test@example.com')
+
+def run_git(cwd, *args):
+    return subprocess.check_output(['git'] + list(args), cwd=cwd, env=GIT_ENV).decode('UTF-8').strip()
+
+class TestParseGitConfig(unittest.TestCase):
+    """
+    Unit tests for the .gitmodules parser
+    """
+
+    def test_submodules(self):
+        config = gitquery.parse_git_config('''
+# comment
+[submodule "libfoo"]
+	path = third_party/foo
+	URL = https://example.com/foo.git ; trailing comment
+[submodule "With \\"quotes\\""]
+	path = "a path with spaces"
+	url = ../bar
+[core] bare
+''')
+        self.assertEqual(config, {
+            ('submodule', 'libfoo', 'path'): 'third_party/foo',
+            ('submodule', 'libfoo', 'url'): 'https://example.com/foo.git',
+            ('submodule', 'With "quotes"', 'path'): 'a path with spaces',
+            ('submodule', 'With "quotes"', 'url'): '../bar',
+            ('core', None, 'bare'): 'true',
+        })
+
+class TestGitQuery(unittest.TestCase):
+    """
+    Unit tests for GitQuery against a scratch repository
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.repo = self.tmpdir + '/repo'
+        os.makedirs(self.repo + '/dir')
+        run_git(self.repo, 'init', '-q')
+        with open(self.repo + '/dir/file', 'w') as f:
+            f.write('hello\n')
+        run_git(self.repo, 'add', '.')
+        run_git(self.repo, 'commit', '-q', '-m', 'first')
+        run_git(self.repo, 'tag', '-a', '-m', 'v1', 'v1')
+        run_git(self.repo, 'commit', '-q', '--allow-empty', '-m', 'second')
+        self.query = gitquery.GitQuery(self.repo)
+
+    def tearDown(self):
+        self.query.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_rev_parse_matches_git(self):
+        for rev in ['HEAD', 'v1', 'HEAD~1', run_git(self.repo, 'symbolic-ref', '--short', 'HEAD')]:
+            self.assertEqual(self.query.rev_parse(rev), run_git(self.repo, 'rev-parse', rev))
+
+    def test_objects(self):
+        self.assertEqual(self.query.read_blob('HEAD:dir/file'), b'hello\n')
+        self.assertIsNone(self.query.read_blob('HEAD:missing'))
+        self.assertEqual(self.query.lookup_path('HEAD', 'dir/file')[0], '100644')
+        self.assertEqual([e[1] for e in self.query.ls_tree('HEAD')], ['dir'])
+
+    def test_describe_many(self):
+        head = run_git(self.repo, 'rev-parse', 'HEAD')
+        first = run_git(self.repo, 'rev-parse', 'HEAD~1')
+        self.assertEqual(self.query.describe_many([head, first]),
+                         {head: 'v1-1-g' + head, first: 'v1-0-g' + first})
+
+    def test_invalidate_sees_new_refs(self):
+        self.assertNotIn('refs/tags/v2', self.query.refs())
+        self.query.read_object('HEAD')
+        run_git(self.repo, 'tag', 'v2')
+        self.query.invalidate()
+        self.assertIn('refs/tags/v2', self.query.refs())
+        self.assertEqual(self.query.rev_parse('v2'), run_git(self.repo, 'rev-parse', 'HEAD'))
+
+if __name__ == '__main__':
+    unittest.main()
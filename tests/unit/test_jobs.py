@@ -0,0 +1,62 @@
+#pylint: skip-file
+
+import threading
+import time
+import unittest
+
+from rdgo import jobs
+
+class TestJobPool(unittest.TestCase):
+    """
+    Unit tests for the bounded thread pool used for mirroring
+    """
+
+    def test_map_preserves_order(self):
+        def slow_square(x):
+            time.sleep(0.01 * (5 - x))
+            return x * x
+        pool = jobs.JobPool(4)
+        self.assertEqual(pool.map(slow_square, range(5)), [0, 1, 4, 9, 16])
+
+    def test_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'max': 0}
+        def work(x):
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+        jobs.JobPool(3).map(work, range(12))
+        self.assertLessEqual(state['max'], 3)
+
+    def test_sequential_runs_in_caller(self):
+        caller = threading.current_thread()
+        threads = jobs.JobPool(1).map(lambda x: threading.current_thread(), range(3))
+        self.assertEqual(threads, [caller] * 3)
+
+    def test_nested_map_does_not_deadlock(self):
+        pool = jobs.JobPool(2)
+        def outer(x):
+            return sum(pool.map(lambda y: x * y, range(4)))
+        self.assertEqual(pool.map(outer, range(4)), [0, 6, 12, 18])
+
+    def test_errors_are_reraised_after_completion(self):
+        done = []
+        def work(x):
+            if x == 1:
+                raise SystemExit(1)
+            time.sleep(0.01)
+            done.append(x)
+        self.assertRaises(SystemExit, jobs.JobPool(4).map, work, range(4))
+        self.assertEqual(sorted(done), [0, 2, 3])
+
+    def test_url_host(self):
+        self.assertEqual(jobs.url_host('https://github.com/foo/bar'), 'github.com')
+        self.assertEqual(jobs.url_host('git@github.com:foo/bar'), 'github.com')
+        self.assertEqual(jobs.url_host('file:///srv/git/foo'), '')
+        self.assertEqual(jobs.url_host('/srv/git/foo'), '')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+#pylint: skip-file
+
+import hashlib
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+from six.moves import BaseHTTPServer, socketserver
+
+from rdgo import lookaside
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.requests.append(self.path)
+        if self.path.startswith('/redirect/'):
+            self.send_response(302)
+            self.send_header('Location', '/files/' + self.path[len('/redirect/'):])
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = server.files.get(self.path[len('/files/'):])
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        name = self.path[len('/files/'):]
+        with server.lock:
+            server.ranges.append(self.headers.get('Range'))
+            truncate = name in server.truncate
+            server.truncate.discard(name)
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'][len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, len(body) - 1, len(body)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.end_headers()
+        if truncate:
+            # Drop the connection halfway through
+            self.wfile.write(body[start:start + (len(body) - start) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class TestLookaside(unittest.TestCase):
+    """
+    Unit tests for the bulk lookaside downloader, against a local
+    stand-in for the lookaside cache
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.mirror = self.tmpdir + '/lookaside'
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.lock = threading.Lock()
+        self.server.connections = set()
+        self.server.requests = []
+        self.server.files = {}
+        self.server.ranges = []
+        self.server.truncate = set()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def add_file(self, name, body, urlprefix='/files/'):
+        self.server.files[name] = body
+        md5 = hashlib.md5(body).hexdigest()
+        return lookaside.LookasideObject(self.base + urlprefix + name, 'md5', md5,
+                                         lookaside.object_path(self.mirror, 'md5', md5))
+
+    def test_download_all(self):
+        objects = [self.add_file('f{0}.tar.gz'.format(i), os.urandom(1000 + i)) for i in range(20)]
+        objects.append(self.add_file('moved.tar.gz', b'moved', urlprefix='/redirect/'))
+        # Shared between two components
+        objects.append(objects[0])
+        failed = lookaside.Downloader(jobs=4, per_host=2).download_all(objects)
+        self.assertEqual(failed, [])
+        for obj in objects:
+            with open(obj.path, 'rb') as f:
+                self.assertEqual(hashlib.md5(f.read()).hexdigest(), obj.hash)
+        # Each object fetched once, over reused connections
+        self.assertEqual(len(self.server.requests), 22)
+        self.assertLessEqual(len(self.server.connections), 4)
+        # No temporary files left behind
+        leftovers = [name for (_, _, names) in os.walk(self.mirror)
+                     for name in names if name.endswith('.tmp')]
+        self.assertEqual(leftovers, [])
+
+        # Nothing to do the second time
+        self.assertEqual(lookaside.Downloader().download_all(objects), [])
+        self.assertEqual(len(self.server.requests), 22)
+
+    def test_failures(self):
+        good = self.add_file('good', b'good')
+        bad = self.add_file('bad', b'bad')
+        self.server.files['bad'] = b'corrupted'
+        missing = good._replace(url=self.base + '/files/missing',
+                                path=lookaside.object_path(self.mirror, 'md5', '0' * 32))
+        failed = lookaside.Downloader().download_all([good, bad, missing])
+        self.assertEqual([obj for (obj, _) in failed], [bad, missing])
+        self.assertIn('Checksum mismatch', failed[0][1])
+        self.assertIn('404', failed[1][1])
+        self.assertTrue(os.path.exists(good.path))
+        self.assertFalse(os.path.exists(bad.path))
+        # The bad data was set aside rather than left to be resumed
+        self.assertFalse(os.path.exists(bad.path + '.part'))
+        quarantined = os.listdir(self.mirror + '/quarantine/md5')
+        self.assertEqual(len(quarantined), 1)
+        with open(self.mirror + '/quarantine/md5/' + quarantined[0], 'rb') as f:
+            self.assertEqual(f.read(), b'corrupted')
+
+    def test_resume_partial_download(self):
+        body = os.urandom(100000)
+        obj = self.add_file('big.tar.gz', body)
+        os.makedirs(os.path.dirname(obj.path))
+        with open(obj.path + '.part', 'wb') as f:
+            f.write(body[0:30000])
+        self.assertTrue(lookaside.Downloader().download(obj))
+        self.assertEqual(self.server.ranges, ['bytes=30000-'])
+        with open(obj.path, 'rb') as f:
+            self.assertEqual(f.read(), body)
+        self.assertFalse(os.path.exists(obj.path + '.part'))
+
+    def test_retry_resumes_after_dropped_connection(self):
+        body = os.urandom(100000)
+        obj = self.add_file('flaky.tar.gz', body)
+        self.server.truncate.add('flaky.tar.gz')
+        self.assertTrue(lookaside.Downloader().download(obj))
+        self.assertEqual(self.server.ranges, [None, 'bytes=50000-'])
+        with open(obj.path, 'rb') as f:
+            self.assertEqual(f.read(), body)
+
+    def test_object_path(self):
+        self.assertEqual(lookaside.object_path('/m', 'sha512', 'abcdef'), '/m/sha512/ab/cdef')
+        self.assertRaises(ValueError, lookaside.object_path, '/m', 'sha1', 'abcdef')
+        self.assertRaises(ValueError, lookaside.object_path, '/m', 'md5', '../../etc')
+
+FAKE_SERVER = '''
+import json, os, sys
+assert sys.argv[1:] == ['--server']
+while True:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    request = json.loads(line)
+    response = {'id': request['id']}
+    if request['op'] == 'fail':
+        response['error'] = 'failed as requested'
+    else:
+        with open(request['log'], 'a') as f:
+            f.write('{0} {1}\\n'.format(os.getpid(), request['value']))
+        response['ok'] = True
+    sys.stdout.write(json.dumps(response) + '\\n')
+    sys.stdout.flush()
+'''
+
+_shared_client = None
+
+def _worker_request(value):
+    _shared_client.request('log', log=_shared_client.log, value=value)
+
+class TestPrepSourcesClient(unittest.TestCase):
+    """
+    Unit tests for the client of rpkg-prep-sources --server
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        script = self.tmpdir + '/server.py'
+        with open(script, 'w') as f:
+            f.write(FAKE_SERVER)
+        self.client = lookaside.PrepSourcesClient([sys.executable, script])
+        self.client.log = self.tmpdir + '/log'
+
+    def tearDown(self):
+        self.client.close()
+        shutil.rmtree(self.tmpdir)
+
+    def read_log(self):
+        with open(self.client.log) as f:
+            return [line.split() for line in f]
+
+    def test_requests_share_one_process(self):
+        global _shared_client
+        self.client.request('log', log=self.client.log, value='first')
+        _shared_client = self.client
+        pool = multiprocessing.get_context('fork').Pool(3)
+        try:
+            pool.map(_worker_request, [str(i) for i in range(12)])
+        finally:
+            pool.close()
+            pool.join()
+        entries = self.read_log()
+        self.assertEqual(len(entries), 13)
+        self.assertEqual(len(set(pid for (pid, _) in entries)), 1)
+        self.assertEqual(sorted(value for (_, value) in entries[1:]), sorted(str(i) for i in range(12)))
+
+    def test_errors(self):
+        self.assertRaises(lookaside.PrepSourcesError, self.client.request, 'fail')
+        # The server is still usable afterwards
+        self.client.request('log', log=self.client.log, value='after')
+        self.assertEqual([value for (_, value) in self.read_log()], ['after'])
+
+if __name__ == '__main__':
+    unittest.main()
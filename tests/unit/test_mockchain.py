@@ -0,0 +1,335 @@
+#pylint: skip-file
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from rdgo import buildtimes, mockchain
+from rdgo.buildgraph import BuildGraph
+from rdgo.dircache import tree_size
+
+class FakeBuilds(object):
+    """Stands in for MockChain.do_one_build(), recording the order in
+    which builds start and finish and how many run at once."""
+    def __init__(self, results=None, duration=0.01):
+        # Filename -> list of return codes of successive attempts
+        self.results = results or {}
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.events = []
+        self.attempts = {}
+        # Filename -> the PhaseTimer passed to the last attempt
+        self.timers = {}
+        self.busy_roots = set()
+        self.max_busy = 0
+
+    def __call__(self, pkg, root, timer=None):
+        fn = pkg.filename
+        with self.lock:
+            self.timers[fn] = timer
+            assert root not in self.busy_roots, "two builds in one root"
+            self.busy_roots.add(root)
+            self.max_busy = max(self.max_busy, len(self.busy_roots))
+            attempt = self.attempts.get(fn, 0)
+            self.attempts[fn] = attempt + 1
+            self.events.append(('start', fn))
+        time.sleep(self.duration)
+        results = self.results.get(fn, [1])
+        with self.lock:
+            self.busy_roots.discard(root)
+            self.events.append(('end', fn))
+        return results[min(attempt, len(results) - 1)]
+
+    def index(self, event, fn):
+        return self.events.index((event, fn))
+
+class MockChainTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        createrepo_patch = patch.object(mockchain, 'createrepo', side_effect=self._createrepo)
+        createrepo_patch.start()
+        self.addCleanup(createrepo_patch.stop)
+        self.builds = FakeBuilds()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _createrepo(self, path, pkglist=None):
+        with self.builds.lock:
+            self.builds.events.append(('createrepo', None))
+
+    def _chain(self, jobs=1):
+        # Without running __init__, which needs mock's configuration
+        chain = mockchain.MockChain.__new__(mockchain.MockChain)
+        chain.local_repo = self.tmpdir + '/repo'
+        if not os.path.isdir(chain.local_repo):
+            os.mkdir(chain.local_repo)
+        chain._local_tmp_dir = self.tmpdir
+        chain._chroot_cache = None
+        chain._build_times = buildtimes.BuildTimes(self.tmpdir + '/buildtimes.json')
+        chain._graph = None
+        chain._priority = {}
+        chain._root_paths = {}
+        chain._setup_rpms = []
+        chain._roots = [mockchain.MockRoot('root-{0}'.format(i), self.tmpdir + '/configs-{0}'.format(i),
+                                           self.tmpdir + '/configs-{0}/root.cfg'.format(i))
+                        for i in range(jobs)]
+        chain._createrepo_lock = threading.Lock()
+        chain._building = set()
+        chain._unindexed = set()
+        chain.do_one_build = self.builds
+        chain.do_clean_root = lambda root=None: None
+        return chain
+
+    def _pkg(self, name):
+        return mockchain.SRPMBuild('{0}/{1}-1.0-1.temp.src.rpm'.format(self.tmpdir, name), [], [], [], False)
+
+    def _build(self, chain, pkgs, deps):
+        """Build @pkgs, where @deps maps a package's filename to the
+        packages it needs."""
+        graph = BuildGraph([pkg.filename for pkg in pkgs])
+        for (fn, needs) in deps.items():
+            graph.deps[fn] = set(need.filename for need in needs)
+        with patch.object(mockchain, 'compute_build_graph', return_value=graph):
+            return chain.build(pkgs)
+
+class TestMockChain(MockChainTestCase):
+    """
+    Unit tests for building chains of packages across mock roots
+    """
+
+    def test_build_nothing(self):
+        # e.g. when only srpmroot components needed building
+        self.assertEqual(self._chain().build([]), 0)
+
+    def test_dependencies_first(self):
+        (a, b, c, d) = [self._pkg(name) for name in 'abcd']
+        self.assertEqual(self._build(self._chain(jobs=3), [c, b, a, d], {b.filename: [a], c.filename: [b]}), 0)
+        builds = self.builds
+        self.assertTrue(builds.index('start', b.filename) > builds.index('end', a.filename))
+        self.assertTrue(builds.index('start', c.filename) > builds.index('end', b.filename))
+        # The repository is updated between a build and its dependent
+        between = builds.events[builds.index('end', a.filename):builds.index('start', b.filename)]
+        self.assertIn(('createrepo', None), between)
+
+    def test_createrepo_recorded(self):
+        (a, b, c) = [self._pkg(name) for name in 'abc']
+        self.assertEqual(self._build(self._chain(), [a, b, c], {b.filename: [a]}), 0)
+        # The createrepo b needed is counted as part of b's build
+        self.assertNotIn('createrepo', self.builds.timers[a.filename].phases)
+        self.assertIn('createrepo', self.builds.timers[b.filename].phases)
+
+    def test_roots_busy(self):
+        pkgs = [self._pkg('p{0}'.format(i)) for i in range(8)]
+        self.assertEqual(self._build(self._chain(jobs=3), pkgs, {}), 0)
+        self.assertTrue(1 <= self.builds.max_busy <= 3)
+        self.assertEqual(len(self.builds.attempts), 8)
+
+    def test_failure_blocks_dependents(self):
+        (a, b, c) = [self._pkg(name) for name in 'abc']
+        self.builds.results = {a.filename: [0]}
+        self.assertEqual(self._build(self._chain(jobs=2), [a, b, c], {b.filename: [a]}), 2)
+        self.assertNotIn(b.filename, self.builds.attempts)
+        self.assertEqual(self.builds.attempts[c.filename], 1)
+
+    def test_retry_after_progress(self):
+        (a, b) = [self._pkg(name) for name in 'ab']
+        # b was built in the first pass, so a (which might have needed
+        # it without saying so) gets another chance
+        self.builds.results = {a.filename: [0, 1]}
+        self.assertEqual(self._build(self._chain(), [a, b], {}), 0)
+        self.assertEqual(self.builds.attempts, {a.filename: 2, b.filename: 1})
+
+    def test_no_retry_without_progress(self):
+        (a, b) = [self._pkg(name) for name in 'ab']
+        self.builds.results = {a.filename: [0], b.filename: [0]}
+        self.assertEqual(self._build(self._chain(jobs=2), [a, b], {}), 2)
+        self.assertEqual(self.builds.attempts, {a.filename: 1, b.filename: 1})
+
+class FakeMock(object):
+    """Stands in for subprocess.Popen running mock, writing the logs a
+    build with @returncode leaves in its result directory."""
+    def __init__(self, returncode):
+        self.returncode = returncode
+        self.argvs = []
+        self._popen = subprocess.Popen
+
+    def __call__(self, argv, *args, **kwargs):
+        if argv[0] != '/usr/bin/mock':
+            return self._popen(argv, *args, **kwargs)
+        self.argvs.append(argv)
+        resdir = argv[argv.index('--resultdir') + 1]
+        with open(resdir + '/state.log', 'w') as f:
+            f.write('Start: build setup for foo\nStart: rpmbuild foo\n')
+            if self.returncode == 0:
+                f.write('Finish: rpmbuild foo\n')
+        with open(resdir + '/build.log', 'w') as f:
+            f.write('error: Bad exit status\n')
+        return self
+
+    def wait(self):
+        return self.returncode
+
+class TestDoOneBuild(MockChainTestCase):
+    """
+    Unit tests for running mock on a single package
+    """
+
+    def _do_one_build(self, returncode, timer=None):
+        chain = self._chain()
+        del chain.do_one_build
+        pkg = self._pkg('foo')
+        with open(pkg.filename, 'w') as f:
+            f.write('srpm')
+        fake_mock = FakeMock(returncode)
+        with patch.object(mockchain.subprocess, 'Popen', fake_mock), patch.dict(os.environ):
+            os.environ.pop('PRESERVE_TEMP', None)
+            ret = chain.do_one_build(pkg, chain._roots[0], timer)
+        return (chain, ret, fake_mock, chain.local_repo + '/foo-1.0-1')
+
+    def _status(self, resdir):
+        with open(resdir + '/status.json') as f:
+            return json.load(f)['status']
+
+    def test_success(self):
+        (chain, ret, fake_mock, resdir) = self._do_one_build(0)
+        self.assertEqual(ret, 1)
+        self.assertEqual(self._status(resdir), 'success')
+        self.assertFalse(os.path.exists(self.tmpdir + '/foo-1.0-1.temp.src.rpm'))
+        self.assertIsNotNone(chain._build_times.estimate('foo'))
+
+    def test_phases_recorded(self):
+        timer = buildtimes.PhaseTimer()
+        timer.add('createrepo', 2.0)
+        (chain, ret, fake_mock, resdir) = self._do_one_build(0, timer)
+        self.assertEqual(ret, 1)
+        with open(chain._build_times.path) as f:
+            phases = json.load(f)['components']['foo']['phases']
+        self.assertEqual(phases['createrepo'], 2.0)
+        self.assertIn('rpmbuild', phases)
+        self.assertTrue(chain._build_times.estimate('foo') >= 2.0)
+
+    def test_failure(self):
+        (chain, ret, fake_mock, resdir) = self._do_one_build(1)
+        self.assertEqual(ret, 0)
+        self.assertEqual(self._status(resdir), 'build-failed')
+        # Only successful builds say how long a component takes
+        self.assertIsNone(chain._build_times.estimate('foo'))
+
+    def test_previous_results(self):
+        resdir = self.tmpdir + '/repo/foo-1.0-1'
+        os.makedirs(resdir)
+        with open(resdir + '/fail', 'w') as f:
+            f.write('')
+        (chain, ret, fake_mock, resdir) = self._do_one_build(0)
+        self.assertEqual(ret, 1)
+        self.assertFalse(os.path.exists(resdir + '/fail'))
+        with open(resdir + '/success', 'w') as f:
+            f.write('')
+        with patch.object(mockchain.subprocess, 'Popen', fake_mock):
+            self.assertEqual(chain.do_one_build(self._pkg('foo'), chain._roots[0]), 2)
+        self.assertEqual(len(fake_mock.argvs), 1)
+
+class TestChrootCache(MockChainTestCase):
+    """
+    Unit tests for reusing populated mock chroots
+    """
+
+    def setUp(self):
+        MockChainTestCase.setUp(self)
+        self.cache = mockchain.ChrootCache(self.tmpdir + '/chroots')
+        self.mockcfg = self.tmpdir + '/root.cfg'
+        self._write(self.mockcfg, "config_opts['root'] = 'test'\nbaseurl=file:///local/build-0\n")
+
+    def _write(self, path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_key(self):
+        key = self.cache.key(self.mockcfg, '/local/build-0', ['gcc', 'make'], ['foo-1.0-1.x86_64.rpm'])
+        # The local repository alternates between build directories
+        self._write(self.mockcfg + '.1', "config_opts['root'] = 'test'\nbaseurl=file:///local/build-1\n")
+        self.assertEqual(self.cache.key(self.mockcfg + '.1', '/local/build-1', ['make', 'gcc'],
+                                        ['foo-1.0-1.x86_64.rpm']), key)
+        self._write(self.mockcfg + '.2', "config_opts['root'] = 'other'\nbaseurl=file:///local/build-0\n")
+        others = [self.cache.key(self.mockcfg + '.2', '/local/build-0', ['gcc', 'make'], ['foo-1.0-1.x86_64.rpm']),
+                  self.cache.key(self.mockcfg, '/local/build-0', ['gcc'], ['foo-1.0-1.x86_64.rpm']),
+                  self.cache.key(self.mockcfg, '/local/build-0', ['gcc', 'make'], ['foo-1.0-2.x86_64.rpm']),
+                  self.cache.key(self.mockcfg, '/local/build-0', ['gcc', 'make'], [])]
+        with patch.object(mockchain.time, 'time', return_value=time.time() + self.cache.max_age):
+            others.append(self.cache.key(self.mockcfg, '/local/build-0', ['gcc', 'make'], ['foo-1.0-1.x86_64.rpm']))
+        self.assertEqual(len(set(others + [key])), len(others) + 1)
+
+    def _cached_chain(self):
+        chain = self._chain()
+        del chain.do_one_build
+        chain._chroot_cache = self.cache
+        os.mkdir(chain._roots[0].config_path)
+        shutil.copy(self.mockcfg, chain._roots[0].mockcfg_path)
+        root_path = self.tmpdir + '/chroot'
+        chain._root_path = lambda root: root_path
+        # mock --clean removes the chroot
+        chain.do_clean_root = lambda root=None: mockchain.rmrf(root_path)
+        populated = []
+
+        def run_mock(root, *argv):
+            populated.append(argv)
+            os.makedirs(root_path + '/usr/bin')
+            self._write(root_path + '/usr/bin/gcc', 'gcc')
+        chain._run_mock_sync = run_mock
+        return (chain, root_path, populated)
+
+    def test_prepare_root(self):
+        (chain, root_path, populated) = self._cached_chain()
+        root = chain._roots[0]
+        self.assertEqual(chain._prepare_root(root, 'a' * 64, ['--init']), ['--no-clean'])
+        self.assertEqual(populated, [('--old-chroot', '--init')])
+        # A hit copies the cached tree rather than running mock; the
+        # copy may be changed by the build without affecting the cache
+        self.assertEqual(chain._prepare_root(root, 'a' * 64, ['--init']), ['--no-clean'])
+        self.assertEqual(len(populated), 1)
+        self._write(root_path + '/usr/bin/gcc', 'changed')
+        self.assertEqual(chain._prepare_root(root, 'a' * 64, ['--init']), ['--no-clean'])
+        with open(root_path + '/usr/bin/gcc') as f:
+            self.assertEqual(f.read(), 'gcc')
+        chain._prepare_root(root, 'b' * 64, ['--installdeps', 'foo.src.rpm'])
+        self.assertEqual(populated[1], ('--old-chroot', '--installdeps', 'foo.src.rpm'))
+
+    def test_do_one_build_reuses_chroot(self):
+        (chain, root_path, populated) = self._cached_chain()
+        pkg = self._pkg('foo')
+        fake_mock = FakeMock(0)
+        with patch.object(mockchain.subprocess, 'Popen', fake_mock), \
+             patch.object(mockchain, 'srpm_buildrequires', return_value=['gcc']):
+            for i in range(2):
+                with open(pkg.filename, 'w') as f:
+                    f.write('srpm')
+                mockchain.rmrf(chain._pkg_resdir(pkg))
+                self.assertEqual(chain.do_one_build(pkg, chain._roots[0]), 1)
+        self.assertEqual(populated, [('--old-chroot', '--installdeps', pkg.filename)])
+        self.assertEqual(len(fake_mock.argvs), 2)
+        self.assertIn('--no-clean', fake_mock.argvs[1])
+
+    def test_prune(self):
+        cache = mockchain.ChrootCache(self.tmpdir + '/chroots', max_bytes=10000)
+        for i in range(5):
+            path = self.tmpdir + '/tree{0}'.format(i)
+            os.mkdir(path)
+            self._write(path + '/data', 'x' * 4000)
+            cache.insert('{0}'.format(i) * 64, path)
+            os.utime(cache.lookup('{0}'.format(i) * 64), (1000 + i, 1000 + i))
+        cache.prune()
+        remaining = [key for (key, _) in cache.entries()]
+        self.assertTrue(0 < len(remaining) < 5)
+        self.assertIn('4' * 64, remaining)
+        self.assertTrue(sum(tree_size(path) for (_, path) in cache.entries()) <= 10000)
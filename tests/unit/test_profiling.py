@@ -0,0 +1,103 @@
+#pylint: skip-file
+
+import io
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+from rdgo import profiling
+
+# task_resolve edits spec files, so needs the rpm bindings
+try:
+    from rdgo import task_resolve
+except ImportError:
+    task_resolve = None
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+class TestProfiling(unittest.TestCase):
+    """
+    Unit tests for the --profile option
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_pop_option(self):
+        argv = ['rdgo', 'build', '--profile']
+        self.assertEqual(profiling.pop_option(argv, {}), None)
+        self.assertEqual(argv, ['rdgo', 'build', '--profile'])
+        argv = ['rdgo', '--profile', 'build']
+        self.assertEqual(profiling.pop_option(argv, {}), '')
+        self.assertEqual(argv, ['rdgo', 'build'])
+        argv = ['rdgo', '--profile=out.collapsed', 'resolve', '-j', '4']
+        self.assertEqual(profiling.pop_option(argv, {profiling.ENV_VAR: 'env.prof'}), 'out.collapsed')
+        self.assertEqual(argv, ['rdgo', 'resolve', '-j', '4'])
+        self.assertEqual(profiling.pop_option(['rdgo', 'build'], {profiling.ENV_VAR: 'env.prof'}), 'env.prof')
+        self.assertEqual(profiling.pop_option(['rdgo', 'build'], {profiling.ENV_VAR: '1'}), '')
+        self.assertEqual(profiling.pop_option(['rdgo', 'build'], {profiling.ENV_VAR: ''}), None)
+
+    def test_pstats(self):
+        path = self.tmpdir + '/out.prof'
+        out = io.StringIO()
+        def run():
+            busy(0.05)
+            sys.exit(3)
+        with self.assertRaises(SystemExit):
+            profiling.profile_call(run, path, stream=out)
+        stats = pstats.Stats(path)
+        self.assertTrue(any(func[2] == 'busy' for func in stats.stats))
+        self.assertIn('busy', out.getvalue())
+
+    def test_sampled(self):
+        path = self.tmpdir + '/out.collapsed'
+        out = io.StringIO()
+        self.assertEqual(profiling.profile_call(lambda: busy(0.2) or 42, path, stream=out), 42)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(len(lines) > 0)
+        for line in lines:
+            (stack, count) = line.rsplit(' ', 1)
+            self.assertTrue(int(count) > 0)
+        self.assertTrue(any('busy (test_profiling.py:' in line for line in lines))
+        self.assertIn('busy (test_profiling.py:', out.getvalue())
+
+    @unittest.skipIf(task_resolve is None, "rpm bindings are not available")
+    def test_resolve_build(self):
+        # resolve --build leaves exec'ing the build to its caller, so
+        # the profile of the resolve is written first
+        path = self.tmpdir + '/resolve.prof'
+        with patch.object(builtins, 'PKGLIBDIR', self.tmpdir, create=True):
+            task = task_resolve.TaskResolve()
+        def resolve(opts):
+            busy(0.05)
+            return True
+        with patch.object(task, '_resolve', resolve), patch.object(os, 'execvp') as execvp, \
+                patch.object(os, 'execlp') as execlp:
+            next_argv = profiling.profile_call(lambda: task.run(['--build']), path, stream=io.StringIO())
+        self.assertEqual(next_argv, ['rpmdistro-gitoverlay', 'build'])
+        self.assertFalse(execvp.called or execlp.called)
+        self.assertTrue(any(func[2] == 'busy' for func in pstats.Stats(path).stats))
+
+if __name__ == '__main__':
+    unittest.main()
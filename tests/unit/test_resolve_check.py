@@ -0,0 +1,123 @@
+#pylint: skip-file
+
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+# task_resolve edits spec files, so needs the rpm bindings
+try:
+    from rdgo import task_resolve
+except ImportError:
+    task_resolve = None
+
+SNAPSHOT = {
+    'root': {'mock': 'fedora-rawhide-x86_64'},
+    'components': [
+        {'name': 'foo',
+         'src': 'https://example.com/foo.git',
+         'revision': 'a' * 40,
+         'distgit': {'name': 'foo', 'revision': 'b' * 40},
+         'srcsnap': 'foo-1.0-1.srcsnap'},
+        {'name': 'bar',
+         'src': 'https://example.com/bar.git',
+         'revision': 'c' * 40,
+         'distgit': {'name': 'bar', 'revision': 'd' * 40},
+         'srcsnap': 'bar-2.0-1.srcsnap'},
+    ],
+}
+
+@unittest.skipIf(task_resolve is None, "rpm bindings are not available")
+class TestResolveCheck(unittest.TestCase):
+    """
+    Unit tests for `resolve --check`
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.mkdir(self.tmpdir + '/snapshot')
+        with patch.object(builtins, 'PKGLIBDIR', self.tmpdir, create=True):
+            self.task = task_resolve.TaskResolve()
+        self.task.workdir = self.tmpdir
+        self.logged = []
+        patcher = patch.object(task_resolve, 'log', self.logged.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write_snapshot(self):
+        with open(self.tmpdir + '/snapshot/snapshot.json', 'w') as f:
+            json.dump(SNAPSHOT, f)
+
+    def _expanded(self):
+        expanded = copy.deepcopy(SNAPSHOT)
+        for component in expanded['components']:
+            del component['srcsnap']
+        return expanded
+
+    def _check(self, expanded):
+        """Run the check, returning its exit code"""
+        try:
+            self.task._check(expanded)
+        except SystemExit as e:
+            return e.code
+        return 0
+
+    def test_unchanged(self):
+        self._write_snapshot()
+        self.assertEqual(self._check(self._expanded()), 0)
+        self.assertEqual(self.logged, ["No changes."])
+
+    def test_changed_revision(self):
+        self._write_snapshot()
+        expanded = self._expanded()
+        expanded['components'][1]['revision'] = 'e' * 40
+        self.assertEqual(self._check(expanded), task_resolve.CHECK_CHANGED_EXIT_CODE)
+        self.assertEqual(self.logged[0], "  bar: revision {0} -> {1}".format('c' * 40, 'e' * 40))
+        self.assertEqual(self.logged[1:], ["1 change(s) since the current snapshot"])
+
+    def test_changed_distgit_revision(self):
+        self._write_snapshot()
+        expanded = self._expanded()
+        expanded['components'][0]['distgit']['revision'] = 'f' * 40
+        self.assertEqual(self._check(expanded), task_resolve.CHECK_CHANGED_EXIT_CODE)
+        self.assertEqual(self.logged[0], "  foo: distgit revision {0} -> {1}".format('b' * 40, 'f' * 40))
+
+    def test_added_component(self):
+        self._write_snapshot()
+        expanded = self._expanded()
+        expanded['components'].append({'name': 'baz',
+                                       'src': 'https://example.com/baz.git',
+                                       'revision': '1' * 40})
+        self.assertEqual(self._check(expanded), task_resolve.CHECK_CHANGED_EXIT_CODE)
+        self.assertEqual(self.logged, ["  baz: new component",
+                                       "1 change(s) since the current snapshot"])
+
+    def test_removed_component(self):
+        self._write_snapshot()
+        expanded = self._expanded()
+        del expanded['components'][0]
+        self.assertEqual(self._check(expanded), task_resolve.CHECK_CHANGED_EXIT_CODE)
+        self.assertEqual(self.logged, ["  foo: removed",
+                                       "1 change(s) since the current snapshot"])
+
+    def test_missing_snapshot(self):
+        self.assertEqual(self._check(self._expanded()), task_resolve.CHECK_CHANGED_EXIT_CODE)
+        self.assertEqual(self.logged, ["No snapshot/snapshot.json yet"])
+
+if __name__ == '__main__':
+    unittest.main()
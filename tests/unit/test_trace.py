@@ -0,0 +1,66 @@
+#pylint: skip-file
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from rdgo import trace
+from rdgo.utils import run_sync
+
+class TestTrace(unittest.TestCase):
+    """
+    Unit tests for Chrome trace event output
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = self.tmpdir + '/trace.json'
+
+    def tearDown(self):
+        trace._events = None
+        shutil.rmtree(self.tmpdir)
+
+    def test_disabled(self):
+        self.assertFalse(trace.enabled())
+        with trace.span('nothing'):
+            pass
+        trace.write()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_spans(self):
+        trace.enable(self.path)
+        with trace.span('outer', component='foo'):
+            with trace.span('inner'):
+                run_sync(['true'], cwd=self.tmpdir)
+        def in_thread():
+            with trace.span('threaded'):
+                pass
+        t = threading.Thread(target=in_thread, name='worker')
+        t.start()
+        t.join()
+        # As if from a worker process
+        other = {'name': 'srcsnap', 'ph': 'X', 'ts': 0, 'dur': 1, 'pid': 1, 'tid': 1, 'args': {}}
+        trace.add_events([other])
+        trace.write()
+        with open(self.path) as f:
+            events = json.load(f)['traceEvents']
+        spans = dict((e['name'], e) for e in events if e['ph'] == 'X')
+        self.assertEqual(sorted(spans), ['inner', 'outer', 'srcsnap', 'threaded', 'true'])
+        self.assertEqual(spans['outer']['args'], {'component': 'foo'})
+        self.assertEqual(spans['true']['cat'], 'subprocess')
+        self.assertEqual(spans['true']['args'], {'argv': 'true', 'cwd': self.tmpdir})
+        # Nested spans lie within their parents
+        for (inner, outer) in [('true', 'inner'), ('inner', 'outer')]:
+            self.assertGreaterEqual(spans[inner]['ts'], spans[outer]['ts'])
+            self.assertLessEqual(spans[inner]['ts'] + spans[inner]['dur'],
+                                 spans[outer]['ts'] + spans[outer]['dur'])
+        self.assertNotEqual(spans['threaded']['tid'], spans['outer']['tid'])
+        names = dict((e['tid'], e['args']['name']) for e in events if e['ph'] == 'M')
+        self.assertEqual(names, {spans['outer']['tid']: threading.current_thread().name,
+                                 spans['threaded']['tid']: 'worker'})
+
+if __name__ == '__main__':
+    unittest.main()